@@ -1,41 +1,242 @@
-from flask import Flask, jsonify, request
+import os
+import time
+from hardware_executor import ASYNC_MODE, HardwareExecutor, patch
+# Green modes must be patched before flask and friends are imported.
+patch(ASYNC_MODE)
+
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
 from websocket_manager import WebSocketManager
 from joystick import JoystickController
-from scale import Scale
-# from battery import BatteryMonitor
+from scale import Scale, measure_sum
+from weight_broadcaster import WeightBroadcaster
+from drink_detector import DrinkDetector
+from coalesce import SingleFlight
+from history import encode_frame
+import metrics
+from battery import BatteryMonitor
 import json
 
 app = Flask(__name__)
 CORS(app)
-websocket = WebSocketManager()
+websocket = WebSocketManager(ASYNC_MODE)
 websocket.init_app(app)
 
-# Initialize hardware
-scale = Scale()
-# battery = BatteryMonitor()
-joystick = JoystickController(callback=websocket.emit_joystick)
+# Initialize hardware. Blocking hardware calls from request handlers go
+# through the single hardware thread, see hardware_executor.py.
+hardware = HardwareExecutor(ASYNC_MODE)
+# One Scale per load cell (HX711_DOUT_PINS); cell 0 drives the game.
+scales = Scale.create_cells()
+scale = scales[0]
+battery = BatteryMonitor(on_change=websocket.emit_battery)
+# RECORD_FILE records the session for replay (GPIO_BACKEND=replay), e.g.
+# RECORD_FILE=sessions/%Y%m%d-%H%M%S.hxr; strftime fields are filled in.
+recorder = None
+if os.environ.get('RECORD_FILE'):
+    from recording import Recorder
+    recorder = Recorder(time.strftime(os.environ['RECORD_FILE']))
+    scale.set_recorder(recorder)
+
+def on_joystick(direction):
+    if recorder is not None:
+        recorder.joystick(direction)
+    websocket.emit_joystick(direction)
+
+joystick = JoystickController(callback=on_joystick)
+weight_broadcaster = WeightBroadcaster(scale, websocket)
+# With several load cells, weight:<n> carries the updates of cell n alone.
+cell_broadcasters = []
+if len(scales) > 1:
+    for cell in scales:
+        room = websocket.cell_room(cell.cell)
+        websocket.allow_room(room)
+        cell_broadcasters.append(WeightBroadcaster(cell, websocket, room=room))
+drink_detector = DrinkDetector(on_event=websocket.emit_drink_event)
+scale.add_weight_listener(drink_detector.update)
+
+@app.before_request
+def before_request():
+    if metrics.ENABLED:
+        g.request_start = time.perf_counter()
+    if recorder is not None:
+        recorder.api({'method': request.method, 'path': request.path,
+                      'args': request.args.to_dict(),
+                      'body': request.get_json(silent=True)})
+
+@app.after_request
+def after_request(response):
+    start = g.get('request_start')
+    if start is not None:
+        # The route pattern, not the raw path, so labels stay bounded.
+        rule = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.HTTP_REQUESTS.observe(time.perf_counter() - start, rule)
+    return response
+
+def _sample_age():
+    latest = scale.sampler.latest()
+    return time.monotonic() - latest[1] if latest else None
+
+metrics.registry.callback('hx711_measured_sps', 'Conversions per second measured on DOUT.',
+                          lambda: scale.measured_sps)
+metrics.registry.callback('scale_sample_age_seconds', 'Age of the newest sample.', _sample_age)
+metrics.registry.callback('hx711_timing_violations_total',
+                          'Conversions discarded for breaking the PD_SCK timing contract.',
+                          lambda: scale.hx.timing_violations, type='counter')
+metrics.registry.callback('hx711_spikes_total',
+                          'Single-conversion spikes discarded by the delta check.',
+                          lambda: scale.hx.spikes, type='counter')
+metrics.registry.callback('hx711_glitch_rate', 'Fraction of conversions discarded.',
+                          lambda: scale.hx.glitch_rate)
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Concurrent identical requests share one measurement, and a result is
+# reused for a short freshness window (seconds).
+WEIGHT_FRESHNESS = 0.1
+TARE_FRESHNESS = 1.0
+single_flight = SingleFlight(event_factory=hardware.create_event)
+for _name in ('executed', 'coalesced', 'cached'):
+    metrics.registry.callback('coalesced_requests_%s_total' % _name,
+                              'Requests %s by the single-flight coalescer.' % _name,
+                              lambda key=_name: single_flight.stats()[key], type='counter')
+
+def _cell(value=0):
+    """The Scale of load cell `value`, as given by ?cell= or a JSON body."""
+    try:
+        index = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid load cell %r" % (value,))
+    if not 0 <= index < len(scales):
+        raise ValueError("No load cell %s, there are %d" % (value, len(scales)))
+    return scales[index]
+
+def _cells(value):
+    # 'sum' is every cell, added up.
+    return scales if value == 'sum' else [_cell(value)]
+
+def read_weight(cells=None):
+    total = 0
+    for cell in cells or [scale]:
+        weight = cell.latest_weight()
+        if weight is None:
+            # Only before the first sample, wait for it off the event loop.
+            weight = hardware.run(cell.get_cached_weight)
+        total += weight
+    return round(total, 1)
+
+def forget_weights():
+    for key in list(range(len(scales))) + ['sum']:
+        single_flight.forget(('weight', str(key)))
+
+def tare(cells=None):
+    for cell in cells or scales:
+        single_flight.do(('tare', cell.cell), hardware.run, cell.tare, freshness=TARE_FRESHNESS)
+    forget_weights()
 
 @app.route('/weight')
 def get_weight():
+    # ?cell=<n> reads one load cell, ?cell=sum all of them added up.
+    cell = request.args.get('cell', '0')
     try:
-        weight = scale.get_weight()
+        cells = _cells(cell)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        # ?resolution=<grams>&timeout=<seconds> asks for a fresh adaptive
+        # measurement instead of the cached filtered value.
+        if 'resolution' in request.args or 'timeout' in request.args:
+            resolution = request.args.get('resolution', scale.RESOLUTION, type=float)
+            timeout = request.args.get('timeout', scale.MEASURE_TIMEOUT, type=float)
+            measurement = single_flight.do(('measure', cell, resolution), hardware.run,
+                                           measure_sum, cells, resolution,
+                                           time.monotonic() + timeout,
+                                           freshness=WEIGHT_FRESHNESS)
+            return jsonify(measurement._asdict())
+        weight = single_flight.do(('weight', cell), read_weight, cells,
+                                  freshness=WEIGHT_FRESHNESS)
         return jsonify({'weight': weight})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Sample history after a cursor. The response's `cursor` is passed back as
+# `since` to get the next batch; format=binary returns a history.py frame.
+SAMPLES_DEFAULT_SECONDS = 10
+SAMPLES_LIMIT = 20000
+
+@app.route('/samples')
+def get_samples():
+    try:
+        scale = _cell(request.args.get('cell', 0))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    history = scale.sampler.history
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = max(0, history.count - int(SAMPLES_DEFAULT_SECONDS * scale.rate))
+    limit = min(request.args.get('limit', SAMPLES_LIMIT, type=int), SAMPLES_LIMIT)
+    start, counts, times, filtered = history.export(since, limit)
+    offset = scale.calibration['offset']
+    reference_unit = scale.calibration['reference_unit']
+
+    if request.args.get('format') == 'binary':
+        frame = encode_frame(start, counts, times, filtered, offset, reference_unit)
+        return Response(frame, mimetype='application/octet-stream')
+
+    t0 = times[0] if times else None
+    return jsonify({
+        'start': start,
+        'cursor': start + len(counts),
+        'dropped': max(0, start - max(since, 0)),
+        'offset': offset,
+        'reference_unit': reference_unit,
+        't0': t0,
+        # Seconds after t0, in microseconds to keep the JSON small.
+        'dt_us': [int((t - t0) * 1e6) for t in times],
+        'counts': counts.tolist(),
+        'filtered': [round(f, 1) for f in filtered],
+    })
+
+@app.route('/drink')
+def get_drink_status():
+    return jsonify(drink_detector.get_status())
+
+@app.route('/drink/reset', methods=['POST'])
+def reset_drink():
+    drink_detector.reset()
+    return jsonify({'success': True, 'message': 'Waiting for a vessel'})
+
+@app.route('/stats')
+def get_stats():
+    return jsonify({
+        'coalescing': single_flight.stats(),
+        'scale': {'rate': scale.rate, 'measured_sps': scale.measured_sps,
+                  'glitches': scale.glitch_stats(),
+                  'realtime': scale.sampler.realtime_status},
+        'cells': [cell.glitch_stats() for cell in scales],
+    })
+
 @app.route('/battery')
 def get_battery():
     try:
-        status = 1
+        status = battery.get_status()
+        if 'error' in status:
+            return jsonify(status), 503
         return jsonify(status)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/tare', methods=['POST'])
 def tare_scale():
+    # ?cell=<n> tares one load cell, by default all are tared.
+    cell = request.args.get('cell')
+    try:
+        cells = _cells(cell) if cell is not None else None
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     try:
-        scale.tare()
+        tare(cells)
         return jsonify({'success': True, 'message': 'Scale tared successfully'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -43,7 +244,11 @@ def tare_scale():
 @app.route('/reset', methods=['POST'])
 def reset_scale():
     try:
-        success = scale.reset_calibration()
+        scale = _cell(request.args.get('cell', 0))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    try:
+        success = hardware.run(scale.reset_calibration)
         if success:
             return jsonify({'success': True, 'message': 'Scale reset to factory defaults'})
         return jsonify({'success': False, 'message': 'Failed to reset scale'})
@@ -56,23 +261,33 @@ def calibrate():
         data = request.get_json()
         step = data.get('step')
         known_weight = data.get('known_weight', 100.0)
+        try:
+            scale = _cell(data.get('cell', 0))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         if step == 1:
-            scale.tare()
+            tare([scale])
             return jsonify({
                 'success': True,
                 'message': 'Zero point set. Please place the calibration weight.'
             })
         
         elif step == 2:
-            scale.calibrate_with_known_weight(known_weight)
+            # Waits for the sampler on this thread, so the hardware thread
+            # stays free for tare and reads while the weight settles.
+            report = single_flight.do(('calibrate', scale.cell, known_weight),
+                                      scale.calibrate_with_known_weight, known_weight,
+                                      sleep=hardware.green_sleep)
+            forget_weights()
             return jsonify({
                 'success': True,
-                'message': 'Scale calibrated. Please remove the weight.'
+                'message': 'Scale calibrated. Please remove the weight.',
+                'report': report
             })
         
         elif step == 3:
-            scale.tare()
+            tare([scale])
             return jsonify({
                 'success': True,
                 'message': 'Calibration complete!'
@@ -83,11 +298,73 @@ def calibrate():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Multi-point calibration: start, then record one point per known weight
+# (each call waits until that weight has settled on the scale), then fit.
+@app.route('/calibrate/start', methods=['POST'])
+def start_calibration():
+    data = request.get_json(silent=True) or {}
+    try:
+        scale = _cell(data.get('cell', 0))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    status = scale.start_calibration(quadratic=bool(data.get('quadratic', False)),
+                                     sleep=hardware.green_sleep)
+    return jsonify({'success': True, 'session': status})
+
+@app.route('/calibrate/point', methods=['POST'])
+def record_calibration_point():
+    try:
+        data = request.get_json()
+        known_weight = float(data['known_weight'])
+        timeout = float(data.get('timeout', 60.0))
+        try:
+            scale = _cell(data.get('cell', 0))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        point = single_flight.do(('calibrate_point', scale.cell, known_weight),
+                                 scale.record_calibration_point, known_weight, timeout)
+        return jsonify({'success': True, 'point': point})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/calibrate/fit', methods=['POST'])
+def fit_calibration():
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            scale = _cell(data.get('cell', 0))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        report = hardware.run(scale.finish_calibration, bool(data.get('apply', True)))
+        forget_weights()
+        return jsonify({'success': True, 'report': report})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/calibrate/session')
+def get_calibration_session():
+    try:
+        session = _cell(request.args.get('cell', 0)).calibration_session
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(session.get_status() if session else None)
+
 if __name__ == '__main__':
     try:
         joystick.start()
-        websocket.run(app)
+        battery.start()
+        weight_broadcaster.start()
+        for broadcaster in cell_broadcasters:
+            broadcaster.start()
+        websocket.run(app, port=int(os.environ.get('PORT', 5000)))
     finally:
-        scale.cleanup()
-        # battery.cleanup()
-        joystick.cleanup()
\ No newline at end of file
+        weight_broadcaster.stop()
+        for broadcaster in cell_broadcasters:
+            broadcaster.stop()
+        hardware.shutdown()
+        battery.cleanup()
+        joystick.cleanup()
+        if recorder is not None:
+            recorder.close()
+        # Last, it releases every pin of the shared GPIO backend.
+        Scale.cleanup_cells(scales)
\ No newline at end of file
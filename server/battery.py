@@ -1,70 +1,146 @@
-import struct
-import smbus
-import RPi.GPIO as GPIO
-from threading import Lock
+from threading import Lock, Thread, Event
+from gpio_backends import BOTH, default_backend, open_i2c_bus
 
 class BatteryMonitor:
+    """CW2015 fuel gauge and power-detect pin behind a cached status.
+
+    A background refresher reads VCELL and SOC in one I2C block transaction
+    every REFRESH_INTERVAL seconds, or right away when the power-detect pin
+    changes. get_status() only returns the cached dict, and `on_change` is
+    called with the new status whenever it differs from the previous one.
+
+    Without a reachable CW2015 the monitor is unavailable: get_status()
+    returns {'error': ...} and nothing is refreshed, so the server still
+    starts on boards without the fuel gauge.
+    """
     CW2015_ADDRESS = 0X62
     CW2015_REG_VCELL = 0X02
     CW2015_REG_SOC = 0X04
     CW2015_REG_MODE = 0X0A
     POWER_DETECT_PIN = 4
+    REFRESH_INTERVAL = 30.0  # Seconds
+    POWER_BOUNCETIME = 200   # Milliseconds
 
-    def __init__(self):
-        self._bus = smbus.SMBus(1)
+    def __init__(self, bus=None, gpio=None, on_change=None,
+                 refresh_interval=REFRESH_INTERVAL):
+        self._bus = bus
         self._lock = Lock()
-        
+        self.on_change = on_change
+        self.refresh_interval = refresh_interval
+        self._status = None
+        self._wake = Event()
+        self.stop_event = Event()
+        self.thread = None
+
         # Initialize GPIO
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-        GPIO.setup(self.POWER_DETECT_PIN, GPIO.IN)
-        
+        self.gpio = gpio if gpio is not None else default_backend()
+        self.gpio.setup_input(self.POWER_DETECT_PIN)
+
         # Initialize CW2015
-        self._quick_start()
+        self.error = None
+        try:
+            if self._bus is None:
+                self._bus = open_i2c_bus(1)
+            self._quick_start()
+        except Exception as e:
+            self.error = "Battery monitor unavailable: %s" % e
+            print(self.error)
+            self._status = {'error': self.error}
+            return
+        self.refresh()
+
+    @property
+    def available(self):
+        return self.error is None
 
     def _quick_start(self):
         """Wake up the CW2015 and initialize fuel-gauge calculations"""
         with self._lock:
             self._bus.write_word_data(self.CW2015_ADDRESS, self.CW2015_REG_MODE, 0x30)
 
-    def read_voltage(self):
-        """Read battery voltage"""
+    def _read_cells(self):
+        """Read (voltage, capacity) with one block read of VCELL and SOC.
+
+        Both registers are big endian: VCELL counts 305uV steps, SOC is the
+        percentage in its high byte and 1/256 % in its low byte.
+        """
         with self._lock:
             try:
-                read = self._bus.read_word_data(self.CW2015_ADDRESS, self.CW2015_REG_VCELL)
-                swapped = struct.unpack("<H", struct.pack(">H", read))[0]
-                return round(swapped * 0.305 / 1000, 2)
-            except:
-                return 0.0
+                vcell_hi, vcell_lo, soc_hi, soc_lo = self._bus.read_i2c_block_data(
+                    self.CW2015_ADDRESS, self.CW2015_REG_VCELL, 4)
+            except Exception as e:
+                print(f"Error reading battery: {e}")
+                return 0.0, 0
+        voltage = round(((vcell_hi << 8) | vcell_lo) * 0.305 / 1000, 2)
+        capacity = round(((soc_hi << 8) | soc_lo) / 256)
+        return voltage, capacity
+
+    def read_voltage(self):
+        """Read battery voltage"""
+        return self._read_cells()[0]
 
     def read_capacity(self):
         """Read battery capacity percentage"""
-        with self._lock:
-            try:
-                read = self._bus.read_word_data(self.CW2015_ADDRESS, self.CW2015_REG_SOC)
-                swapped = struct.unpack("<H", struct.pack(">H", read))[0]
-                return round(swapped / 256)
-            except:
-                return 0
+        return self._read_cells()[1]
 
     def is_power_plugged(self):
         """Check if power adapter is plugged in"""
-        return GPIO.input(self.POWER_DETECT_PIN) == GPIO.HIGH
+        return self.gpio.input(self.POWER_DETECT_PIN) == 1
 
-    def get_status(self):
-        """Get complete battery status"""
-        voltage = self.read_voltage()
-        capacity = self.read_capacity()
+    def refresh(self):
+        """Read the hardware, update the cached status and report changes."""
+        voltage, capacity = self._read_cells()
         is_plugged = self.is_power_plugged()
-        
-        return {
+        status = {
             'voltage': voltage,
             'capacity': capacity,
             'is_plugged': is_plugged,
             'is_low': capacity < 5,
             'is_full': capacity >= 100
         }
+        changed = status != self._status
+        self._status = status
+        if changed and self.on_change:
+            self.on_change(status)
+        return status
+
+    def get_status(self):
+        """Get complete battery status from the cache"""
+        return self._status
+
+    def _on_power_edge(self, pin):
+        self._wake.set()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+            if self.stop_event.is_set():
+                break
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing battery status: {e}")
+
+    def start(self):
+        if not self.available or (self.thread and self.thread.is_alive()):
+            return
+        self.stop_event.clear()
+        if self.gpio.supports_edge:
+            self.gpio.add_event_detect(self.POWER_DETECT_PIN, self._on_power_edge,
+                                       edge=BOTH, bouncetime=self.POWER_BOUNCETIME)
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self._wake.set()
+        if self.thread:
+            self.thread.join()
+        if self.available and self.gpio.supports_edge:
+            self.gpio.remove_event_detect(self.POWER_DETECT_PIN)
 
     def cleanup(self):
         """Cleanup GPIO resources"""
-        GPIO.cleanup(self.POWER_DETECT_PIN)
\ No newline at end of file
+        self.stop()
+        self.gpio.cleanup([self.POWER_DETECT_PIN])
@@ -0,0 +1,546 @@
+"""Benchmarks for the HX711 driver read paths.
+
+Run from the server directory, on the Pi or against the simulated chip:
+
+    python -m bench_hx711 --reads 50
+    GPIO_BACKEND=sim python -m bench_hx711 --json results.json
+    python -m bench_hx711 --backends rpi,gpiod,gpiomem
+
+Reports conversions per second and per-conversion clocking time of
+read_long(), the clocking time and conversions-per-second ceiling of the
+specialised reader against the old per-bit path, read_burst() throughput,
+p50/p99 latency of read_median, read_average, get_weight(n), tare and
+set_gain, readLock wait and hold times, how often PD_SCK stayed high longer
+than the datasheet's 60us and how many conversions the driver discarded as
+glitches. The 'spin', 'edge' and 'poll' ready-wait modes are compared for
+latency and CPU use. With --realtime the sampler's
+read loop is run twice on its own thread, with normal scheduling and then
+with SCHED_FIFO, CPU pinning and mlockall (see realtime.py), optionally
+while --load busy processes compete for the CPUs, and the glitch rate and
+conversion-interval jitter of both runs are compared. Channel B is timed
+through get_value_B() and, interleaved with channel A readers, through
+ChannelScheduler, counting the conversions each reading costs. With several --douts
+(HX711_DOUT_PINS) the shared-clock HX711Multi pass is timed against reading
+one chip. With --json the results are
+also written as JSON, tagged with the git commit and board, so runs can be
+compared across commits and boards.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import threading
+import time
+from array import array
+
+from gpio_backends import GPIO_BACKEND, create_backend
+from hx711 import HX711
+from hx711_multi import HX711Multi
+from channel_scheduler import ChannelScheduler
+import realtime
+
+PD_SCK_HIGH_LIMIT_NS = 60000
+WEIGHT_TIMES = (1, 3, 5, 10)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(durations, unit=1e3):
+    """p50/p99/mean of durations in seconds, scaled to ms by default."""
+    return {
+        'count': len(durations),
+        'mean': statistics.mean(durations) * unit,
+        'p50': percentile(durations, 50) * unit,
+        'p99': percentile(durations, 99) * unit,
+        'max': max(durations) * unit,
+    }
+
+
+class TimingBackend:
+    """Wraps a GPIO backend and times every PD_SCK high pulse.
+
+    The wrapper adds two perf_counter_ns() calls per clock edge, so the
+    numbers are a slight upper bound on what the unwrapped driver does.
+    """
+
+    def __init__(self, backend, pd_sck):
+        self._backend = backend
+        self.name = backend.name
+        self.supports_edge = backend.supports_edge
+        self.input = backend.input
+        self.pd_sck = pd_sck
+        self.pulses = 0
+        self.violations = 0
+        self.longest_high_ns = 0
+        self._high_since = None
+
+        raw_output = backend.output
+        perf_counter_ns = time.perf_counter_ns
+
+        def output(pin, value):
+            if pin != pd_sck:
+                raw_output(pin, value)
+                return
+            if value:
+                raw_output(pin, value)
+                self._high_since = perf_counter_ns()
+            else:
+                raw_output(pin, value)
+                if self._high_since is not None:
+                    high = perf_counter_ns() - self._high_since
+                    self._high_since = None
+                    self.pulses += 1
+                    if high > self.longest_high_ns:
+                        self.longest_high_ns = high
+                    if high > PD_SCK_HIGH_LIMIT_NS:
+                        self.violations += 1
+
+        self.output = output
+
+    def reset_counts(self):
+        self.pulses = 0
+        self.violations = 0
+        self.longest_high_ns = 0
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+
+class TimedLock:
+    """Drop-in for HX711.readLock that records wait and hold times."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waits = []
+        self.holds = []
+        self._acquired_at = 0.0
+
+    def acquire(self, *args, **kwargs):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(*args, **kwargs)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+            self.waits.append(self._acquired_at - start)
+        return acquired
+
+    def release(self):
+        self.holds.append(time.perf_counter() - self._acquired_at)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def reset(self):
+        self.waits = []
+        self.holds = []
+
+
+def timed_section(fn, reads):
+    """summarize(timed_calls(...)), or the error if the read path raises."""
+    try:
+        return summarize(timed_calls(fn, reads))
+    except Exception as e:
+        return {'error': "%s: %s" % (type(e).__name__, e)}
+
+
+def timed_calls(fn, reads):
+    durations = []
+    for _ in range(reads):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def wait_until_ready(hx):
+    while not hx.is_ready():
+        pass
+
+
+def bench_clocking(hx, reads):
+    durations = []
+    for _ in range(reads):
+        # Wait outside the timed region, so only the clocking is measured.
+        wait_until_ready(hx)
+        start = time.perf_counter()
+        hx.readRawBytes()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations, unit=1e6)
+
+
+def legacy_clock_in(hx, pulses):
+    """The per-bit readNextByte() path that _clock_in() replaced."""
+    data = [hx.readNextByte(), hx.readNextByte(), hx.readNextByte()]
+    for _ in range(pulses):
+        hx.readNextBit()
+    if hx.byte_format == 'LSB':
+        data.reverse()
+    return hx.convertFromTwosComplement24bit((data[0] << 16) | (data[1] << 8) | data[2])
+
+
+def bench_reader(hx, reads):
+    """Clocking time of the specialised reader against the per-bit path.
+
+    Both are timed the same way, with readLock held and the conversion
+    ready, and the ceiling is the conversions per second each could clock
+    if the chip converted instantly. read_burst() is timed end to end.
+    """
+    pulses = hx.PULSES[hx.get_gain()]
+    results = {}
+    for name, clock_in in (('legacy', lambda: legacy_clock_in(hx, pulses)),
+                           ('fast', lambda: hx._clock_in(pulses))):
+        durations = []
+        for _ in range(reads):
+            with hx.readLock:
+                hx.wait_ready()
+                start = time.perf_counter()
+                clock_in()
+                durations.append(time.perf_counter() - start)
+        result = summarize(durations, unit=1e6)
+        result['ceiling_sps'] = 1e6 / result['mean']
+        results[name] = result
+    results['speedup'] = results['legacy']['mean'] / results['fast']['mean']
+
+    out = array('i', bytes(4 * reads))
+    start = time.perf_counter()
+    hx.read_burst(reads, out)
+    results['read_burst_sps'] = reads / (time.perf_counter() - start)
+    return results
+
+
+def bench_driver(hx, timing, reads):
+    results = {}
+
+    start = time.perf_counter()
+    latencies = timed_calls(hx.read_long, reads)
+    results['read_long'] = summarize(latencies)
+    results['conversions_per_second'] = reads / (time.perf_counter() - start)
+    results['clocking_us'] = bench_clocking(hx, reads)
+    results['reader'] = bench_reader(hx, reads)
+
+    for times in (3, 4, 5):
+        results['read_median_%d' % times] = timed_section(
+            lambda: hx.read_median(times), max(3, reads // times))
+    for times in (5, 10):
+        results['read_average_%d' % times] = timed_section(
+            lambda: hx.read_average(times), max(3, reads // times))
+    for times in WEIGHT_TIMES:
+        results['get_weight_%d' % times] = timed_section(
+            lambda: hx.get_weight(times), max(3, reads // times))
+
+    offset = hx.get_offset()
+    results['tare_15'] = timed_section(lambda: hx.tare(15), 3)
+    hx.set_offset(offset)
+
+    for gain in (64, 32, 128):
+        results['set_gain_%d' % gain] = timed_section(lambda: hx.set_gain(gain), 3)
+
+    results['pd_sck'] = {
+        'pulses': timing.pulses,
+        'high_over_60us': timing.violations,
+        'violation_rate': timing.violations / timing.pulses if timing.pulses else 0.0,
+        'longest_high_us': timing.longest_high_ns / 1000.0,
+    }
+    results['read_lock'] = {
+        'wait_ms': summarize(hx.readLock.waits),
+        'hold_ms': summarize(hx.readLock.holds),
+    }
+    results['glitches'] = hx.glitch_stats()
+    results['channels'] = bench_channels(hx, reads)
+    return results
+
+
+def bench_wait_mode(backend, wait_mode, reads, dout, pd_sck):
+    hx = HX711(dout, pd_sck, wait_mode=wait_mode, backend=backend)
+    try:
+        hx.reset()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        latencies = timed_calls(hx.read_long, reads)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+    finally:
+        hx.close()
+
+    result = summarize(latencies)
+    result['cpu_percent'] = 100.0 * cpu / wall
+    return result
+
+
+def _spin(stop):
+    while not stop.is_set():
+        pass
+
+
+def sampling_run(backend, reads, dout, pd_sck, rt):
+    """read_timed() in a loop on a fresh thread, as the Sampler does."""
+    timing = TimingBackend(backend, pd_sck)
+    hx = HX711(dout, pd_sck, backend=timing)
+    result = {}
+    timestamps = []
+
+    def loop():
+        if rt:
+            result['realtime'] = realtime.make_realtime(cpu=realtime.choose_cpu())
+        hx.reset()
+        timing.reset_counts()
+        for _ in range(reads):
+            timestamps.append(hx.read_timed()[1])
+
+    thread = threading.Thread(target=loop)
+    try:
+        thread.start()
+        thread.join()
+    finally:
+        hx.close()
+
+    intervals = [b - a for a, b in zip(timestamps, timestamps[1:])]
+    expected = statistics.median(intervals)
+    result['interval_jitter_us'] = summarize([abs(i - expected) for i in intervals], unit=1e6)
+    result['glitches'] = hx.glitch_stats()
+    result['high_over_60us'] = timing.violations
+    result['longest_high_us'] = timing.longest_high_ns / 1000.0
+    return result
+
+
+def bench_realtime(backend, reads, dout, pd_sck, load):
+    """Normal vs real-time sampling, with `load` busy processes running."""
+    stop = multiprocessing.Event()
+    spinners = [multiprocessing.Process(target=_spin, args=(stop,), daemon=True)
+                for _ in range(load)]
+    for process in spinners:
+        process.start()
+    try:
+        # Real-time last: mlockall and the affinity of the main process
+        # would otherwise leak into the baseline.
+        return {mode: sampling_run(backend, reads, dout, pd_sck, mode == 'realtime')
+                for mode in ('normal', 'realtime')}
+    finally:
+        stop.set()
+        for process in spinners:
+            process.join()
+
+
+def bench_multi(backend, douts, pd_sck, reads):
+    """Clocking time of one HX711Multi pass over all cells."""
+    multi = HX711Multi(douts, pd_sck, backend=backend)
+    durations = []
+    try:
+        for _ in range(reads):
+            with multi.readLock:
+                multi.wait_ready()
+                start = time.perf_counter()
+                multi._clock_out()
+                durations.append(time.perf_counter() - start)
+    finally:
+        multi.close()
+    result = summarize(durations, unit=1e6)
+    result['cells'] = len(douts)
+    result['per_cell_mean'] = result['mean'] / len(douts)
+    return result
+
+
+def bench_channels(hx, reads):
+    """Conversions clocked per channel B reading, alone and interleaved with A."""
+    results = {}
+    hx.set_gain(128)
+    start = hx.conversions_read
+    results['get_value_B_1'] = timed_section(lambda: hx.get_value_B(1), reads // 2)
+    results['get_value_B_1']['conversions_per_read'] = (
+        (hx.conversions_read - start) / max(1, reads // 2))
+
+    scheduler = ChannelScheduler(hx)
+    start = hx.conversions_read
+    discarded = hx.discarded
+    latencies = {'A': [], 'B': []}
+
+    def reader(channel):
+        for _ in range(reads // 2):
+            begin = time.perf_counter()
+            scheduler.read(channel)
+            latencies[channel].append(time.perf_counter() - begin)
+
+    threads = [threading.Thread(target=reader, args=(channel,)) for channel in ('A', 'B')]
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+    stats = scheduler.stats()
+    delivered = sum(stats['delivered'].values())
+    results['interleaved'] = {
+        'conversions': hx.conversions_read - start,
+        'delivered': stats['delivered'],
+        'dropped': stats['dropped'],
+        'discarded': hx.discarded - discarded,
+        'deliveries_per_second': delivered / wall,
+        'latency_ms': {channel: summarize(values) for channel, values in latencies.items()},
+    }
+    return results
+
+
+def make_driver(backend, dout, pd_sck):
+    timing = TimingBackend(backend, pd_sck)
+    hx = HX711(dout, pd_sck, backend=timing)
+    hx.readLock = TimedLock()
+    hx.reset()
+    timing.reset_counts()
+    hx.readLock.reset()
+    return hx, timing
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def board():
+    try:
+        with open('/proc/device-tree/model') as f:
+            return f.read().strip('\0\n')
+    except OSError:
+        return platform.machine()
+
+
+def print_results(name, results):
+    print("== %s ==" % name)
+    print("  conversions/s      %8.2f" % results['conversions_per_second'])
+    clocking = results['clocking_us']
+    print("  clocking           mean %8.1fus  p50 %8.1fus  p99 %8.1fus"
+          % (clocking['mean'], clocking['p50'], clocking['p99']))
+    reader = results['reader']
+    for name in ('legacy', 'fast'):
+        print("  reader %-11s mean %8.1fus  p99 %8.1fus  ceiling %8.0f conversions/s"
+              % (name, reader[name]['mean'], reader[name]['p99'], reader[name]['ceiling_sps']))
+    print("  reader speedup     %8.2fx  read_burst %8.2f conversions/s"
+          % (reader['speedup'], reader['read_burst_sps']))
+    for key, value in results.items():
+        if not isinstance(value, dict) or key in ('clocking_us', 'multi_clocking_us'):
+            continue
+        if 'p99' in value:
+            print("  %-18s p50 %8.2fms  p99 %8.2fms" % (key, value['p50'], value['p99']))
+        elif 'error' in value:
+            print("  %-18s failed: %s" % (key, value['error']))
+    pd_sck = results['pd_sck']
+    print("  PD_SCK >60us       %d of %d pulses (longest %.1fus)"
+          % (pd_sck['high_over_60us'], pd_sck['pulses'], pd_sck['longest_high_us']))
+    glitches = results['glitches']
+    print("  glitches           %d timing, %d spikes in %d conversions (%.2f%%)"
+          % (glitches['timing_violations'], glitches['spikes'], glitches['conversions'],
+             100.0 * glitches['glitch_rate']))
+    lock = results['read_lock']
+    print("  readLock hold      p50 %8.2fms  p99 %8.2fms"
+          % (lock['hold_ms']['p50'], lock['hold_ms']['p99']))
+    for mode, result in results.get('wait_modes', {}).items():
+        if 'error' in result:
+            print("  wait %-13s failed: %s" % (mode, result['error']))
+            continue
+        print("  wait %-13s p50 %8.2fms  p99 %8.2fms  cpu %5.1f%%"
+              % (mode, result['p50'], result['p99'], result['cpu_percent']))
+    channels = results['channels']
+    channel_b = channels['get_value_B_1']
+    if 'error' not in channel_b:
+        print("  get_value_B(1)     p50 %8.2fms  p99 %8.2fms  %.2f conversions per reading"
+              % (channel_b['p50'], channel_b['p99'], channel_b['conversions_per_read']))
+    interleaved = channels['interleaved']
+    print("  A/B interleaved    %d conversions for %d A + %d B readings, %d discarded, %d dropped"
+          % (interleaved['conversions'], interleaved['delivered']['A'],
+             interleaved['delivered']['B'], interleaved['discarded'], interleaved['dropped']))
+    multi = results.get('multi_clocking_us')
+    if multi:
+        print("  multi x%-10d mean %8.1fus  p99 %8.1fus  per cell %8.1fus"
+              % (multi['cells'], multi['mean'], multi['p99'], multi['per_cell_mean']))
+    for mode, result in results.get('realtime', {}).items():
+        jitter = result['interval_jitter_us']
+        glitches = result['glitches']
+        print("  sched %-12s jitter p50 %8.1fus  p99 %8.1fus  max %8.1fus  glitches %.2f%%  >60us %d"
+              % (mode, jitter['p50'], jitter['p99'], jitter['max'],
+                 100.0 * glitches['glitch_rate'], result['high_over_60us']))
+        failed = {k: v for k, v in result.get('realtime', {}).items()
+                  if k in ('scheduler', 'affinity', 'mlock') and v != 'ok'}
+        for step, error in failed.items():
+            print("  %-18s not applied: %s" % (step, error))
+
+
+def run(backend_name, args):
+    backend = create_backend(backend_name)
+    try:
+        hx, timing = make_driver(backend, args.dout, args.pd_sck)
+        results = bench_driver(hx, timing, args.reads)
+        hx.close()
+
+        results['wait_modes'] = {}
+        for wait_mode in HX711.WAIT_MODES:
+            if wait_mode == HX711.WAIT_EDGE and not backend.supports_edge:
+                continue
+            try:
+                results['wait_modes'][wait_mode] = bench_wait_mode(
+                    backend, wait_mode, args.reads, args.dout, args.pd_sck)
+            except Exception as e:
+                results['wait_modes'][wait_mode] = {'error': "%s: %s" % (type(e).__name__, e)}
+
+        douts = [int(pin) for pin in args.douts.split(',')]
+        if len(douts) > 1:
+            results['multi_clocking_us'] = bench_multi(backend, douts, args.pd_sck, args.reads)
+
+        if args.realtime:
+            results['realtime'] = bench_realtime(backend, args.reads, args.dout,
+                                                 args.pd_sck, args.load)
+    finally:
+        backend.cleanup([args.pd_sck])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reads', type=int, default=50)
+    parser.add_argument('--dout', type=int, default=17)
+    parser.add_argument('--pd-sck', type=int, default=22)
+    parser.add_argument('--douts', default=os.environ.get('HX711_DOUT_PINS', '17'),
+                        help="comma separated DOUT pins sharing PD_SCK, for the HX711Multi pass")
+    parser.add_argument('--backends', default=GPIO_BACKEND,
+                        help="comma separated GPIO backends to run against (rpi, gpiod, gpiomem, sim)")
+    parser.add_argument('--realtime', action='store_true',
+                        help="compare normal and real-time scheduling of the sampling loop")
+    parser.add_argument('--load', type=int, default=0,
+                        help="busy processes competing for the CPUs during --realtime")
+    parser.add_argument('--json', help="write the results to this file as JSON")
+    args = parser.parse_args()
+
+    report = {
+        'commit': git_commit(),
+        'board': board(),
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'reads': args.reads,
+        'backends': {},
+    }
+    for name in filter(None, args.backends.split(',')):
+        results = run(name, args)
+        report['backends'][name] = results
+        print_results(name, results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Joystick latency from pin edge to joystick_event emit.
+
+Drives the simulated joystick pins and times each press from the falling
+edge to the controller's callback, which is where app.py emits
+joystick_event. Runs the controller with edge callbacks and with the
+polling fallback, and reports idle CPU use and hold-to-repeat timing:
+
+    python -m bench_joystick --presses 200 --json joystick.json
+
+The simulated backend runs edge callbacks inline on the thread that drives
+the pin, so edge latency here is the controller's own cost. On the Pi the
+backend's callback thread adds its wake-up time on top.
+"""
+import argparse
+import json
+import time
+
+from bench_hx711 import summarize
+from joystick import JoystickController
+from simulation import SimulatedGPIOBackend
+
+
+class Recorder:
+    """Joystick callback that timestamps every emit."""
+
+    def __init__(self):
+        self.emits = []
+
+    def __call__(self, direction):
+        self.emits.append((time.perf_counter(), direction))
+
+
+def bench_latency(use_edges, presses, hold):
+    backend = SimulatedGPIOBackend()
+    recorder = Recorder()
+    joystick = JoystickController(callback=recorder, gpio=backend, use_edges=use_edges)
+    joystick.start()
+    pins = list(JoystickController.JOYSTICK.values())
+    gap = JoystickController.DEBOUNCE + 0.01
+    latencies = []
+    missed = 0
+    try:
+        for i in range(presses):
+            pin = pins[i % len(pins)]
+            seen = len(recorder.emits)
+            start = time.perf_counter()
+            backend.set_input(pin, 0)
+            deadline = start + 1.0
+            while len(recorder.emits) == seen and time.perf_counter() < deadline:
+                time.sleep(0.0001)
+            if len(recorder.emits) > seen:
+                latencies.append(recorder.emits[seen][0] - start)
+            else:
+                missed += 1
+            time.sleep(hold)
+            backend.set_input(pin, 1)
+            time.sleep(gap)
+    finally:
+        joystick.stop()
+    result = summarize(latencies) if latencies else {}
+    result['missed'] = missed
+    return result
+
+
+def bench_idle_cpu(use_edges, duration):
+    backend = SimulatedGPIOBackend()
+    joystick = JoystickController(gpio=backend, use_edges=use_edges)
+    joystick.start()
+    try:
+        cpu = time.process_time()
+        time.sleep(duration)
+        cpu = time.process_time() - cpu
+    finally:
+        joystick.stop()
+    return 100.0 * cpu / duration
+
+
+def bench_repeat(hold):
+    """Emit times, relative to the press, while one direction is held."""
+    backend = SimulatedGPIOBackend()
+    recorder = Recorder()
+    joystick = JoystickController(callback=recorder, gpio=backend)
+    joystick.start()
+    pin = JoystickController.JOYSTICK['down']
+    try:
+        start = time.perf_counter()
+        backend.set_input(pin, 0)
+        time.sleep(hold)
+        backend.set_input(pin, 1)
+    finally:
+        joystick.stop()
+    return [round((t - start) * 1e3, 1) for t, _ in recorder.emits]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--presses', type=int, default=100)
+    parser.add_argument('--hold', type=float, default=0.02,
+                        help="seconds each press is held, below REPEAT_DELAY")
+    parser.add_argument('--idle', type=float, default=2.0,
+                        help="seconds to measure idle CPU use for")
+    parser.add_argument('--repeat-hold', type=float, default=2.0)
+    parser.add_argument('--json', help="write the results to this file as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for mode, use_edges in (('edge', True), ('poll', False)):
+        result = bench_latency(use_edges, args.presses, args.hold)
+        result['idle_cpu_percent'] = bench_idle_cpu(use_edges, args.idle)
+        results[mode] = result
+        print("%-5s p50 %8.3fms  p99 %8.3fms  missed %d  idle cpu %5.2f%%"
+              % (mode, result.get('p50', float('nan')), result.get('p99', float('nan')),
+                 result['missed'], result['idle_cpu_percent']))
+
+    results['repeat_ms'] = bench_repeat(args.repeat_hold)
+    print("repeat emits (ms after press): %s" % ', '.join('%g' % t for t in results['repeat_ms']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
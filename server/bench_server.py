@@ -0,0 +1,135 @@
+"""Joystick event latency while clients hammer /weight.
+
+Starts app.py against the simulated hardware in the requested ASYNC_MODE,
+with the simulated joystick pressed every --press-interval seconds. A
+Socket.IO client records the delay between each joystick_event's server
+timestamp and its arrival, first with no HTTP load and then while
+--clients processes request /weight back to back. Needs the client extras:
+
+    pip install "python-socketio[client]" requests
+    python -m bench_server --modes threading,eventlet --clients 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+from bench_hx711 import summarize
+
+JOYSTICK_PINS = '6,19'  # up, down; alternating so every press is a new direction
+
+
+def wait_for_server(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url + '/weight', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server at %s did not come up" % url)
+
+
+def hammer(url, stop, counts):
+    # A process of its own, so the load does not hold the GIL of the
+    # Socket.IO client measuring the latencies.
+    n = 0
+    while not stop.is_set():
+        try:
+            urllib.request.urlopen(url + '/weight', timeout=5).read()
+            n += 1
+        except OSError:
+            pass
+    counts.put(n)
+
+
+def collect_latencies(client, duration):
+    latencies = []
+
+    def on_joystick(data):
+        latencies.append(time.time() - data['timestamp'])
+
+    client.on('joystick_event', on_joystick)
+    time.sleep(duration)
+    client.on('joystick_event', lambda data: None)
+    return latencies
+
+
+def bench_mode(mode, args):
+    import socketio
+
+    port = args.port
+    url = 'http://127.0.0.1:%d' % port
+    env = dict(os.environ, GPIO_BACKEND='sim', ASYNC_MODE=mode, PORT=str(port),
+               SIM_PRESS_PINS=JOYSTICK_PINS, SIM_PRESS_INTERVAL=str(args.press_interval))
+    server = subprocess.Popen([sys.executable, 'app.py'], env=env,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(url)
+        client = socketio.Client()
+        client.connect(url)
+
+        idle = collect_latencies(client, args.duration)
+
+        stop = multiprocessing.Event()
+        counts = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=hammer, args=(url, stop, counts))
+                   for _ in range(args.clients)]
+        for worker in workers:
+            worker.start()
+        start = time.perf_counter()
+        loaded = collect_latencies(client, args.duration)
+        stop.set()
+        total = sum(counts.get() for _ in workers)
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        client.disconnect()
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'idle_ms': summarize(idle) if idle else None,
+        'loaded_ms': summarize(loaded) if loaded else None,
+        'weight_requests_per_second': total / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default='threading')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--press-interval', type=float, default=0.5)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--json', help="write the results to this file as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes.split(','):
+        result = bench_mode(mode, args)
+        results[mode] = result
+        for phase in ('idle_ms', 'loaded_ms'):
+            stats = result[phase]
+            if stats is None:
+                print("%-10s %-6s no joystick events received" % (mode, phase[:-3]))
+                continue
+            print("%-10s %-6s p50 %7.2fms  p99 %7.2fms  (%d events)"
+                  % (mode, phase[:-3], stats['p50'], stats['p99'], stats['count']))
+        print("%-10s /weight %.0f req/s with %d clients"
+              % (mode, result['weight_requests_per_second'], args.clients))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
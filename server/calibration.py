@@ -0,0 +1,179 @@
+"""Multi-point least-squares calibration.
+
+A CalibrationSession records one averaged raw-count plateau per known
+weight from the sampler's stream and fits
+
+    weight = x + quadratic * x**2,  x = (raw - offset) / reference_unit
+
+to all of them with NumPy least squares. The quadratic term is optional and
+needs at least three distinct weights. Each recorded plateau is detected
+automatically: the session waits until the raw stream is steady for
+SETTLE_SAMPLES samples, then averages PLATEAU_SAMPLES more and keeps them
+only if they stayed steady throughout. With `require_change` a new point
+must also differ from the points already recorded, so an operator can swap
+weights and just call record_point() again.
+"""
+import time
+
+import numpy as np
+
+from filters import MAD_TO_SIGMA
+
+
+class CalibrationError(Exception):
+    pass
+
+
+def _robust_stats(counts):
+    """Median and MAD-based sigma of an array of raw counts."""
+    median = float(np.median(counts))
+    sigma = float(np.median(np.abs(counts - median))) * MAD_TO_SIGMA
+    return median, sigma
+
+
+def is_steady(counts, tolerance):
+    """True if the noise and the drift between both halves stay within tolerance."""
+    counts = np.asarray(counts, dtype=np.float64)
+    half = len(counts) // 2
+    _, sigma = _robust_stats(counts)
+    drift = abs(float(np.median(counts[:half])) - float(np.median(counts[half:])))
+    return sigma <= tolerance and drift <= tolerance
+
+
+def fit_calibration(points, quadratic=False):
+    """Fit offset, reference unit and optionally a quadratic term.
+
+    `points` are (known weight in grams, mean raw counts) pairs. Returns the
+    calibration dict together with per-point residuals in grams.
+    """
+    weights = np.array([w for w, _ in points], dtype=np.float64)
+    counts = np.array([c for _, c in points], dtype=np.float64)
+    distinct = len(np.unique(weights))
+    needed = 3 if quadratic else 2
+    if distinct < needed:
+        raise CalibrationError("Need at least %d different weights, got %d" % (needed, distinct))
+
+    # Fit in centred and scaled counts; raw counts near 2**23 squared are
+    # badly conditioned otherwise.
+    center = counts.mean()
+    scale = max(float(np.ptp(counts)), 1.0)
+    u = (counts - center) / scale
+    columns = [np.ones_like(u), u] + ([u * u] if quadratic else [])
+    beta, _, rank, _ = np.linalg.lstsq(np.column_stack(columns), weights, rcond=None)
+    if rank < len(columns):
+        raise CalibrationError("Calibration points do not determine the fit")
+
+    # weight = a + b*d + k*d**2 with d = raw - center
+    a = beta[0]
+    b = beta[1] / scale
+    k = beta[2] / scale ** 2 if quadratic else 0.0
+
+    # The offset is the zero crossing closest to the lightest point, and the
+    # reference unit the slope there.
+    nearest = counts[np.argmin(weights)] - center
+    if k == 0.0:
+        if b == 0.0:
+            raise CalibrationError("Calibration points have no slope")
+        d0 = -a / b
+    else:
+        roots = np.roots([k, b, a])
+        roots = roots[np.isreal(roots)].real
+        if not len(roots):
+            raise CalibrationError("Quadratic fit has no zero point")
+        d0 = roots[np.argmin(np.abs(roots - nearest))]
+    slope = b + 2 * k * d0
+    reference_unit = 1.0 / slope
+    calibration = {
+        'reference_unit': float(reference_unit),
+        'offset': float(center + d0),
+        'quadratic': float(k * reference_unit ** 2),
+    }
+
+    predicted = np.column_stack(columns) @ beta
+    residuals = predicted - weights
+    return calibration, {
+        'residuals': [round(float(r), 3) for r in residuals],
+        'rms': float(np.sqrt(np.mean(residuals ** 2))),
+        'max_error': float(np.max(np.abs(residuals))),
+    }
+
+
+class CalibrationSession:
+    SETTLE_SAMPLES = 10
+    PLATEAU_SAMPLES = 40
+    TOLERANCE = 400.0     # Counts of noise or drift still counted as settled
+    MIN_CHANGE = 2000.0   # Counts a new weight must differ from earlier points
+    POINT_TIMEOUT = 60.0  # Seconds
+
+    def __init__(self, sampler, quadratic=False, settle_samples=SETTLE_SAMPLES,
+                 plateau_samples=PLATEAU_SAMPLES, tolerance=TOLERANCE,
+                 min_change=MIN_CHANGE, sleep=None):
+        self.sampler = sampler
+        # Passed on to sampler.wait_for_samples(), so a green request thread
+        # can wait for the plateau without blocking the hub.
+        self.sleep = sleep
+        self.quadratic = quadratic
+        self.settle_samples = settle_samples
+        self.plateau_samples = plateau_samples
+        self.tolerance = tolerance
+        self.min_change = min_change
+        self.points = []
+
+    def _is_new(self, known_weight, counts):
+        return all(abs(counts - point['counts']) > self.min_change
+                   for point in self.points if point['weight'] != known_weight)
+
+    def wait_for_plateau(self, known_weight=None, timeout=POINT_TIMEOUT, require_change=True):
+        """Block until the load has settled and return its averaged plateau."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Scale did not settle within %.0f s" % timeout)
+            self.sampler.wait_for_samples(1, timeout=remaining, sleep=self.sleep)
+            settle = np.array([v for v, _ in self.sampler.recent(self.settle_samples)],
+                              dtype=np.float64)
+            if len(settle) < self.settle_samples or not is_steady(settle, self.tolerance):
+                continue
+            if require_change and not self._is_new(known_weight, float(np.median(settle))):
+                continue
+
+            samples = self.sampler.wait_for_samples(
+                self.plateau_samples, timeout=max(0.0, deadline - time.monotonic()),
+                sleep=self.sleep)
+            counts = np.array([v for v, _ in samples], dtype=np.float64)
+            if not is_steady(np.concatenate((settle, counts)), self.tolerance):
+                continue
+            median, sigma = _robust_stats(counts)
+            # Mean of the samples within 3 sigma, so a stray spike cannot
+            # shift the plateau.
+            kept = counts[np.abs(counts - median) <= 3 * max(sigma, 1.0)]
+            return {
+                'weight': known_weight,
+                'counts': float(kept.mean()),
+                'sigma': sigma,
+                'samples': int(len(kept)),
+                'stderr': sigma / float(np.sqrt(len(kept))),
+            }
+
+    def record_point(self, known_weight, timeout=POINT_TIMEOUT, require_change=True):
+        point = self.wait_for_plateau(known_weight, timeout, require_change)
+        self.points.append(point)
+        return point
+
+    def add_point(self, known_weight, counts):
+        """Add a point measured elsewhere, e.g. the current tare offset as 0 g."""
+        point = {'weight': known_weight, 'counts': float(counts), 'sigma': None,
+                 'samples': 0, 'stderr': None}
+        self.points.append(point)
+        return point
+
+    def fit(self):
+        return fit_calibration([(p['weight'], p['counts']) for p in self.points],
+                               quadratic=self.quadratic)
+
+    def get_status(self):
+        return {
+            'quadratic': self.quadratic,
+            'points': self.points,
+        }
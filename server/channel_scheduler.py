@@ -0,0 +1,122 @@
+"""Interleaved channel A and B reads on one HX711.
+
+The HX711 converts one channel at a time, and the trailing PD_SCK pulses of
+every readout pick the channel and gain of the *next* conversion. Switching
+with set_gain() therefore throws a conversion away, twice per B reading if
+channel A is used in between. ChannelScheduler picks the trailing pulses of
+each readout from the requests that are waiting instead: while both
+channels have readers it alternates A, B, A, B, and every conversion goes
+to the stream of the channel it was taken on, so none is read only to be
+discarded.
+
+    scheduler = ChannelScheduler(hx)
+    value, timestamp = scheduler.read('A')   # from any thread
+    value, timestamp = scheduler.read('B')
+
+The scheduler has to be the only reader of the chip; a read_timed() in
+between costs a switch conversion whenever the chip was left on the other
+channel.
+"""
+import threading
+import time
+from collections import deque
+
+from hx711 import SensorNotReadyError
+
+
+class ChannelScheduler:
+    CHANNELS = ('A', 'B')
+    STREAM_SIZE = 16  # Conversions kept per channel until somebody reads them
+    MAX_AGE = 0.5  # Seconds after which a kept conversion is too old to hand out
+    MAX_READS = 8  # Readouts one read() may clock before giving up
+
+    def __init__(self, hx, gain_a=128):
+        if gain_a not in (128, 64):
+            raise ValueError("Channel A gain must be 128 or 64, got %r" % gain_a)
+        self.hx = hx
+        self.gains = {'A': gain_a, 'B': 32}
+        self._channels = {gain: channel for channel, gain in self.gains.items()}
+        self._streams = {channel: deque(maxlen=self.STREAM_SIZE) for channel in self.CHANNELS}
+        # read() calls per channel that have not returned yet. Counted
+        # outside _lock, so the reader clocking the chip sees who is queued
+        # behind it.
+        self._waiting = {channel: 0 for channel in self.CHANNELS}
+        self._count_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._last = 'A'
+        self.delivered = {channel: 0 for channel in self.CHANNELS}
+        self.dropped = 0
+
+    def read(self, channel):
+        """The next conversion of `channel` ('A' or 'B') as (value, timestamp)."""
+        if channel not in self._streams:
+            raise ValueError("Unknown HX711 channel: %r" % channel)
+        stream = self._streams[channel]
+        with self._count_lock:
+            self._waiting[channel] += 1
+        try:
+            with self._lock:
+                self._last = channel
+                for _ in range(self.MAX_READS):
+                    sample = self._take(stream)
+                    if sample is not None:
+                        self.delivered[channel] += 1
+                        return sample
+                    self._read_one()
+                sample = self._take(stream)
+                if sample is None:
+                    raise SensorNotReadyError(
+                        "No channel %s conversion in %d readouts" % (channel, self.MAX_READS))
+                self.delivered[channel] += 1
+                return sample
+        finally:
+            with self._count_lock:
+                self._waiting[channel] -= 1
+
+    def _take(self, stream):
+        stale = time.monotonic() - self.MAX_AGE
+        while stream and stream[0][1] < stale:
+            stream.popleft()
+        return stream.popleft() if stream else None
+
+    def _read_one(self):
+        # Called with _lock held: read the pending conversion and select the
+        # channel of the one after it.
+        current = self._channels.get(self.hx.pending_gain)
+        next_channel = self._choose_next(current)
+        value, timestamp, gain = self.hx.read_next(self.gains[next_channel])
+        channel = self._channels.get(gain)
+        if channel is None:
+            # Broke the timing contract, or the chip came up at a gain
+            # neither channel uses.
+            self.dropped += 1
+            return
+        self._streams[channel].append((value, timestamp))
+
+    def _choose_next(self, current):
+        with self._count_lock:
+            # Conversions still owed to each channel once the one being read
+            # now is in its stream.
+            owed = {channel: self._waiting[channel] - len(self._streams[channel])
+                    - (channel == current)
+                    for channel in self.CHANNELS}
+        if current is not None:
+            other = 'B' if current == 'A' else 'A'
+            if owed[other] > 0:
+                return other
+            if owed[current] > 0:
+                return current
+        for channel in self.CHANNELS:
+            if owed[channel] > 0:
+                return channel
+        # Nobody else is waiting: stay ready for whoever asked last.
+        return self._last
+
+    def stats(self):
+        return {
+            'gains': dict(self.gains),
+            'delivered': dict(self.delivered),
+            'dropped': self.dropped,
+            'discarded': self.hx.discarded,
+            'conversions': self.hx.conversions_read,
+        }
@@ -0,0 +1,101 @@
+import time
+from threading import Event, Lock
+
+
+class _Call:
+    def __init__(self, event):
+        self.event = event
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls into one execution.
+
+    Callers asking for the same key while a call is in flight wait for it and
+    share its result. A successful result is also reused for `freshness`
+    seconds. Counters show how many calls were executed, coalesced onto an
+    in-flight call or answered from the fresh result.
+
+    Keys may carry client-supplied values, so stored results are dropped
+    once older than the longest freshness asked for, and at most
+    MAX_RESULTS are kept.
+    """
+    MAX_RESULTS = 256
+
+    def __init__(self, freshness=0.0, event_factory=Event):
+        self.freshness = freshness
+        self._longest = freshness
+        # Must match the server's concurrency model: waiting on a real
+        # threading.Event would block an eventlet/gevent hub.
+        self.event_factory = event_factory
+        self._lock = Lock()
+        self._calls = {}
+        self._results = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.cached = 0
+
+    def do(self, key, fn, *args, freshness=None, **kwargs):
+        if freshness is None:
+            freshness = self.freshness
+        with self._lock:
+            if freshness > self._longest:
+                self._longest = freshness
+            cached = self._results.get(key)
+            if cached is not None and time.monotonic() - cached[0] <= freshness:
+                self.cached += 1
+                return cached[1]
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call(self.event_factory())
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None:
+                    now = time.monotonic()
+                    # Re-insert, so the results stay in the order stored.
+                    self._results.pop(key, None)
+                    self._results[key] = (now, call.result)
+                    self._prune(now)
+            call.event.set()
+        return call.result
+
+    def _prune(self, now):
+        # Called with _lock held. Oldest first, so stop at the first one
+        # that is still fresh.
+        results = self._results
+        while results:
+            key = next(iter(results))
+            if len(results) <= self.MAX_RESULTS and now - results[key][0] <= self._longest:
+                break
+            del results[key]
+
+    def forget(self, key):
+        """Drop a cached result, e.g. after a tare invalidated the weight."""
+        with self._lock:
+            self._results.pop(key, None)
+
+    def stats(self):
+        return {
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'cached': self.cached,
+        }
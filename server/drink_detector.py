@@ -0,0 +1,160 @@
+import time
+from collections import deque
+from threading import Lock
+
+
+class DrinkDetector:
+    """Event-driven drink detection over the live weight stream.
+
+    Tracks one round of the game:
+
+        idle -> placed -> tared -> lifted -> returned -> lifted -> ...
+
+    `placed` fires when a vessel heavier than MIN_VESSEL has been stable for
+    STABLE_TIME seconds. It is auto-tared straight away: that stable weight
+    becomes the baseline. `lifted` fires when the weight drops below half the
+    baseline, `returned` when the vessel is back and stable again, with the
+    amount drunk. The returned weight is the baseline for the next sip. A
+    vessel that comes back heavier than it left (a refill or a new glass)
+    is `placed` again, and one that stays off for MAX_LIFT_TIME seconds
+    ends in `idle`.
+
+    Weights come from Scale.add_weight_listener(), which is not shifted by
+    tare(). The detector also re-learns the empty-platform level while idle,
+    so drift and a stale calibration offset do not matter.
+    """
+    IDLE = 'idle'
+    PLACED = 'placed'
+    TARED = 'tared'
+    LIFTED = 'lifted'
+    RETURNED = 'returned'
+
+    MIN_VESSEL = 50.0       # Grams
+    STABLE_TOLERANCE = 1.0  # Grams, max spread of a stable window
+    STABLE_TIME = 0.5       # Seconds
+    MAX_LIFT_TIME = 120.0   # Seconds before a lifted vessel counts as gone
+    REFILL_MARGIN = 5.0     # Grams heavier than the baseline that count as a new vessel
+
+    def __init__(self, on_event=None, min_vessel=MIN_VESSEL,
+                 stable_tolerance=STABLE_TOLERANCE, stable_time=STABLE_TIME,
+                 max_lift_time=MAX_LIFT_TIME):
+        self.on_event = on_event
+        self.min_vessel = min_vessel
+        self.stable_tolerance = stable_tolerance
+        self.stable_time = stable_time
+        self.max_lift_time = max_lift_time
+
+        self._window = deque()
+        self.zero = None
+        # update() runs on the sampler thread, reset() and get_status() on
+        # request threads.
+        self._lock = Lock()
+        # Events of the current update(), passed to on_event once the lock
+        # is released.
+        self._events = []
+        self._reset()
+
+    def reset(self):
+        """Forget the current round and wait for a vessel again."""
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self.state = self.IDLE
+        self.baseline = None
+        self.lifted_at = None
+        self.result = None
+
+    def _stable_value(self, weight, timestamp):
+        """Mean of the window if the last STABLE_TIME seconds were stable."""
+        window = self._window
+        window.append((timestamp, weight))
+        # Drop the oldest sample only while the rest still span STABLE_TIME.
+        while len(window) > 1 and timestamp - window[1][0] >= self.stable_time:
+            window.popleft()
+        values = [w for _, w in window]
+        if (timestamp - window[0][0] < self.stable_time
+                or max(values) - min(values) > self.stable_tolerance):
+            return None
+        return sum(values) / len(values)
+
+    def _emit(self, state, timestamp, **data):
+        self.state = state
+        event = {
+            'state': state,
+            'timestamp': timestamp,
+            'time': time.time(),
+        }
+        event.update(data)
+        self._events.append(event)
+        return event
+
+    def update(self, weight, timestamp):
+        with self._lock:
+            self._update(weight, timestamp)
+            events, self._events = self._events, []
+        # Outside the lock: a slow emit must not stall the sampler's other
+        # listeners behind it, and on_event may read the detector.
+        if self.on_event:
+            for event in events:
+                self.on_event(event)
+
+    def _update(self, weight, timestamp):
+        stable = self._stable_value(weight, timestamp)
+
+        if self.zero is None:
+            if stable is None:
+                return
+            # Assume the platform is empty at start-up unless it reads heavy.
+            self.zero = stable if abs(stable) < self.min_vessel else 0.0
+
+        load = weight - self.zero
+        stable_load = stable - self.zero if stable is not None else None
+
+        if self.state == self.IDLE:
+            if stable_load is None:
+                return
+            if stable_load < self.min_vessel:
+                # Track slow drift of the empty platform.
+                self.zero = stable
+                return
+            self._emit(self.PLACED, timestamp, weight=round(stable_load, 1))
+            self.baseline = stable_load
+            self._emit(self.TARED, timestamp, baseline=round(stable_load, 1))
+
+        elif self.state in (self.TARED, self.RETURNED):
+            if load < self.baseline / 2:
+                self.lifted_at = timestamp
+                self._emit(self.LIFTED, timestamp, weight=round(load, 1),
+                           baseline=round(self.baseline, 1))
+            elif (self.state == self.TARED and stable_load is not None
+                    and abs(stable_load - self.baseline) > self.stable_tolerance):
+                # Settled at a slightly different weight, e.g. the glass was
+                # nudged or topped up before drinking.
+                self.baseline = stable_load
+                self._emit(self.TARED, timestamp, baseline=round(stable_load, 1))
+
+        elif self.state == self.LIFTED:
+            if stable_load is not None and stable_load >= self.min_vessel:
+                if stable_load > self.baseline + self.REFILL_MARGIN:
+                    self._emit(self.PLACED, timestamp, weight=round(stable_load, 1))
+                    self.baseline = stable_load
+                    self._emit(self.TARED, timestamp, baseline=round(stable_load, 1))
+                    return
+                drunk = self.baseline - stable_load
+                self.result = drunk
+                self._emit(self.RETURNED, timestamp, weight=round(stable_load, 1),
+                           baseline=round(self.baseline, 1), drunk=round(drunk, 1),
+                           duration=round(timestamp - self.lifted_at, 2))
+                self.baseline = stable_load
+            elif timestamp - self.lifted_at > self.max_lift_time:
+                self._reset()
+                self._emit(self.IDLE, timestamp, reason='timeout')
+
+    def get_status(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'baseline': self.baseline,
+                'result': self.result,
+            }
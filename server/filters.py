@@ -0,0 +1,214 @@
+"""Per-sample filters for the continuous HX711 sample stream.
+
+Every filter takes one sample at a time through update(value), which returns
+the current estimate, and keeps that estimate in `value` so it can be read
+again without sampling. Filters can be chained with FilterChain; the output of
+one is the input of the next.
+
+Sliding-window filters keep their window in a sorted list, so an update is a
+binary search plus a list insert/remove. Windows here are a few dozen samples
+at most, where that beats heap-based structures in CPython.
+"""
+import bisect
+import math
+from collections import deque
+
+# Scales the median absolute deviation to a standard deviation for normal noise.
+MAD_TO_SIGMA = 1.4826
+
+
+class SortedWindow:
+    """The last `size` samples, kept both in arrival order and sorted."""
+
+    def __init__(self, size):
+        if size <= 0:
+            raise ValueError("Window size must be at least 1")
+        self.size = size
+        self._fifo = deque()
+        self.sorted = []
+
+    def __len__(self):
+        return len(self._fifo)
+
+    def push(self, value):
+        if len(self._fifo) == self.size:
+            old = self._fifo.popleft()
+            del self.sorted[bisect.bisect_left(self.sorted, old)]
+        self._fifo.append(value)
+        bisect.insort(self.sorted, value)
+
+    def median(self):
+        ordered = self.sorted
+        n = len(ordered)
+        if n & 1:
+            return ordered[n // 2]
+        return (ordered[n // 2 - 1] + ordered[n // 2]) / 2.0
+
+    def clear(self):
+        self._fifo.clear()
+        self.sorted = []
+
+
+class RunningMedian:
+    def __init__(self, window=5):
+        self._window = SortedWindow(window)
+        self.value = None
+
+    def update(self, value):
+        self._window.push(value)
+        self.value = self._window.median()
+        return self.value
+
+    def reset(self):
+        self._window.clear()
+        self.value = None
+
+
+class TrimmedMean:
+    """Mean of the window after dropping `trim` of the samples at each end."""
+
+    def __init__(self, window=10, trim=0.2):
+        if not 0 <= trim < 0.5:
+            raise ValueError("trim must be in [0, 0.5)")
+        self._window = SortedWindow(window)
+        self.trim = trim
+        self.value = None
+
+    def update(self, value):
+        self._window.push(value)
+        ordered = self._window.sorted
+        k = int(len(ordered) * self.trim)
+        kept = ordered[k:len(ordered) - k]
+        self.value = sum(kept) / len(kept)
+        return self.value
+
+    def reset(self):
+        self._window.clear()
+        self.value = None
+
+
+class EMA:
+    """Exponential moving average, alpha = 2 / (span + 1) unless given."""
+
+    def __init__(self, alpha=None, span=5):
+        self.alpha = alpha if alpha is not None else 2.0 / (span + 1)
+        self.value = None
+
+    def update(self, value):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class Hampel:
+    """Spike rejector.
+
+    A sample further than `n_sigmas` robust standard deviations (from the
+    median absolute deviation) away from the median of the previous samples
+    is replaced by that median. `min_deviation` keeps a perfectly quiet window
+    from rejecting every tiny change.
+    """
+
+    def __init__(self, window=7, n_sigmas=3.0, min_deviation=0.0):
+        self._window = SortedWindow(window)
+        self.n_sigmas = n_sigmas
+        self.min_deviation = min_deviation
+        self.rejected = 0
+        self.value = None
+
+    def update(self, value):
+        window = self._window
+        if len(window) >= 3:
+            median = window.median()
+            mad = sorted(abs(x - median) for x in window.sorted)[len(window) // 2]
+            limit = max(self.n_sigmas * MAD_TO_SIGMA * mad, self.min_deviation)
+            if abs(value - median) > limit:
+                self.rejected += 1
+                # Still remember the sample, so a real step is accepted once
+                # it fills half the window.
+                window.push(value)
+                self.value = median
+                return self.value
+        window.push(value)
+        self.value = value
+        return self.value
+
+    def reset(self):
+        self._window.clear()
+        self.value = None
+
+
+class Kalman1D:
+    """Constant-value Kalman filter.
+
+    `process_variance` is how much the true value may wander per sample,
+    `measurement_variance` the sensor noise, both in squared input units.
+    """
+
+    def __init__(self, process_variance=1.0, measurement_variance=100.0):
+        self.process_variance = process_variance
+        self.measurement_variance = measurement_variance
+        self.value = None
+        self.variance = None
+
+    def update(self, value):
+        if self.value is None:
+            self.value = value
+            self.variance = self.measurement_variance
+            return self.value
+        variance = self.variance + self.process_variance
+        gain = variance / (variance + self.measurement_variance)
+        self.value += gain * (value - self.value)
+        self.variance = (1 - gain) * variance
+        return self.value
+
+    @property
+    def standard_error(self):
+        return math.sqrt(self.variance) if self.variance is not None else None
+
+    def reset(self):
+        self.value = None
+        self.variance = None
+
+
+class FilterChain:
+    def __init__(self, *filters):
+        self.filters = list(filters)
+        self.value = None
+
+    def update(self, value):
+        for f in self.filters:
+            value = f.update(value)
+        self.value = value
+        return value
+
+    def reset(self):
+        for f in self.filters:
+            f.reset()
+        self.value = None
+
+
+FILTERS = {
+    'median': RunningMedian,
+    'trimmed_mean': TrimmedMean,
+    'ema': EMA,
+    'hampel': Hampel,
+    'kalman': Kalman1D,
+}
+
+
+def build_chain(spec):
+    """Build a FilterChain from a list like [{'type': 'hampel', 'window': 7}, ...]."""
+    filters = []
+    for entry in spec:
+        options = dict(entry)
+        kind = options.pop('type')
+        if kind not in FILTERS:
+            raise ValueError("Unrecognised filter type: \"%s\"" % kind)
+        filters.append(FILTERS[kind](**options))
+    return FilterChain(*filters)
@@ -0,0 +1,293 @@
+"""GPIO backends for the bit-banged drivers.
+
+Every backend offers the same small interface:
+
+    setup_output(pin), setup_input(pin, pull_up=False)
+    output(pin, value), input(pin), read_levels(pins)
+    add_event_detect(pin, callback, edge=FALLING, bouncetime=None)
+    remove_event_detect(pin), cleanup(pins=None)
+
+`output` and `input` are plain attributes bound at construction time, so hot
+loops like HX711.readNextBit pay a single call per pin access.
+"""
+import mmap
+import os
+import threading
+import time
+
+FALLING = 'falling'
+RISING = 'rising'
+BOTH = 'both'
+
+# Selects the backend default_backend() builds: rpi, gpiod, gpiomem, sim
+# (simulated hardware, see simulation.py) or replay (a recorded session, see
+# recording.py).
+GPIO_BACKEND = os.environ.get('GPIO_BACKEND', 'rpi')
+
+
+class RPiGPIOBackend:
+    name = 'rpi'
+    supports_edge = True
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self._gpio = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        self._edges = {
+            FALLING: GPIO.FALLING,
+            RISING: GPIO.RISING,
+            BOTH: GPIO.BOTH,
+        }
+        self.output = GPIO.output
+        self.input = GPIO.input
+
+    def setup_output(self, pin):
+        self._gpio.setup(pin, self._gpio.OUT)
+
+    def setup_input(self, pin, pull_up=False):
+        pull = self._gpio.PUD_UP if pull_up else self._gpio.PUD_OFF
+        self._gpio.setup(pin, self._gpio.IN, pull_up_down=pull)
+
+    def read_levels(self, pins):
+        return [self._gpio.input(pin) for pin in pins]
+
+    def add_event_detect(self, pin, callback, edge=FALLING, bouncetime=None):
+        kwargs = {'callback': callback}
+        if bouncetime:
+            kwargs['bouncetime'] = int(bouncetime)
+        self._gpio.add_event_detect(pin, self._edges[edge], **kwargs)
+
+    def remove_event_detect(self, pin):
+        self._gpio.remove_event_detect(pin)
+
+    def cleanup(self, pins=None):
+        if pins is None:
+            self._gpio.cleanup()
+        else:
+            self._gpio.cleanup(list(pins))
+
+
+class GpiodBackend:
+    """libgpiod (v1 Python bindings) through the GPIO character device."""
+    name = 'gpiod'
+    supports_edge = True
+    CONSUMER = 'pi_wiegen'
+    EVENT_POLL = 0.1  # Seconds between stop checks in the edge watcher
+
+    def __init__(self, chip='gpiochip0'):
+        import gpiod
+        self._gpiod = gpiod
+        self._chip = gpiod.Chip(chip)
+        self._lines = {}
+        self._pull_up = {}
+        self._watchers = {}
+        self.output = self._output
+        self.input = self._input
+
+    def _request(self, pin, **kwargs):
+        line = self._lines.pop(pin, None)
+        if line is not None:
+            line.release()
+        line = self._chip.get_line(pin)
+        line.request(consumer=self.CONSUMER, **kwargs)
+        self._lines[pin] = line
+        return line
+
+    def setup_output(self, pin):
+        self._request(pin, type=self._gpiod.LINE_REQ_DIR_OUT, default_vals=[0])
+
+    def setup_input(self, pin, pull_up=False):
+        self._pull_up[pin] = pull_up
+        self._request(pin, type=self._gpiod.LINE_REQ_DIR_IN, flags=self._flags(pin))
+
+    def _flags(self, pin):
+        return self._gpiod.LINE_REQ_FLAG_BIAS_PULL_UP if self._pull_up.get(pin) else 0
+
+    def _output(self, pin, value):
+        self._lines[pin].set_value(1 if value else 0)
+
+    def _input(self, pin):
+        return self._lines[pin].get_value()
+
+    def read_levels(self, pins):
+        return [self._lines[pin].get_value() for pin in pins]
+
+    def add_event_detect(self, pin, callback, edge=FALLING, bouncetime=None):
+        request_type = {
+            FALLING: self._gpiod.LINE_REQ_EV_FALLING_EDGE,
+            RISING: self._gpiod.LINE_REQ_EV_RISING_EDGE,
+            BOTH: self._gpiod.LINE_REQ_EV_BOTH_EDGES,
+        }[edge]
+        line = self._request(pin, type=request_type, flags=self._flags(pin))
+
+        stop = threading.Event()
+        thread = threading.Thread(target=self._watch, args=(pin, line, callback, bouncetime, stop),
+                                  daemon=True)
+        self._watchers[pin] = (thread, stop)
+        thread.start()
+
+    def _watch(self, pin, line, callback, bouncetime, stop):
+        debounce = (bouncetime or 0) / 1000.0
+        last = 0.0
+        while not stop.is_set():
+            if not line.event_wait(sec=0, nsec=int(self.EVENT_POLL * 1e9)):
+                continue
+            line.event_read()
+            now = time.monotonic()
+            if now - last >= debounce:
+                last = now
+                callback(pin)
+
+    def remove_event_detect(self, pin):
+        watcher = self._watchers.pop(pin, None)
+        if watcher is None:
+            return
+        thread, stop = watcher
+        stop.set()
+        thread.join()
+
+    def cleanup(self, pins=None):
+        for pin in list(self._lines if pins is None else pins):
+            self.remove_event_detect(pin)
+            line = self._lines.pop(pin, None)
+            if line is not None:
+                line.release()
+
+
+class GpiomemBackend:
+    """Direct BCM283x register access through an mmap of /dev/gpiomem.
+
+    Writes go to the GPSET0/GPCLR0 registers and reads come from GPLEV0, so a
+    pin access is a single memory operation with no syscall. Only pins 0-31
+    are supported, which covers the whole 40-pin header. Edge detection needs
+    the kernel, so this backend has none.
+    """
+    name = 'gpiomem'
+    supports_edge = False
+    BLOCK_SIZE = 4096
+
+    # Register offsets in 32-bit words.
+    GPFSEL0 = 0x00 // 4
+    GPSET0 = 0x1C // 4
+    GPCLR0 = 0x28 // 4
+    GPLEV0 = 0x34 // 4
+    GPPUD = 0x94 // 4
+    GPPUDCLK0 = 0x98 // 4
+
+    def __init__(self, path='/dev/gpiomem'):
+        fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            self._mem = mmap.mmap(fd, self.BLOCK_SIZE, mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self._regs = memoryview(self._mem).cast('I')
+        self._outputs = set()
+
+        regs = self._regs
+        set_reg = self.GPSET0
+        clr_reg = self.GPCLR0
+        lev_reg = self.GPLEV0
+
+        def output(pin, value):
+            regs[set_reg if value else clr_reg] = 1 << pin
+
+        def input(pin):
+            return (regs[lev_reg] >> pin) & 1
+
+        self.output = output
+        self.input = input
+
+    def _check_pin(self, pin):
+        if not 0 <= pin < 32:
+            raise ValueError("GpiomemBackend only supports GPIO 0-31, got %d" % pin)
+
+    def _set_function(self, pin, function):
+        self._check_pin(pin)
+        index = self.GPFSEL0 + pin // 10
+        shift = (pin % 10) * 3
+        self._regs[index] = (self._regs[index] & ~(0b111 << shift)) | (function << shift)
+
+    def setup_output(self, pin):
+        self._set_function(pin, 0b001)
+        self._outputs.add(pin)
+
+    def setup_input(self, pin, pull_up=False):
+        self._set_function(pin, 0b000)
+        self._outputs.discard(pin)
+        # BCM2835/2837 pull sequence: select the pull, clock it into the pin,
+        # then remove both.  The Pi Zero 2W uses the BCM2837.
+        self._regs[self.GPPUD] = 2 if pull_up else 0
+        time.sleep(0.00001)
+        self._regs[self.GPPUDCLK0] = 1 << pin
+        time.sleep(0.00001)
+        self._regs[self.GPPUD] = 0
+        self._regs[self.GPPUDCLK0] = 0
+
+    def read_levels(self, pins):
+        # One register read for all pins.
+        levels = self._regs[self.GPLEV0]
+        return [(levels >> pin) & 1 for pin in pins]
+
+    def add_event_detect(self, pin, callback, edge=FALLING, bouncetime=None):
+        raise NotImplementedError("GpiomemBackend has no edge detection")
+
+    def remove_event_detect(self, pin):
+        pass
+
+    def cleanup(self, pins=None):
+        # Like RPi.GPIO, return the pins we drove to inputs.
+        for pin in list(self._outputs if pins is None else pins):
+            self.setup_input(pin)
+
+
+BACKENDS = {
+    RPiGPIOBackend.name: RPiGPIOBackend,
+    GpiodBackend.name: GpiodBackend,
+    GpiomemBackend.name: GpiomemBackend,
+}
+
+_default = None
+_default_bus = None
+_default_lock = threading.Lock()
+
+
+def create_backend(name):
+    if name == 'sim':
+        # Imported here, simulation.py depends on this module.
+        from simulation import create_sim_backend
+        return create_sim_backend()
+    if name == 'replay':
+        from recording import create_replay_backend
+        return create_replay_backend()
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unrecognised GPIO backend: \"%s\"" % name)
+    # Outside the try: a KeyError raised while opening the chip is not a bad
+    # backend name.
+    return backend_class()
+
+
+def default_backend():
+    """Return the process-wide backend selected by GPIO_BACKEND."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = create_backend(GPIO_BACKEND)
+        return _default
+
+
+def open_i2c_bus(bus=1):
+    """Return the process-wide SMBus, or a FakeCW2015 with simulated GPIO."""
+    global _default_bus
+    with _default_lock:
+        if _default_bus is None:
+            if GPIO_BACKEND in ('sim', 'replay'):
+                from simulation import FakeCW2015
+                _default_bus = FakeCW2015()
+            else:
+                import smbus
+                _default_bus = smbus.SMBus(bus)
+        return _default_bus
@@ -0,0 +1,129 @@
+"""Async server support: keeps hardware I/O off the request and Socket.IO threads.
+
+ASYNC_MODE selects how the server runs:
+
+- threading (default): Flask-SocketIO's thread-per-request mode.
+- eventlet / gevent: cooperative green threads. The networking stack is
+  monkey patched, but `thread` is left alone, so the sampler, joystick and
+  battery threads stay real OS threads with real locks and keep their
+  bit-bang timing.
+
+Either way, blocking hardware calls (tare, calibration, battery reads) go
+through one HardwareExecutor with a single worker thread. A green handler
+calling run() yields to the hub until the result is ready instead of
+blocking it.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'threading')
+ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+
+
+def patch(async_mode=ASYNC_MODE):
+    """Monkey patch for green modes. Call before importing flask."""
+    if async_mode not in ASYNC_MODES:
+        raise ValueError("Unrecognised ASYNC_MODE: \"%s\"" % async_mode)
+    if async_mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch(thread=False)
+    elif async_mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all(thread=False)
+
+
+def is_green(async_mode=ASYNC_MODE):
+    return async_mode in ('eventlet', 'gevent')
+
+
+class GreenNotifier:
+    """Wakes a green task from any OS thread.
+
+    Hardware threads must not touch the hub, so notify() writes a byte to a
+    pipe and wait() parks the green task on the pipe's read end through the
+    hub's own fd wait. A notify() between two waits is never lost: the byte
+    stays in the pipe until the next wait() reads it.
+    """
+
+    def __init__(self, async_mode=ASYNC_MODE):
+        if async_mode == 'eventlet':
+            from eventlet import patcher
+            from eventlet.hubs import trampoline
+            self._os = patcher.original('os')
+            self._wait_readable = lambda fd: trampoline(fd, read=True)
+        elif async_mode == 'gevent':
+            from gevent.socket import wait_read
+            self._os = os
+            self._wait_readable = wait_read
+        else:
+            raise ValueError("GreenNotifier needs eventlet or gevent, not %s" % async_mode)
+        self._read_fd, self._write_fd = self._os.pipe()
+        self._os.set_blocking(self._read_fd, False)
+        self._os.set_blocking(self._write_fd, False)
+
+    def notify(self):
+        try:
+            self._os.write(self._write_fd, b'\0')
+        except BlockingIOError:
+            # Pipe full: a wake-up is pending anyway.
+            pass
+
+    def wait(self):
+        self._wait_readable(self._read_fd)
+        try:
+            self._os.read(self._read_fd, 4096)
+        except BlockingIOError:
+            pass
+
+
+class HardwareExecutor:
+    """Runs blocking hardware calls one at a time on a dedicated worker thread."""
+
+    def __init__(self, async_mode=ASYNC_MODE):
+        self.async_mode = async_mode
+        # Waits that only watch the sampler stay on the request thread
+        # instead of holding the hardware thread. A green handler must not
+        # block on a real Condition there, so it polls with the hub's sleep;
+        # None in threading mode, where it can block.
+        self.green_sleep = None
+        if async_mode == 'eventlet':
+            # tpool hands work to real OS threads and wakes the hub when it
+            # is done. With one thread it is our dedicated executor.
+            from eventlet import tpool
+            import eventlet
+            tpool.set_num_threads(1)
+            self._tpool = tpool
+            self.green_sleep = eventlet.sleep
+        elif async_mode == 'gevent':
+            from gevent.threadpool import ThreadPool
+            import gevent
+            self._pool = ThreadPool(maxsize=1)
+            self.green_sleep = gevent.sleep
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hardware')
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn on the hardware thread and return its result (or raise its error)."""
+        if self.async_mode == 'eventlet':
+            return self._tpool.execute(fn, *args, **kwargs)
+        if self.async_mode == 'gevent':
+            return self._pool.apply(fn, args, kwargs)
+        return self._pool.submit(fn, *args, **kwargs).result()
+
+    def create_event(self):
+        """An Event that can be waited on from request handlers in this mode."""
+        if self.async_mode == 'eventlet':
+            from eventlet.green.threading import Event
+        elif self.async_mode == 'gevent':
+            from gevent.event import Event
+        else:
+            from threading import Event
+        return Event()
+
+    def shutdown(self):
+        if self.async_mode == 'eventlet':
+            self._tpool.killall()
+        elif self.async_mode == 'gevent':
+            self._pool.kill()
+        else:
+            self._pool.shutdown(wait=False)
@@ -0,0 +1,135 @@
+"""Preallocated sample history for the acquisition thread.
+
+Raw counts, monotonic timestamps and filtered values live in three
+fixed-size arrays, array('i') and array('d'), used as one ring. No Python
+object is kept per sample. Samples are addressed by their total index (the
+n-th sample ever written), which is also the cursor clients pass back to get
+everything after it.
+"""
+import struct
+import sys
+from array import array
+
+# Binary frame: header, then `n` int32 counts, `n` float64 timestamps and
+# `n` float64 filtered values, all little endian.
+FRAME_MAGIC = b'HXS1'
+FRAME_HEADER = struct.Struct('<4sQIdd')  # magic, start, n, offset, reference_unit
+
+
+class SampleHistory:
+    def __init__(self, size):
+        if size <= 0:
+            raise ValueError("History size must be at least 1")
+        self.size = size
+        self.counts = array('i', bytes(4 * size))
+        self.times = array('d', bytes(8 * size))
+        self.filtered = array('d', bytes(8 * size))
+        # Total number of samples ever written; the newest lives at index
+        # (count - 1) % size.
+        self.count = 0
+
+    def append(self, value, timestamp, filtered):
+        index = self.count % self.size
+        self.counts[index] = value
+        self.times[index] = timestamp
+        self.filtered[index] = filtered
+        self.count += 1
+
+    def _written(self):
+        # Samples written or being written; only differs from count when
+        # another process writes, see shared_history.py.
+        return self.count
+
+    def _range(self, start, count):
+        # Clamp to what is still in the ring.
+        return max(start, count - self.size, 0), count
+
+    def recent(self, n):
+        """Up to n of the newest samples as (value, timestamp), oldest first."""
+        count = self.count
+        return self.since(count - n, count)
+
+    def since(self, index, count=None):
+        """Samples from total index `index` on as (value, timestamp), oldest first."""
+        if count is None:
+            count = self.count
+        start, end = self._range(index, count)
+        size = self.size
+        counts = self.counts
+        times = self.times
+        return [(counts[i % size], times[i % size]) for i in range(start, end)]
+
+    def _segments(self, start, end):
+        """Ring slices covering total indices [start, end), in order."""
+        if start >= end:
+            return []
+        first, last = start % self.size, (end - 1) % self.size + 1
+        if first < last:
+            return [(first, last)]
+        return [(first, self.size), (0, last)]
+
+    def export(self, cursor, limit=None):
+        """Copy the samples after `cursor` into new arrays.
+
+        Returns (start, counts, times, filtered). `start` is the total index
+        of the first sample, which is later than `cursor` if older samples
+        were already overwritten; start + len(counts) is the next cursor.
+        """
+        count = self.count
+        start, end = self._range(cursor, count)
+        if limit is not None:
+            end = min(end, start + limit)
+        counts, times, filtered = array('i'), array('d'), array('d')
+        for a, b in self._segments(start, end):
+            counts.extend(self.counts[a:b])
+            times.extend(self.times[a:b])
+            filtered.extend(self.filtered[a:b])
+        # The writer may have lapped us while copying; drop what it overwrote.
+        lost = self._written() - self.size - start
+        if lost > 0:
+            del counts[:lost], times[:lost], filtered[:lost]
+            start += lost
+        return start, counts, times, filtered
+
+    def numpy_views(self, cursor=0):
+        """Zero-copy NumPy views of the samples after `cursor`.
+
+        Returns (start, segments) where each segment is a (counts, times,
+        filtered) tuple of views into the ring, oldest first; there are two
+        segments when the range wraps around. The views alias the live
+        buffer, so copy what must outlive the next `size` samples.
+        """
+        import numpy as np
+        count = self.count
+        start, end = self._range(cursor, count)
+        counts = np.frombuffer(self.counts, dtype=np.int32)
+        times = np.frombuffer(self.times, dtype=np.float64)
+        filtered = np.frombuffer(self.filtered, dtype=np.float64)
+        return start, [(counts[a:b], times[a:b], filtered[a:b])
+                       for a, b in self._segments(start, end)]
+
+
+def encode_frame(start, counts, times, filtered, offset=0.0, reference_unit=1.0):
+    """Binary frame of exported samples, see FRAME_HEADER."""
+    if sys.byteorder == 'big':
+        counts, times, filtered = array('i', counts), array('d', times), array('d', filtered)
+        for data in (counts, times, filtered):
+            data.byteswap()
+    header = FRAME_HEADER.pack(FRAME_MAGIC, start, len(counts), offset, reference_unit)
+    return b''.join((header, counts.tobytes(), times.tobytes(), filtered.tobytes()))
+
+
+def decode_frame(frame):
+    """Inverse of encode_frame: (start, counts, times, filtered, offset, reference_unit)."""
+    magic, start, n, offset, reference_unit = FRAME_HEADER.unpack_from(frame)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Not a sample frame")
+    position = FRAME_HEADER.size
+    arrays = []
+    for typecode, width in (('i', 4), ('d', 8), ('d', 8)):
+        data = array(typecode, frame[position:position + n * width])
+        if sys.byteorder == 'big':
+            data.byteswap()
+        arrays.append(data)
+        position += n * width
+    return (start,) + tuple(arrays) + (offset, reference_unit)
@@ -1,10 +1,53 @@
-import RPi.GPIO as GPIO
 import time
 import threading
+from array import array
+
+import metrics
+from gpio_backends import FALLING, default_backend
+from filters import RunningMedian, TrimmedMean
+
+
+class SensorNotReadyError(Exception):
+    """Raised when the HX711 does not signal a conversion within the timeout."""
+    pass
+
 
 class HX711:
 
-    def __init__(self, dout, pd_sck, gain=128):
+    # How readRawBytes() waits for DOUT to go low.  'edge' sleeps until the
+    # GPIO falling-edge interrupt fires, 'poll' sleeps through most of the
+    # conversion period and then checks the pin every POLL_INTERVAL, 'spin'
+    # polls the pin flat out.  By default edge if the backend has edge
+    # detection, poll otherwise; spin costs a whole core.
+    WAIT_SPIN = 'spin'
+    WAIT_EDGE = 'edge'
+    WAIT_POLL = 'poll'
+    WAIT_MODES = (WAIT_SPIN, WAIT_EDGE, WAIT_POLL)
+    POLL_MARGIN = 0.2  # Fraction of the conversion period left to poll through
+    POLL_INTERVAL = 0.0005  # Seconds between pin checks in poll mode
+
+    # Output rates selectable with the board's RATE pin, in samples per second.
+    RATES = (10, 80)
+    # Conversion intervals kept for measured_sps.
+    RATE_WINDOW = 16
+
+    # Timing contract of the serial interface. PD_SCK high for longer than
+    # 60us powers the chip down; a readout that outlasts the conversion
+    # period can mix two conversions.
+    PD_SCK_HIGH_LIMIT_NS = 60000
+
+    # Trailing PD_SCK pulses after the 24 data bits -> gain (and channel)
+    # of the next conversion: 128 and 64 are channel A, 32 is channel B.
+    PULSES = {128: 1, 64: 3, 32: 2}
+    # A value further than this many counts from the running estimate is
+    # dropped as a spike if the next conversion is back near the estimate.
+    MAX_DELTA = 50000
+    # Conversions thrown away in a row before a read gives up and returns
+    # what it has.
+    MAX_RETRIES = 3
+
+    def __init__(self, dout, pd_sck, gain=128, wait_mode=None, ready_timeout=1.0,
+                 backend=None, rate=10, check_timing=True, max_delta=MAX_DELTA):
         self.PD_SCK = pd_sck
 
         self.DOUT = dout
@@ -13,12 +56,79 @@ class HX711:
         # software try to access get values from the class at the same time.
         self.readLock = threading.Lock()
         
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.PD_SCK, GPIO.OUT)
-        GPIO.setup(self.DOUT, GPIO.IN)
+        # GPIO access goes through a backend (RPi.GPIO, libgpiod or direct
+        # /dev/gpiomem registers), see gpio_backends.py.
+        self.gpio = backend if backend is not None else default_backend()
+        self.gpio.setup_output(self.PD_SCK)
+        self.gpio.setup_input(self.DOUT)
+
+        # Longest time to wait for a conversion before giving up.  At 10 SPS
+        # a conversion takes 100ms, so anything much longer means the load
+        # cell or the HX711 is gone.
+        self.ready_timeout = ready_timeout
+
+        # The RATE pin is hardwired on most boards, so this only tells the
+        # driver what to expect; measured_sps is what the chip really does.
+        if rate not in self.RATES:
+            raise ValueError("HX711 rate must be 10 or 80 SPS, got %r" % rate)
+        self.rate = rate
+        self._intervals = RunningMedian(self.RATE_WINDOW)
+        self._last_ready = None
+        # Poll-mode waits left that skip the sleep, see wait_ready().
+        self._poll_only = 0
+
+        # Glitch detection, see read_timed(). max_delta=None turns the
+        # delta check off, check_timing=False the pulse timing.
+        self.check_timing = check_timing
+        self.max_delta = max_delta
+        self._violation = False
+        self._init_state()
+
+        if wait_mode is None:
+            wait_mode = self.WAIT_EDGE if self.gpio.supports_edge else self.WAIT_POLL
+        if wait_mode not in self.WAIT_MODES:
+            raise ValueError("Unrecognised wait_mode: \"%s\"" % wait_mode)
+        if wait_mode == self.WAIT_EDGE and not self.gpio.supports_edge:
+            raise ValueError("GPIO backend \"%s\" has no edge detection" % self.gpio.name)
+        self.wait_mode = wait_mode
+        self.dataReady = threading.Event()
+        if self.wait_mode == self.WAIT_EDGE:
+            # A previous instance on the same pin may still have its edge
+            # detection registered.
+            self.gpio.remove_event_detect(self.DOUT)
+            hx711_add_event_detect(self, self._on_data_ready)
 
         self.GAIN = 0
 
+        self.set_gain(gain)
+        
+        # Think about whether this is necessary.
+        time.sleep(1)
+
+    def _init_state(self):
+        # Everything but the GPIO side, so drivers that get their conversions
+        # elsewhere (shared_history.py, hx711_multi.py) can share the rest.
+
+        # Monotonic time at which the newest sample's conversion was seen
+        # to complete.
+        self.last_timestamp = None
+
+        self._estimate = RunningMedian(3)
+        self._pending = None
+        self.conversions_read = 0
+        self.timing_violations = 0
+        self.spikes = 0
+        # Conversions read only to switch channel/gain.
+        self.discarded = 0
+
+        # Gain the chip is converting at right now, as selected by the last
+        # readout's trailing pulses; None when unknown.
+        self._pending_gain = None
+
+        # Optional recording.Recorder that gets every sample and gain change.
+        self.recorder = None
+        self._recorded_gain = None
+
         # The value returned by the hx711 that corresponds to your reference
         # unit AFTER dividing by the SCALE.
         self.REFERENCE_UNIT = 1
@@ -30,13 +140,8 @@ class HX711:
 
         self.DEBUG_PRINTING = False
 
-        self.byte_format = 'MSB'
-        self.bit_format = 'MSB'
+        self.set_reading_format('MSB', 'MSB')
 
-        self.set_gain(gain)
-        
-        # Think about whether this is necessary.
-        time.sleep(1)
 
     def set_scale(self, scale):
         """
@@ -49,7 +154,82 @@ class HX711:
 
     
     def is_ready(self):
-        return GPIO.input(self.DOUT) == 0
+        return self.gpio.input(self.DOUT) == 0
+
+
+    def _on_data_ready(self, channel):
+        # Called from the GPIO event thread on the DOUT falling edge.
+        self.dataReady.set()
+
+
+    def wait_ready(self):
+        # Must be called with readLock held, so nobody is clocking PD_SCK
+        # and the only falling edge on DOUT is the end of a conversion.
+        # Returns True if it had to wait, i.e. the conversion completed just
+        # now rather than at some unknown time before the call.
+        if self.wait_mode == self.WAIT_EDGE:
+            # Clear before checking the pin, so an edge between the check
+            # and the wait is not lost. HX711Multi shares this and needs
+            # every DOUT low, which can take one edge per chip.
+            self.dataReady.clear()
+            if self.is_ready():
+                return False
+            deadline = time.monotonic() + self.ready_timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.dataReady.wait(remaining):
+                    if self.is_ready():
+                        return True
+                    raise SensorNotReadyError(
+                        "HX711 not ready after %.2fs" % self.ready_timeout)
+                self.dataReady.clear()
+                if self.is_ready():
+                    return True
+
+        if self.is_ready():
+            return False
+        now = time.monotonic()
+        deadline = now + self.ready_timeout
+        poll = self.wait_mode == self.WAIT_POLL
+        if poll and self.last_timestamp is not None and not self._poll_only:
+            # Sleep until shortly before the next conversion is due.
+            interval = self._intervals.value or 1.0 / self.rate
+            due = self.last_timestamp + interval * (1 - self.POLL_MARGIN)
+            if due > now:
+                time.sleep(min(due, deadline) - now)
+                if self.is_ready():
+                    # Slept past the conversion, so the chip is faster than
+                    # we thought. Poll from the start for the next two
+                    # conversions, which measures the interval again.
+                    self._intervals.reset()
+                    self._poll_only = 2
+                    return False
+        elif self._poll_only:
+            self._poll_only -= 1
+        while not self.is_ready():
+            if time.monotonic() > deadline:
+                raise SensorNotReadyError(
+                    "HX711 not ready after %.2fs" % self.ready_timeout)
+            if poll:
+                time.sleep(self.POLL_INTERVAL)
+        return True
+
+
+    def _track_rate(self, timestamp, waited):
+        # Only the time between two conversions we both saw complete is a
+        # conversion interval.
+        if waited and self._last_ready is not None:
+            self._intervals.update(timestamp - self._last_ready)
+        self._last_ready = timestamp if waited else None
+
+
+    @property
+    def measured_sps(self):
+        """Conversions per second seen on DOUT, or None until measured."""
+        interval = self._intervals.value
+        if not interval:
+            return None
+        return 1.0 / interval
 
     
     def set_gain(self, gain):
@@ -60,10 +240,16 @@ class HX711:
         elif gain == 32:
             self.GAIN = 2
 
-        GPIO.output(self.PD_SCK, False)
+        # The other channel's values say nothing about this one.
+        self._estimate.reset()
+        self._pending = None
 
-        # Read out a set of raw bytes and throw it away.
-        self.readRawBytes()
+        self.gpio.output(self.PD_SCK, False)
+
+        # Unless the last readout already selected this gain, read out a
+        # set of raw bytes and throw it away.
+        if self._pending_gain != gain:
+            self.readRawBytes()
 
         
     def get_gain(self):
@@ -76,15 +262,30 @@ class HX711:
 
         # Shouldn't get here.
         return 0
-        
+
+
+    @property
+    def pending_gain(self):
+        """Gain of the conversion the chip is working on, None if unknown."""
+        return self._pending_gain
+
 
     def readNextBit(self):
        # Clock HX711 Digital Serial Clock (PD_SCK).  DOUT will be
        # ready 1us after PD_SCK rising edge, so we sample after
        # lowering PD_SCL, when we know DOUT will be stable.
-       GPIO.output(self.PD_SCK, True)
-       GPIO.output(self.PD_SCK, False)
-       value = GPIO.input(self.DOUT)
+       if self.check_timing:
+          # An upper bound of the high time; if the thread was preempted in
+          # between, the chip may have powered down mid-read.
+          start = time.perf_counter_ns()
+          self.gpio.output(self.PD_SCK, True)
+          self.gpio.output(self.PD_SCK, False)
+          if time.perf_counter_ns() - start > self.PD_SCK_HIGH_LIMIT_NS:
+             self._violation = True
+       else:
+          self.gpio.output(self.PD_SCK, True)
+          self.gpio.output(self.PD_SCK, False)
+       value = self.gpio.input(self.DOUT)
 
        # Convert Boolean to int and return it.
        return int(value)
@@ -108,61 +309,332 @@ class HX711:
         
 
     def readRawBytes(self):
+        # The three bytes in set_reading_format() order.
+        value = self._readRawBytesTimed()[0] & 0xFFFFFF
+        return [value >> 16, (value >> 8) & 0xFF, value & 0xFF]
+
+
+    def _readRawBytesTimed(self, next_gain=None, at=None):
+        # One conversion as (signed value, timestamp, gain it was converted
+        # at). The gain is taken under readLock, so it belongs to this very
+        # conversion; None when unknown. next_gain selects the gain of the
+        # following conversion, by default the one set with set_gain(). With
+        # `at`, a conversion at any other gain is only read to switch, and
+        # selects `at` instead.
+        if next_gain is None:
+            next_gain = self.get_gain()
+        # Timing for /metrics, only once somebody scrapes it.
+        timed = metrics.ENABLED
+        if timed:
+            requested = time.perf_counter()
+
         # Wait for and get the Read Lock, in case another thread is already
         # driving the HX711 serial interface.
         self.readLock.acquire()
 
-        # Wait until HX711 is ready for us to read a sample.
-        while not self.is_ready():
-           pass
+        try:
+            if timed:
+                acquired = time.perf_counter()
+            # Wait until HX711 is ready for us to read a sample.  Raises
+            # SensorNotReadyError on timeout, and the lock is still released.
+            waited = self.wait_ready()
+            timestamp = time.monotonic()
+            self._track_rate(timestamp, waited)
+            self.last_timestamp = timestamp
+            if timed:
+                ready = time.perf_counter()
+            gain = self._pending_gain
+            if at is not None and gain != at:
+                next_gain = at
+            value = self._clock_in(self.PULSES[next_gain])
+            # A chip that powered down during the readout restarts at 128.
+            self._pending_gain = (next_gain if not self._violation or next_gain == 128
+                                  else None)
+            # Every raw conversion is recorded, including the ones read only
+            # to switch gain or later dropped as spikes, so a replay goes
+            # through the same checks. A readout that broke the timing
+            # contract holds no conversion, and one at an unknown gain
+            # cannot be assigned to a channel.
+            if self.recorder is not None and gain is not None and not self._violation:
+                self._record(value, timestamp, gain)
+        finally:
+            # Release the Read Lock, now that we've finished driving the HX711
+            # serial interface.
+            self.readLock.release()
+
+        if timed:
+            released = time.perf_counter()
+            metrics.CONVERSIONS.inc()
+            metrics.READ_RAW_BYTES.observe(released - requested)
+            metrics.READ_LOCK_WAIT.observe(acquired - requested)
+            metrics.READ_LOCK_HOLD.observe(released - acquired)
+            metrics.CLOCKING.observe(released - ready)
+
+        return value, timestamp, gain
+
+
+    def _clock_in(self, pulses):
+        # Called with readLock held once DOUT is low: clock out the 24 data
+        # bits and `pulses` gain pulses and return the signed value. The
+        # per-bit work is one clock pulse, one pin read and a shift from
+        # the table set_reading_format() built. Sets self._violation like
+        # readNextBit().
+        output = self.gpio.output
+        read_pin = self.gpio.input
+        pd_sck = self.PD_SCK
+        dout = self.DOUT
+        word = 0
+        if self.check_timing:
+            perf_counter_ns = time.perf_counter_ns
+            limit = self.PD_SCK_HIGH_LIMIT_NS
+            violation = False
+            readout_start = perf_counter_ns()
+            for shift in self._shifts:
+                start = perf_counter_ns()
+                output(pd_sck, True)
+                output(pd_sck, False)
+                if perf_counter_ns() - start > limit:
+                    violation = True
+                word |= read_pin(dout) << shift
+            for _ in range(pulses):
+                start = perf_counter_ns()
+                output(pd_sck, True)
+                output(pd_sck, False)
+                if perf_counter_ns() - start > limit:
+                    violation = True
+            if perf_counter_ns() - readout_start > 1e9 / self.rate:
+                violation = True
+            self._violation = violation
+        else:
+            for shift in self._shifts:
+                output(pd_sck, True)
+                output(pd_sck, False)
+                word |= read_pin(dout) << shift
+            for _ in range(pulses):
+                output(pd_sck, True)
+                output(pd_sck, False)
+            self._violation = False
+        # 24-bit two's complement to a signed int.
+        return word - ((word & 0x800000) << 1)
+
+
+    def read_burst(self, n, out=None):
+        """Read n conversions at the set_gain() gain into an array('i').
+
+        Takes readLock once for the whole burst and fills `out` (allocated
+        if None) with raw values, oldest first. Conversions that broke the
+        timing contract are read again; there is no spike check. Returns
+        `out`.
+        """
+        if out is None:
+            out = array('i', bytes(4 * n))
+        elif len(out) < n:
+            raise ValueError("read_burst() needs room for %d values, got %d" % (n, len(out)))
+        gain = self.get_gain()
+        pulses = self.PULSES[gain]
+        clock_in = self._clock_in
+        wait_ready = self.wait_ready
+        track_rate = self._track_rate
+        monotonic = time.monotonic
+        record = self.recorder is not None
+        timed = metrics.ENABLED
+        if timed:
+            requested = time.perf_counter()
+
+        with self.readLock:
+            if timed:
+                acquired = time.perf_counter()
+            i = 0
+            failures = 0
+            while i < n:
+                # Not at our gain if the pending conversion is on the other
+                # channel or the chip powered down: read it only to resync.
+                resync = self._pending_gain != gain
+                waited = wait_ready()
+                timestamp = monotonic()
+                track_rate(timestamp, waited)
+                value = clock_in(pulses)
+                self.conversions_read += 1
+                if self._violation:
+                    self.timing_violations += 1
+                    self._pending_gain = gain if gain == 128 else None
+                    failures += 1
+                    if failures > self.MAX_RETRIES:
+                        raise SensorNotReadyError(
+                            "No valid HX711 conversion in %d attempts" % failures)
+                    continue
+                self._pending_gain = gain
+                if resync:
+                    self.discarded += 1
+                    continue
+                failures = 0
+                out[i] = value
+                if record:
+                    self._record(value, timestamp, gain)
+                i += 1
+            if n:
+                self.last_timestamp = timestamp
+                self.lastVal = out[n - 1]
+
+        if timed:
+            released = time.perf_counter()
+            metrics.CONVERSIONS.inc(amount=n)
+            metrics.READ_LOCK_WAIT.observe(acquired - requested)
+            metrics.READ_LOCK_HOLD.observe(released - acquired)
+        return out
 
-        # Read three bytes of data from the HX711.
-        firstByte  = self.readNextByte()
-        secondByte = self.readNextByte()
-        thirdByte  = self.readNextByte()
 
-        # HX711 Channel and gain factor are set by number of bits read
-        # after 24 data bits.
-        for i in range(self.GAIN):
-           # Clock a bit out of the HX711 and throw it away.
-           self.readNextBit()
+    def read_long(self):
+        return self.read_timed()[0]
 
-        # Release the Read Lock, now that we've finished driving the HX711
-        # serial interface.
-        self.readLock.release()           
 
-        # Depending on how we're configured, return an ordered list of raw byte
-        # values.
-        if self.byte_format == 'LSB':
-           return [thirdByte, secondByte, firstByte]
-        else:
-           return [firstByte, secondByte, thirdByte]
+    def read_timed(self):
+        """Read one sample as (value, monotonic timestamp of its conversion).
 
+        Conversions that broke the timing contract are discarded and read
+        again. So are single-conversion spikes: a value further than
+        max_delta from the running estimate is checked against the next
+        conversion. Only if that one is back near the estimate is the
+        suspect dropped and counted as a spike. Otherwise the load really
+        changed, e.g. a glass being set down ramps over several
+        conversions, and both values are kept; the second one is returned
+        by the next call.
+        """
+        if self._pending is not None:
+            sample, self._pending = self._pending, None
+            return self._accept(*sample)
+
+        sample = None
+        for attempt in range(self.MAX_RETRIES + 1):
+            value, timestamp, gain = self._read_conversion()
+            if self._violation:
+                self.timing_violations += 1
+                continue
+            if gain != self.get_gain():
+                # Converted on the other channel after read_at(), or at an
+                # unknown gain after a long PD_SCK high may have powered the
+                # chip down. This readout selected our gain again.
+                self.discarded += 1
+                continue
+            estimate = self._estimate.value
+            if (self.max_delta is None or estimate is None
+                    or abs(value - estimate) <= self.max_delta):
+                if sample is not None:
+                    # Back near the estimate, the suspect was a spike.
+                    self.spikes += 1
+                return self._accept(value, timestamp)
+            if sample is None:
+                # Suspect; let the next conversion decide.
+                sample = (value, timestamp)
+                continue
+            # Confirmed: the reading did not return, the load changed. It
+            # need not be near the suspect, a ramp is still moving.
+            self._pending = (value, timestamp)
+            return self._accept(*sample)
+
+        if sample is None:
+            raise SensorNotReadyError(
+                "No valid HX711 conversion in %d attempts" % (self.MAX_RETRIES + 1))
+        # Give up on the old estimate rather than rejecting forever.
+        self._estimate.reset()
+        return self._accept(*sample)
+
+
+    def _accept(self, value, timestamp):
+        self._estimate.update(value)
+        # Record the latest sample value we've read.
+        self.lastVal = value
+        return value, timestamp
 
-    def read_long(self):
-        # Get a sample from the HX711 in the form of raw bytes.
-        dataBytes = self.readRawBytes()
 
+    def _record(self, value, timestamp, gain):
+        if self.recorder is None:
+            return
+        if gain != self._recorded_gain:
+            self.recorder.gain(gain, timestamp)
+            self._recorded_gain = gain
+        self.recorder.sample(value, timestamp)
 
-        if self.DEBUG_PRINTING:
-            print(dataBytes,)
-        
-        # Join the raw bytes into a single 24bit 2s complement value.
-        twosComplementValue = ((dataBytes[0] << 16) |
-                               (dataBytes[1] << 8)  |
-                               dataBytes[2])
 
-        if self.DEBUG_PRINTING:
-            print("Twos: 0x%06x" % twosComplementValue)
-        
-        # Convert from 24bit twos-complement to a signed value.
-        signedIntValue = self.convertFromTwosComplement24bit(twosComplementValue)
+    def read_next(self, next_gain=None):
+        """Read the pending conversion, whatever its gain.
+
+        Returns (value, timestamp, gain), where gain is the one the value
+        was converted at, or None if the readout broke the timing contract
+        and the value must not be used. The trailing pulses select
+        `next_gain` (by default the set_gain() one) for the next conversion.
+        See channel_scheduler.py.
+        """
+        value, timestamp, gain = self._read_conversion(next_gain)
+        if self._violation:
+            self.timing_violations += 1
+            return value, timestamp, None
+        return value, timestamp, gain
 
-        # Record the latest sample value we've read.
-        self.lastVal = signedIntValue
+
+    def read_at(self, gain, next_gain=None):
+        """One conversion at `gain` as (value, timestamp), leaving the chip
+        set up for `next_gain` (by default `gain` again).
+
+        Costs one extra conversion only if the pending one is at another
+        gain. Unlike read_timed() there is no spike check.
+        """
+        if next_gain is None:
+            next_gain = gain
+        for attempt in range(self.MAX_RETRIES + 1):
+            value, timestamp, got = self._read_conversion(next_gain, at=gain)
+            if self._violation:
+                self.timing_violations += 1
+            elif got == gain:
+                return value, timestamp
+            else:
+                # Switch: the pending conversion was at another gain and
+                # its readout selected `gain`.
+                self.discarded += 1
+        raise SensorNotReadyError(
+            "No valid HX711 conversion in %d attempts" % (self.MAX_RETRIES + 1))
+
+
+    def _read_values_at(self, gain, times):
+        # The last readout selects the set_gain() gain again, so switching
+        # back costs nothing.
+        return [self.read_at(gain, gain if i < times - 1 else self.get_gain())[0]
+                for i in range(times)]
+
+
+    @property
+    def glitches(self):
+        return self.timing_violations + self.spikes
+
+
+    @property
+    def glitch_rate(self):
+        """Fraction of conversions discarded as glitches."""
+        if not self.conversions_read:
+            return 0.0
+        return self.glitches / self.conversions_read
+
+
+    def glitch_stats(self):
+        return {
+            'conversions': self.conversions_read,
+            'timing_violations': self.timing_violations,
+            'spikes': self.spikes,
+            'glitch_rate': self.glitch_rate,
+        }
+
+
+    def _read_conversion(self, next_gain=None, at=None):
+        # Get a sample from the HX711 as a signed value, with its timestamp
+        # and gain, see _readRawBytesTimed().
+        value, timestamp, gain = self._readRawBytesTimed(next_gain, at)
+        self.conversions_read += 1
+
+        if self.DEBUG_PRINTING:
+            print("Value: %d (0x%06x)" % (value, value & 0xFFFFFF))
 
         # Return the sample value we've read from the HX711.
-        return int(signedIntValue)
+        return value, timestamp, gain
 
     
     def read_average(self, times=3):
@@ -179,23 +651,14 @@ class HX711:
         if times < 5:
             return self.read_median(times)
 
-        # If we're taking a lot of samples, we'll collect them in a list, remove
-        # the outliers, then take the mean of the remaining set.
-        valueList = []
+        # If we're taking a lot of samples, trim 20% of outlier samples from
+        # top and bottom and take the mean of the remaining set.
+        trimmedMean = TrimmedMean(window=times, trim=0.2)
 
         for x in range(times):
-            valueList += [self.read_long()]
-
-        valueList.sort()
-
-        # We'll be trimming 20% of outlier samples from top and bottom of collected set.
-        trimAmount = int(len(valueList) * 0.2)
+            trimmedMean.update(self.read_long())
 
-        # Trim the edge case values.
-        valueList = valueList[trimAmount:-trimAmount]
-
-        # Return the mean of remaining samples.
-        return sum(valueList) / len(valueList)
+        return trimmedMean.value
 
 
     # A median-based read method, might help when getting random value spikes
@@ -208,21 +671,13 @@ class HX711:
        if times == 1:
           return self.read_long()
 
-       valueList = []
+       # For an even count this is the mean of the two middle values.
+       median = RunningMedian(window=times)
 
        for x in range(times):
-          valueList += [self.read_long()]
-
-       valueList.sort()
+          median.update(self.read_long())
 
-       # If times is odd we can just take the centre value.
-       if (times & 0x1) == 0x1:
-          return valueList[len(valueList) // 2]
-       else:
-          # If times is even we have to take the arithmetic mean of
-          # the two middle values.
-          midpoint = len(valueList) / 2
-          return sum(valueList[midpoint:midpoint+2]) / 2.0
+       return median.value
 
 
     # Compatibility function, uses channel A version
@@ -235,12 +690,14 @@ class HX711:
 
 
     def get_value_B(self, times=3):
-        # for channel B, we need to set_gain(32)
-        g = self.get_gain()
-        self.set_gain(32)
-        value = self.read_median(times) - self.get_offset_B()
-        self.set_gain(g)
-        return value
+        # Channel B is gain 32. Only the conversion pending on channel A is
+        # thrown away; the last B readout switches back.
+        if times <= 0:
+            raise ValueError("HX711::get_value_B(): times must be greater than zero!")
+        median = RunningMedian(window=times)
+        for value in self._read_values_at(32, times):
+            median.update(value)
+        return median.value - self.get_offset_B()
 
     # Compatibility function, uses channel A version
     def get_weight(self, times=3):
@@ -286,19 +743,24 @@ class HX711:
         backupReferenceUnit = self.get_reference_unit_B()
         self.set_reference_unit_B(1)
 
-        # for channel B, we need to set_gain(32)
-        backupGain = self.get_gain()
-        self.set_gain(32)
-
-        value = self.read_average(times)
+        # Channel B is gain 32, read without changing the set_gain() one.
+        if times <= 0:
+            raise ValueError("HX711::tare_B(): times must be greater than zero!")
+        values = self._read_values_at(32, times)
+        if times < 5:
+            average = RunningMedian(window=times)
+        else:
+            average = TrimmedMean(window=times, trim=0.2)
+        for v in values:
+            average.update(v)
+        value = average.value
 
         if self.DEBUG_PRINTING:
             print("Tare B value:", value)
         
         self.set_offset_B(value)
 
-        # Restore gain/channel/reference unit settings.
-        self.set_gain(backupGain)
+        # Restore the reference unit, now that we've got our offset.
         self.set_reference_unit_B(backupReferenceUnit)
        
         return value
@@ -319,6 +781,15 @@ class HX711:
         else:
             raise ValueError("Unrecognised bitformat: \"%s\"" % bit_format)
 
+        # Where each of the 24 bits clocked out ends up in the value, so
+        # _clock_in() assembles it directly in this format.
+        shifts = []
+        for i in range(24):
+            byte, bit = divmod(i, 8)
+            byte_shift = 8 * byte if self.byte_format == 'LSB' else 8 * (2 - byte)
+            shifts.append(byte_shift + (bit if self.bit_format == 'LSB' else 7 - bit))
+        self._shifts = tuple(shifts)
+
             
     # sets offset for channel A for compatibility reasons
     def set_offset(self, offset):
@@ -383,8 +854,8 @@ class HX711:
         # Because a rising edge on HX711 Digital Serial Clock (PD_SCK).  We then
         # leave it held up and wait 100us.  After 60us the HX711 should be
         # powered down.
-        GPIO.output(self.PD_SCK, False)
-        GPIO.output(self.PD_SCK, True)
+        self.gpio.output(self.PD_SCK, False)
+        self.gpio.output(self.PD_SCK, True)
 
         time.sleep(0.0001)
 
@@ -399,19 +870,23 @@ class HX711:
         self.readLock.acquire()
 
         # Lower the HX711 Digital Serial Clock (PD_SCK) line.
-        GPIO.output(self.PD_SCK, False)
+        self.gpio.output(self.PD_SCK, False)
 
         # Wait 100 us for the HX711 to power back up.
         time.sleep(0.0001)
 
-        # Release the Read Lock, now that we've finished driving the HX711
-        # serial interface.
-        self.readLock.release()
-
         # HX711 will now be defaulted to Channel A with gain of 128.  If this
         # isn't what client software has requested from us, take a sample and
         # throw it away, so that next sample from the HX711 will be from the
         # correct channel/gain.
+        self._pending_gain = 128
+
+        # Release the Read Lock, now that we've finished driving the HX711
+        # serial interface.
+        self.readLock.release()
+
+        # The chip settles for a few conversions; that gap is no interval.
+        self._last_ready = None
         if self.get_gain() != 128:
             self.readRawBytes()
 
@@ -420,8 +895,12 @@ class HX711:
         self.power_down()
         self.power_up()
 
+
+    def close(self):
+        if self.wait_mode == self.WAIT_EDGE:
+            self.gpio.remove_event_detect(self.DOUT)
+
 def hx711_add_event_detect(hx711_instance, event_callback):
-        GPIO.add_event_detect(self.DOUT, GPIO.FALLING, 
-            callback=event_callback)
+    hx711_instance.gpio.add_event_detect(hx711_instance.DOUT, event_callback, edge=FALLING)
 
 # EOF - hx711.py
@@ -0,0 +1,311 @@
+"""Several HX711s clocked by one shared PD_SCK line.
+
+Multi-station tables and four-corner platforms have one HX711 per load cell.
+Wired to a common PD_SCK, all chips shift out their conversions together:
+HX711Multi pulses the clock once per bit and samples every DOUT line with a
+single read_levels() call, one GPLEV0 register read on the gpiomem backend,
+so N cells cost one bit-bang pass instead of N. All chips run at the same
+gain, and the data comes out in the chip's native MSB-first order. A pass
+waits until every DOUT is low, with the single-chip driver's wait modes.
+
+HX711Channel gives each cell the single-chip driver's interface (offset,
+reference unit, tare, glitch filtering), so a Scale per cell works
+unchanged. Channels take their values from per-channel queues that every
+pass fills, whichever channel asked for it.
+"""
+import threading
+import time
+from array import array
+from collections import deque
+
+import metrics
+from filters import RunningMedian
+from gpio_backends import FALLING, default_backend
+from hx711 import HX711, SensorNotReadyError
+
+
+class HX711Multi:
+    PULSES = HX711.PULSES
+    QUEUE_SIZE = 16  # Conversions kept per channel until it reads them
+
+    RATES = HX711.RATES
+    RATE_WINDOW = HX711.RATE_WINDOW
+    PD_SCK_HIGH_LIMIT_NS = HX711.PD_SCK_HIGH_LIMIT_NS
+
+    WAIT_SPIN = HX711.WAIT_SPIN
+    WAIT_EDGE = HX711.WAIT_EDGE
+    WAIT_POLL = HX711.WAIT_POLL
+    WAIT_MODES = HX711.WAIT_MODES
+    POLL_MARGIN = HX711.POLL_MARGIN
+    POLL_INTERVAL = HX711.POLL_INTERVAL
+
+    # Same conversion-rate tracking and waiting as the single-chip driver.
+    # In edge mode a falling edge on any DOUT wakes wait_ready(), which
+    # returns once all of them are low.
+    _track_rate = HX711._track_rate
+    measured_sps = HX711.measured_sps
+    wait_ready = HX711.wait_ready
+    _on_data_ready = HX711._on_data_ready
+
+    def __init__(self, douts, pd_sck, gain=128, wait_mode=None, ready_timeout=1.0,
+                 backend=None, rate=10, check_timing=True):
+        self.DOUTS = list(douts)
+        self.PD_SCK = pd_sck
+        self.readLock = threading.Lock()
+        self.gpio = backend if backend is not None else default_backend()
+        self.gpio.setup_output(self.PD_SCK)
+        for dout in self.DOUTS:
+            self.gpio.setup_input(dout)
+
+        self.ready_timeout = ready_timeout
+        if rate not in self.RATES:
+            raise ValueError("HX711 rate must be 10 or 80 SPS, got %r" % rate)
+        self.rate = rate
+        self._intervals = RunningMedian(self.RATE_WINDOW)
+        self._last_ready = None
+        self._poll_only = 0
+        self.last_timestamp = None
+        self.check_timing = check_timing
+        self.passes = 0
+        self.timing_violations = 0
+
+        if wait_mode is None:
+            wait_mode = self.WAIT_EDGE if self.gpio.supports_edge else self.WAIT_POLL
+        if wait_mode not in self.WAIT_MODES:
+            raise ValueError("Unrecognised wait_mode: \"%s\"" % wait_mode)
+        if wait_mode == self.WAIT_EDGE and not self.gpio.supports_edge:
+            raise ValueError("GPIO backend \"%s\" has no edge detection" % self.gpio.name)
+        self.wait_mode = wait_mode
+        self.dataReady = threading.Event()
+        if self.wait_mode == self.WAIT_EDGE:
+            for dout in self.DOUTS:
+                self.gpio.remove_event_detect(dout)
+                self.gpio.add_event_detect(dout, self._on_data_ready, edge=FALLING)
+
+        self._queues = [deque(maxlen=self.QUEUE_SIZE) for _ in self.DOUTS]
+        self.gain = 128
+        self._pulses = self.PULSES[128]
+        self.reset()
+        self.set_gain(gain)
+
+    def is_ready(self):
+        """True once every chip has a conversion ready."""
+        return not any(self.gpio.read_levels(self.DOUTS))
+
+    def _clock_out(self):
+        """Shift out one conversion of every chip: (raw words, violation)."""
+        output = self.gpio.output
+        read_levels = self.gpio.read_levels
+        pins = self.DOUTS
+        pd_sck = self.PD_SCK
+        check = self.check_timing
+        perf_counter_ns = time.perf_counter_ns
+        limit = self.PD_SCK_HIGH_LIMIT_NS
+        violation = False
+
+        words = [0] * len(pins)
+        readout_start = perf_counter_ns()
+        for _ in range(24):
+            if check:
+                start = perf_counter_ns()
+                output(pd_sck, True)
+                output(pd_sck, False)
+                if perf_counter_ns() - start > limit:
+                    violation = True
+            else:
+                output(pd_sck, True)
+                output(pd_sck, False)
+            # Bits are valid after the falling edge.
+            words = [(word << 1) | level for word, level in zip(words, read_levels(pins))]
+        for _ in range(self._pulses):
+            start = perf_counter_ns()
+            output(pd_sck, True)
+            output(pd_sck, False)
+            if check and perf_counter_ns() - start > limit:
+                violation = True
+        if check and perf_counter_ns() - readout_start > 1e9 / self.rate:
+            violation = True
+        return words, violation
+
+    def _read_locked(self):
+        waited = self.wait_ready()
+        timestamp = time.monotonic()
+        self._track_rate(timestamp, waited)
+        self.last_timestamp = timestamp
+        words, violation = self._clock_out()
+        self.passes += 1
+        if violation:
+            self.timing_violations += 1
+            # A chip that powered down is back on channel A, gain 128.
+            if self.gain != 128:
+                self.wait_ready()
+                self._clock_out()
+        if metrics.ENABLED:
+            metrics.CONVERSIONS.inc(amount=len(words))
+        values = [-(word & 0x800000) + (word & 0x7FFFFF) for word in words]
+        return values, timestamp, violation
+
+    def read_timed(self):
+        """One conversion of every chip as (values, monotonic timestamp).
+
+        Unlike the channels' reads this does not filter glitches; a pass
+        that broke the timing contract raises SensorNotReadyError.
+        """
+        with self.readLock:
+            values, timestamp, violation = self._read_locked()
+        if violation:
+            raise SensorNotReadyError("HX711 readout broke the PD_SCK timing contract")
+        return values, timestamp
+
+    def next_conversion(self, index):
+        """The oldest conversion channel `index` has not taken, as
+        (value, timestamp, violation). Clocks a new pass if there is none.
+        """
+        with self.readLock:
+            queue = self._queues[index]
+            if not queue:
+                values, timestamp, violation = self._read_locked()
+                for channel, value in zip(self._queues, values):
+                    channel.append((value, timestamp, violation))
+            return queue.popleft()
+
+    def set_gain(self, gain):
+        """Gain (and channel) of the next conversion, for all chips."""
+        if gain not in self.PULSES:
+            raise ValueError("Unsupported gain: %r" % gain)
+        with self.readLock:
+            self.gain = gain
+            self._pulses = self.PULSES[gain]
+            # The pending conversions were taken at the old gain.
+            for queue in self._queues:
+                queue.clear()
+            # Read out a set of raw bytes and throw it away.
+            self.wait_ready()
+            self._clock_out()
+
+    def get_gain(self):
+        return self.gain
+
+    def reset(self):
+        """Power all chips down and up again; they restart at gain 128."""
+        with self.readLock:
+            self.gpio.output(self.PD_SCK, False)
+            self.gpio.output(self.PD_SCK, True)
+            time.sleep(0.0001)
+            self.gpio.output(self.PD_SCK, False)
+            time.sleep(0.0001)
+            for queue in self._queues:
+                queue.clear()
+        if self.gain != 128:
+            self.set_gain(self.gain)
+
+    def channel(self, index):
+        return HX711Channel(self, index)
+
+    def close(self):
+        if self.wait_mode == self.WAIT_EDGE:
+            for dout in self.DOUTS:
+                self.gpio.remove_event_detect(dout)
+
+
+class HX711Channel(HX711):
+    """One load cell of an HX711Multi with the HX711 driver's interface.
+
+    Offset, reference unit, tare and the spike check of read_timed() are
+    per channel. Gain, power and reset belong to the HX711Multi.
+    """
+
+    def __init__(self, multi, index):
+        self.multi = multi
+        self.index = index
+        self.DOUT = multi.DOUTS[index]
+        self.PD_SCK = multi.PD_SCK
+        self.readLock = threading.Lock()
+        self.ready_timeout = multi.ready_timeout
+        self.rate = multi.rate
+        self.check_timing = multi.check_timing
+        self.max_delta = self.MAX_DELTA
+        self._violation = False
+        self._init_state()
+
+    def _read_conversion(self, next_gain=None, at=None):
+        # HX711Multi re-selects the gain after a bad pass and drops queued
+        # conversions on a gain change, so every conversion is at its gain.
+        value, timestamp, self._violation = self.multi.next_conversion(self.index)
+        self.last_timestamp = timestamp
+        self.conversions_read += 1
+        gain = self.multi.gain
+        if self.recorder is not None and not self._violation:
+            self._record(value, timestamp, gain)
+        return value, timestamp, gain
+
+    def _check_gain(self, *gains):
+        for gain in gains:
+            if gain is None or gain == self.multi.gain:
+                continue
+            if gain == 32:
+                raise ValueError("Channel B is not supported on a shared PD_SCK")
+            raise ValueError("All cells share one gain, use HX711Multi.set_gain()")
+
+    # The gain-switching reads of the single-chip driver, and with them
+    # get_value_B(), get_weight_B() and tare_B(), only work at the shared
+    # gain.
+
+    def read_next(self, next_gain=None):
+        self._check_gain(next_gain)
+        return super().read_next()
+
+    def read_at(self, gain, next_gain=None):
+        self._check_gain(gain, next_gain)
+        return super().read_at(gain)
+
+    # The chip's own readers clock PD_SCK themselves; a channel takes its
+    # conversions from the shared passes instead.
+
+    def readRawBytes(self):
+        value = self._read_conversion()[0] & 0xFFFFFF
+        return [value >> 16, (value >> 8) & 0xFF, value & 0xFF]
+
+    def read_burst(self, n, out=None):
+        """n conversions of this cell into an array('i'), see HX711.read_burst()."""
+        if out is None:
+            out = array('i', bytes(4 * n))
+        elif len(out) < n:
+            raise ValueError("read_burst() needs room for %d values, got %d" % (n, len(out)))
+        i = 0
+        failures = 0
+        while i < n:
+            value, _, _ = self._read_conversion()
+            if self._violation:
+                self.timing_violations += 1
+                failures += 1
+                if failures > self.MAX_RETRIES:
+                    raise SensorNotReadyError(
+                        "No valid HX711 conversion in %d attempts" % failures)
+                continue
+            failures = 0
+            out[i] = value
+            i += 1
+        if n:
+            self.lastVal = out[n - 1]
+        return out
+
+    @property
+    def measured_sps(self):
+        return self.multi.measured_sps
+
+    def get_gain(self):
+        return self.multi.gain
+
+    def set_gain(self, gain):
+        if gain != self.multi.gain:
+            raise ValueError("All cells share one gain, use HX711Multi.set_gain()")
+
+    def power_down(self):
+        pass
+
+    def power_up(self):
+        pass
+
+    def close(self):
+        pass
@@ -1,66 +1,122 @@
-import RPi.GPIO as GPIO
 import time
 from threading import Thread, Event
+from gpio_backends import FALLING, default_backend
 
 class JoystickController:
+    """Reports joystick presses through per-pin falling-edge callbacks.
+
+    The pins are active low with pull-ups. A press is reported as soon as its
+    edge arrives; the backend's bouncetime filters contact bounce, and a
+    monotonic per-pin DEBOUNCE drops any chatter that gets through. Holding a
+    direction repeats it after REPEAT_DELAY, getting faster by
+    REPEAT_ACCELERATION per repeat down to REPEAT_MIN_INTERVAL, for scrolling
+    through menus. Backends without edge detection fall back to polling.
+    """
     JOYSTICK = {
         'up': 6,
         'down': 19,
         'left': 5,
         'right': 26
     }
+    BOUNCETIME = 20             # Milliseconds, handled by the GPIO backend
+    DEBOUNCE = 0.05             # Seconds between accepted presses of one pin
+    REPEAT_DELAY = 0.4          # Seconds held before the first repeat
+    REPEAT_INTERVAL = 0.2       # Seconds between the first repeats
+    REPEAT_ACCELERATION = 0.8   # Interval factor per repeat
+    REPEAT_MIN_INTERVAL = 0.05  # Fastest repeat
+    POLL_INTERVAL = 0.01        # Seconds, only without edge detection
 
-    def __init__(self, callback=None):
+    def __init__(self, callback=None, gpio=None, use_edges=None):
         self.current_direction = 'right'
         self.callback = callback
+        self.gpio = gpio if gpio is not None else default_backend()
+        self.use_edges = self.gpio.supports_edge if use_edges is None else use_edges
+        self._directions = {pin: direction for direction, pin in self.JOYSTICK.items()}
+        self._last_press = {}
+        # The pin being held, handed from the edge callback to the repeat thread.
+        self._held = None
+        self._pressed = Event()
         self.stop_event = Event()
         self._setup_gpio()
-        self.thread = None
+        self.threads = []
 
     def _setup_gpio(self):
         for pin in self.JOYSTICK.values():
-            GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+            self.gpio.setup_input(pin, pull_up=True)
+
+    def _emit(self, direction):
+        self.current_direction = direction
+        if self.callback:
+            self.callback(direction)
 
-    def read_joystick(self):
-        last_direction = None
-        debounce_time = 0.2  # 200ms debounce
-        last_emit_time = 0
+    def _on_edge(self, pin):
+        now = time.monotonic()
+        # Edges that are already gone by the time we look are glitches.
+        if self.gpio.input(pin):
+            return
+        if now - self._last_press.get(pin, float('-inf')) < self.DEBOUNCE:
+            return
+        self._last_press[pin] = now
+        direction = self._directions[pin]
+        self._held = (pin, direction)
+        self._pressed.set()
+        self._emit(direction)
 
+    def _repeat(self):
         while not self.stop_event.is_set():
-            new_direction = None
-            current_time = time.time()
-            
-            if not GPIO.input(self.JOYSTICK['up']):
-                new_direction = 'up'
-            elif not GPIO.input(self.JOYSTICK['down']):
-                new_direction = 'down'
-            elif not GPIO.input(self.JOYSTICK['left']):
-                new_direction = 'left'
-            elif not GPIO.input(self.JOYSTICK['right']):
-                new_direction = 'right'
-            
-            if (new_direction and 
-                new_direction != last_direction and 
-                current_time - last_emit_time >= debounce_time):
-                self.current_direction = new_direction
-                last_direction = new_direction
-                last_emit_time = current_time
-                if self.callback:
-                    self.callback(new_direction)
-            
-            time.sleep(0.05)  # Reduced sleep time for better responsiveness
+            self._pressed.wait()
+            self._pressed.clear()
+            if self.stop_event.is_set() or self._held is None:
+                continue
+            pin, direction = self._held
+            interval = self.REPEAT_DELAY
+            # A new press (or stop) interrupts the wait and restarts the loop.
+            while not self._pressed.wait(interval):
+                if self.gpio.input(pin):
+                    break
+                self._emit(direction)
+                if interval == self.REPEAT_DELAY:
+                    interval = self.REPEAT_INTERVAL
+                else:
+                    interval = max(self.REPEAT_MIN_INTERVAL,
+                                   interval * self.REPEAT_ACCELERATION)
+
+    def _poll(self):
+        pins = list(self.JOYSTICK.values())
+        previous = self.gpio.read_levels(pins)
+        while not self.stop_event.wait(self.POLL_INTERVAL):
+            levels = self.gpio.read_levels(pins)
+            for pin, level, last in zip(pins, levels, previous):
+                if last and not level:
+                    self._on_edge(pin)
+            previous = levels
 
     def start(self):
-        if not self.thread or not self.thread.is_alive():
-            self.stop_event.clear()
-            self.thread = Thread(target=self.read_joystick, daemon=True)
-            self.thread.start()
+        if self.threads:
+            return
+        self.stop_event.clear()
+        self._pressed.clear()
+        targets = [self._repeat]
+        if self.use_edges:
+            for pin in self.JOYSTICK.values():
+                self.gpio.add_event_detect(pin, self._on_edge, edge=FALLING,
+                                           bouncetime=self.BOUNCETIME)
+        else:
+            targets.append(self._poll)
+        self.threads = [Thread(target=target, daemon=True) for target in targets]
+        for thread in self.threads:
+            thread.start()
 
     def stop(self):
+        if self.use_edges:
+            for pin in self.JOYSTICK.values():
+                self.gpio.remove_event_detect(pin)
         self.stop_event.set()
-        if self.thread:
-            self.thread.join()
+        self._pressed.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
 
     def cleanup(self):
         self.stop()
-        # Don't cleanup GPIO here as it's shared with other components
\ No newline at end of file
+        # Don't cleanup GPIO here as it's shared with other components
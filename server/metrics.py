@@ -0,0 +1,173 @@
+"""Prometheus text-format metrics for the acquisition and API hot paths.
+
+Instrumentation is off until the first scrape of /metrics (or from start-up
+with METRICS_ENABLED=1). Instrumented code checks the module-level ENABLED
+flag before taking any timestamps, so an unscraped server pays one
+attribute lookup per instrumented call. Counts therefore start at the first
+scrape, which Prometheus handles like a process restart.
+"""
+import bisect
+import os
+import threading
+
+ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+
+# Seconds, from a single bit-bang read up to a slow API request.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (n, str(v).replace('"', '\\"'))
+                             for n, v in zip(names, values))
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _label_text(self.labelnames, labels), value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total)
+                      for labels, (counts, total) in self._values.items()}
+        names = self.labelnames + ('le',)
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       _label_text(names, labels + (_number(bound),)), cumulative)
+            yield self.name + '_sum', _label_text(self.labelnames, labels), total
+            yield self.name + '_count', _label_text(self.labelnames, labels), cumulative
+
+
+class Callback:
+    """A value read only at scrape time, e.g. the measured sample rate."""
+
+    def __init__(self, name, help, fn, type='gauge'):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.type = type
+
+    def samples(self):
+        value = self.fn()
+        if value is not None:
+            yield self.name, '', value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, fn, type='gauge'):
+        return self.register(Callback(name, help, fn, type))
+
+    def render(self):
+        """The Prometheus text exposition of every metric. Enables collection."""
+        global ENABLED
+        ENABLED = True
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                print(f"Error collecting metric {metric.name}: {e}")
+                continue
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for name, labels, value in samples:
+                lines.append('%s%s %s' % (name, labels, _number(value)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Driver
+CONVERSIONS = registry.counter(
+    'hx711_conversions_total', 'HX711 conversions read.')
+READ_RAW_BYTES = registry.histogram(
+    'hx711_read_raw_bytes_seconds', 'readRawBytes duration, lock wait and DOUT wait included.')
+CLOCKING = registry.histogram(
+    'hx711_clocking_seconds', 'Time spent clocking out one conversion.')
+READ_LOCK_WAIT = registry.histogram(
+    'hx711_read_lock_wait_seconds', 'Time waiting to acquire readLock.')
+READ_LOCK_HOLD = registry.histogram(
+    'hx711_read_lock_hold_seconds', 'Time readLock was held per read.')
+
+# Scale and sampler
+OUT_OF_RANGE = registry.counter(
+    'scale_out_of_range_total', 'Samples outside the -10000..10000 g sanity check, reported as 0.')
+REINITS = registry.counter(
+    'scale_reinit_total', 'HX711 driver re-initialisations.', ('reason',))
+SAMPLE_ERRORS = registry.counter(
+    'sampler_errors_total', 'Failed reads on the sampler thread.')
+
+# API and Socket.IO
+HTTP_REQUESTS = registry.histogram(
+    'http_request_duration_seconds', 'API request latency.', ('path',))
+EMITS = registry.counter(
+    'socketio_emits_total', 'Socket.IO events emitted.', ('event',))
+EMIT_LATENCY = registry.histogram(
+    'socketio_emit_seconds', 'Time from emit call to the event being handed to Socket.IO.',
+    ('event',))
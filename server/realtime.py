@@ -0,0 +1,108 @@
+"""Opt-in real-time scheduling for the acquisition thread.
+
+With SAMPLER_REALTIME=1 the sampler thread, and only that thread, asks
+Linux for SCHED_FIFO priority SAMPLER_RT_PRIORITY, pins itself to one core
+(SAMPLER_CPU, by default the highest-numbered core the process may use;
+the samplers of several load cells share it) and locks the process's
+memory so a page fault cannot stall a conversion half way through its
+clock pulses. Threads started afterwards from the thread that
+started the sampler are kept off that core, so Flask, Socket.IO and the
+joystick and battery threads do not compete with it. For a truly dedicated
+core also boot with isolcpus=<cpu>, which keeps other processes off it too.
+
+Each step needs privileges (CAP_SYS_NICE or an RLIMIT_RTPRIO for the
+priority, CAP_IPC_LOCK or a large RLIMIT_MEMLOCK for the memory lock). A
+step that is not permitted is reported and skipped; the sampler then runs
+as before.
+
+Real-time priority is only for a sampler that sleeps between conversions.
+A SCHED_FIFO thread that spins for DOUT never gives its core back, so the
+kworkers and the GPIO interrupt thread bound to that core starve;
+check_wait_mode() refuses that combination.
+"""
+import ctypes
+import ctypes.util
+import os
+
+SAMPLER_REALTIME = os.environ.get('SAMPLER_REALTIME', '0') == '1'
+PRIORITY = int(os.environ.get('SAMPLER_RT_PRIORITY', '50'))
+CPU = int(os.environ['SAMPLER_CPU']) if os.environ.get('SAMPLER_CPU') else None
+
+# <sys/mman.h>
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+MCL_ONFAULT = 4
+
+
+def check_wait_mode(wait_mode):
+    """Raise ValueError unless `wait_mode` blocks between conversions."""
+    if wait_mode == 'spin':
+        raise ValueError("Real-time sampling needs the edge or poll wait mode, not spin; "
+                         "unset HX711_WAIT_MODE or SAMPLER_REALTIME")
+
+
+# Cores the process may use, taken before reserve_cpu() narrows the
+# importing thread's mask, so every sampler gets the same core.
+AFFINITY = frozenset(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+
+
+def choose_cpu(cpu=CPU):
+    """The core reserved for the samplers, or None on a single-core system.
+
+    The same core for every call in the process: several cells' samplers
+    share it, and restarting a sampler does not take another one.
+    """
+    if cpu is not None:
+        return cpu
+    if not AFFINITY or len(AFFINITY) < 2:
+        return None
+    return max(AFFINITY)
+
+
+def reserve_cpu(cpu):
+    """Keep the calling thread, and threads it starts from now on, off `cpu`.
+
+    Idempotent: the mask is the process's original one without `cpu`.
+    """
+    allowed = (AFFINITY or os.sched_getaffinity(0)) - {cpu}
+    if allowed and os.sched_getaffinity(0) != allowed:
+        os.sched_setaffinity(0, allowed)
+
+
+def lock_memory():
+    """mlockall() the process, locking pages as they are first touched.
+
+    MCL_ONFAULT keeps the 8 MB of every later thread's stack from being
+    made resident up front; kernels before 4.4 lack it and lock everything.
+    """
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    flags = MCL_CURRENT | MCL_FUTURE
+    if libc.mlockall(flags | MCL_ONFAULT) == 0:
+        return
+    if ctypes.get_errno() == 22 and libc.mlockall(flags) == 0:  # EINVAL: no MCL_ONFAULT
+        return
+    errno = ctypes.get_errno()
+    raise OSError(errno, os.strerror(errno))
+
+
+def make_realtime(priority=PRIORITY, cpu=None, lock=True):
+    """Apply real-time settings to the calling thread.
+
+    Returns a dict with the outcome of each step, 'ok' or the error, so the
+    caller can report what actually took effect.
+    """
+    status = {'priority': priority, 'cpu': cpu}
+    steps = [('scheduler', lambda: os.sched_setscheduler(
+        0, os.SCHED_FIFO, os.sched_param(priority)))]
+    if cpu is not None:
+        steps.append(('affinity', lambda: os.sched_setaffinity(0, {cpu})))
+    if lock:
+        steps.append(('mlock', lock_memory))
+    for name, step in steps:
+        try:
+            step()
+            status[name] = 'ok'
+        except (OSError, AttributeError) as e:
+            status[name] = str(e)
+            print(f"Real-time {name} not applied: {e}")
+    return status
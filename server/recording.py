@@ -0,0 +1,334 @@
+"""Record-and-replay of raw HX711 sessions.
+
+A Recorder appends everything needed to reproduce a session to a binary
+file: raw 24-bit counts with their conversion timestamps, gain/channel
+changes, joystick presses, API requests and metadata such as the
+calibration. The file starts with a header and is followed by records
+
+    type (1 byte) | zigzag varint time delta in us | payload
+
+where the time delta is relative to the previous record and the payload is
+a zigzag varint delta to the previous count for samples, a varint gain for
+gain changes, and a varint length plus UTF-8 text for everything else.
+A sample at 10 SPS takes about 6 bytes. The file is append-only, one file
+per session, and a truncated last record (e.g. after a power cut) is
+ignored when reading.
+
+ReplayHX711 feeds a recording back through the HX711 driver on the
+simulated backend, at real or accelerated speed, and the replay backend also
+presses the recorded joystick directions. Select it with GPIO_BACKEND=replay,
+REPLAY_FILE and REPLAY_SPEED, or run a recording straight through the drink
+detector as a regression check:
+
+    python -m recording summary party.hxr
+    python -m recording drinks party.hxr
+"""
+import argparse
+import bisect
+import json
+import os
+import struct
+import threading
+import time
+from array import array
+
+from simulation import DEFAULT_OFFSET, DEFAULT_REFERENCE_UNIT, SimulatedGPIOBackend, SimulatedHX711
+
+MAGIC = b'HXR1'
+HEADER = struct.Struct('<4sdd')  # magic, wall-clock start, monotonic start
+
+SAMPLE = 1
+GAIN = 2
+JOYSTICK = 3
+API = 4
+META = 5
+
+# Gain -> channel of the conversions recorded after a gain record.
+CHANNELS = {128: 'A', 64: 'A', 32: 'B'}
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def _put_varint(out, n):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(data, position):
+    shift = 0
+    result = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+class Recorder:
+    """Appends session records to `path`. Safe to call from any thread."""
+    FLUSH_INTERVAL = 1.0  # Seconds of records at most lost on a crash
+
+    def __init__(self, path):
+        self.path = path
+        # Never overwrite or extend an earlier session; timestamps are only
+        # comparable within one process.
+        self._file = open(path, 'xb')
+        self._lock = threading.Lock()
+        self.start = time.monotonic()
+        self._last_time = self.start
+        self._last_count = 0
+        self._file.write(HEADER.pack(MAGIC, time.time(), self.start))
+        self._last_flush = self.start
+        self.records = 0
+
+    def _write(self, kind, timestamp, payload=b'', value=None):
+        out = bytearray((kind,))
+        with self._lock:
+            delta = int(round((timestamp - self._last_time) * 1e6))
+            self._last_time += delta / 1e6
+            _put_varint(out, _zigzag(delta))
+            if value is not None:
+                _put_varint(out, _zigzag(value - self._last_count))
+                self._last_count = value
+            out += payload
+            self._file.write(out)
+            self.records += 1
+            now = time.monotonic()
+            if now - self._last_flush >= self.FLUSH_INTERVAL:
+                self._file.flush()
+                self._last_flush = now
+
+    def sample(self, value, timestamp):
+        self._write(SAMPLE, timestamp, value=value)
+
+    def gain(self, gain, timestamp=None):
+        payload = bytearray()
+        _put_varint(payload, gain)
+        self._write(GAIN, time.monotonic() if timestamp is None else timestamp, payload)
+
+    def _text(self, kind, text, timestamp):
+        data = text.encode('utf-8')
+        payload = bytearray()
+        _put_varint(payload, len(data))
+        payload += data
+        self._write(kind, time.monotonic() if timestamp is None else timestamp, payload)
+
+    def joystick(self, direction, timestamp=None):
+        self._text(JOYSTICK, direction, timestamp)
+
+    def api(self, request, timestamp=None):
+        """Record an API call, e.g. {'method': 'POST', 'path': '/tare'}."""
+        self._text(API, json.dumps(request, separators=(',', ':')), timestamp)
+
+    def meta(self, data, timestamp=None):
+        self._text(META, json.dumps(data, separators=(',', ':')), timestamp)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Recording:
+    """A loaded recording. Times are seconds since the session start."""
+
+    def __init__(self, wall_start, start):
+        self.wall_start = wall_start
+        self.start = start
+        self.end = start
+        self.times = array('d')
+        self.counts = array('i')
+        self.channels = []
+        # (time, kind, data) for gain changes, joystick, API and meta records.
+        self.events = []
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def channel_samples(self, channel='A'):
+        """(times, counts) of the samples taken on one channel."""
+        times, counts = array('d'), array('i')
+        for t, value, c in zip(self.times, self.counts, self.channels):
+            if c == channel:
+                times.append(t)
+                counts.append(value)
+        return times, counts
+
+    def calibration(self):
+        """The last recorded calibration, or the simulator defaults."""
+        calibration = {'offset': DEFAULT_OFFSET, 'reference_unit': DEFAULT_REFERENCE_UNIT}
+        for _, kind, data in self.events:
+            if kind == META and 'calibration' in data:
+                calibration = data['calibration']
+        return calibration
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, wall_start, start = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("%s is not a recording" % path)
+    recording = Recording(wall_start, start)
+    position = HEADER.size
+    now = start
+    count = 0
+    channel = 'A'
+    try:
+        while position < len(data):
+            kind = data[position]
+            delta, position = _get_varint(data, position + 1)
+            now += _unzigzag(delta) / 1e6
+            t = now - start
+            if kind == SAMPLE:
+                delta, position = _get_varint(data, position)
+                count += _unzigzag(delta)
+                recording.times.append(t)
+                recording.counts.append(count)
+                recording.channels.append(channel)
+            elif kind == GAIN:
+                gain, position = _get_varint(data, position)
+                channel = CHANNELS.get(gain, 'A')
+                recording.events.append((t, GAIN, gain))
+            else:
+                length, position = _get_varint(data, position)
+                if position + length > len(data):
+                    break
+                text = data[position:position + length].decode('utf-8')
+                position += length
+                if kind in (API, META):
+                    text = json.loads(text)
+                recording.events.append((t, kind, text))
+            recording.end = now
+    except IndexError:
+        # Truncated last record.
+        pass
+    return recording
+
+
+class ReplayHX711(SimulatedHX711):
+    """Simulated HX711 whose conversions return a recording's counts.
+
+    The conversion finishing at replay time t returns the last sample the
+    recording had taken by t * speed on the selected channel, and
+    conversions come at the recorded pace divided by `speed`.
+    """
+
+    def __init__(self, recording, speed=1.0, loop=False, **kwargs):
+        super().__init__(**kwargs)
+        self.recording = recording
+        self.speed = speed
+        self.loop = loop
+        self._streams = {c: recording.channel_samples(c) for c in ('A', 'B')}
+        times = recording.times
+        if len(times) > 1:
+            intervals = sorted(b - a for a, b in zip(times, times[1:]))
+            self.period = max(intervals[len(intervals) // 2], 1e-4) / speed
+        else:
+            self.period = 0.1 / speed
+        self.next_conversion = self.start + self.period
+
+    @property
+    def finished(self):
+        return not self.loop and (self.clock() - self.start) * self.speed > self.recording.duration
+
+    def counts_at(self, t, channel, gain):
+        times, counts = self._streams[channel]
+        if not len(counts):
+            return 0
+        t *= self.speed
+        if self.loop and self.recording.duration > 0:
+            t %= self.recording.duration
+        index = max(0, bisect.bisect_right(times, t) - 1)
+        return counts[index]
+
+
+def _replay_events(backend, recording, speed, joystick_pins):
+    start = time.monotonic()
+    for t, kind, data in recording.events:
+        if kind != JOYSTICK or data not in joystick_pins:
+            continue
+        delay = start + t / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        backend.press(joystick_pins[data], hold=min(0.05, 0.5 / speed))
+
+
+def create_replay_backend(path=None, speed=None, dout=17, pd_sck=22, loop=None):
+    """Simulated backend replaying REPLAY_FILE on the Scale's default pins."""
+    from joystick import JoystickController
+    if path is None:
+        path = os.environ['REPLAY_FILE']
+    if speed is None:
+        speed = float(os.environ.get('REPLAY_SPEED', '1'))
+    if loop is None:
+        loop = os.environ.get('REPLAY_LOOP', '0') == '1'
+    recording = load(path)
+    backend = SimulatedGPIOBackend()
+    backend.attach_hx711(ReplayHX711(recording, speed=speed, loop=loop), dout, pd_sck)
+    thread = threading.Thread(target=_replay_events,
+                              args=(backend, recording, speed, JoystickController.JOYSTICK),
+                              daemon=True)
+    thread.start()
+    return backend
+
+
+def run_drinks(recording):
+    """Run the recorded samples through the Scale's filters and a DrinkDetector."""
+    from drink_detector import DrinkDetector
+    from filters import build_chain
+    from scale import Scale
+
+    calibration = recording.calibration()
+    chain = build_chain(Scale.FILTERS)
+    events = []
+    detector = DrinkDetector(on_event=events.append)
+    times, counts = recording.channel_samples('A')
+    for t, value in zip(times, counts):
+        filtered = chain.update(value)
+        detector.update((filtered - calibration['offset']) / calibration['reference_unit'], t)
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and check HX711 recordings")
+    parser.add_argument('command', choices=('summary', 'drinks'))
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    recording = load(args.path)
+    if args.command == 'summary':
+        kinds = {GAIN: 'gain', JOYSTICK: 'joystick', API: 'api', META: 'meta'}
+        print("started   %s" % time.strftime('%Y-%m-%d %H:%M:%S',
+                                             time.localtime(recording.wall_start)))
+        print("duration  %.1f s" % recording.duration)
+        print("samples   %d (%.1f SPS), %d bytes"
+              % (len(recording.counts), len(recording.counts) / max(recording.duration, 1e-9),
+                 os.path.getsize(args.path)))
+        for kind, name in kinds.items():
+            print("%-9s %d" % (name, sum(1 for _, k, _ in recording.events if k == kind)))
+    else:
+        start = time.perf_counter()
+        events = run_drinks(recording)
+        elapsed = time.perf_counter() - start
+        for event in events:
+            print(json.dumps(event))
+        print("%d samples in %.3f s" % (len(recording.counts), elapsed))
+
+
+if __name__ == '__main__':
+    main()
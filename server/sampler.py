@@ -0,0 +1,183 @@
+import time
+from threading import Thread, Event, Condition
+from filters import FilterChain, RunningMedian
+from history import SampleHistory
+import metrics
+import realtime
+
+
+class Sampler:
+    """Background acquisition thread feeding a fixed-size ring buffer.
+
+    The sampler is the only code that clocks the HX711. Every other consumer
+    reads the latest filtered value or the buffered samples, so the number of
+    readers has no effect on how often the sensor is read.
+    """
+    DEFAULT_SIZE = 256
+    PRIME_SAMPLES = 256  # Buffered samples fed to a new filter chain
+    ERROR_BACKOFF = 0.1
+    # After each sample the thread sleeps for this fraction of the typical
+    # sample interval before reading again, so a read that polls for the
+    # next conversion only does so near the end of the period.
+    PACE = 0.8
+    PACE_WINDOW = 8  # Sample intervals the typical one is the median of
+    POLL_INTERVAL = 0.02  # Seconds between count checks of a polling wait_for_samples()
+
+    def __init__(self, read, size=DEFAULT_SIZE, chain=None, on_error=None, timed=False,
+                 realtime=False, history=None, pace=PACE):
+        self._read = read
+        # With timed, read() returns (value, monotonic timestamp), e.g.
+        # HX711.read_timed; otherwise samples are stamped on arrival.
+        self.timed = timed
+        self.size = history.size if history is not None else size
+        # Per-sample filter chain, see filters.py.
+        self.chain = chain if chain is not None else FilterChain(RunningMedian(5))
+        self.on_error = on_error
+        # 0 reads back to back, e.g. for a read that blocks on its own.
+        self.pace = pace
+        self._intervals = RunningMedian(self.PACE_WINDOW)
+        self._last_timestamp = None
+        # Run the sampler thread with SCHED_FIFO priority on its own core,
+        # see realtime.py. realtime_status reports what took effect.
+        self.realtime = realtime
+        self.realtime_status = None
+        self._cpu = None
+        # Called as listener(filtered, timestamp) on the sampler thread for
+        # every sample; keep them cheap.
+        self.listeners = []
+
+        # Preallocated ring of raw counts, monotonic timestamps and filtered
+        # values, see history.py; scale_daemon.py passes one in shared memory.
+        self.history = history if history is not None else SampleHistory(size)
+
+        # (filtered raw value, timestamp) of the newest sample. Replaced as a
+        # whole so readers never need the lock.
+        self._latest = None
+
+        self._cond = Condition()
+        self.stop_event = Event()
+        self.thread = None
+
+    def start(self):
+        if not self.thread or not self.thread.is_alive():
+            if self.realtime:
+                self._cpu = realtime.choose_cpu()
+                if self._cpu is not None:
+                    try:
+                        realtime.reserve_cpu(self._cpu)
+                    except OSError as e:
+                        print(f"Could not reserve CPU {self._cpu} for the sampler: {e}")
+            self.stop_event.clear()
+            self.thread = Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        if self.realtime:
+            self.realtime_status = realtime.make_realtime(cpu=self._cpu)
+        while not self.stop_event.is_set():
+            try:
+                if self.timed:
+                    value, timestamp = self._read()
+                else:
+                    value, timestamp = self._read(), time.monotonic()
+            except Exception as e:
+                print(f"Error sampling scale: {e}")
+                if metrics.ENABLED:
+                    metrics.SAMPLE_ERRORS.inc()
+                if self.on_error:
+                    self.on_error(e)
+                self.stop_event.wait(self.ERROR_BACKOFF)
+                continue
+            self._append(value, timestamp)
+            pause = self._pause(timestamp)
+            if pause > 0:
+                self.stop_event.wait(pause)
+
+    def _pause(self, timestamp):
+        """Seconds to sleep before the next read.
+
+        Paced from the sample timestamps rather than the configured rate, so
+        an accelerated replay or a backlog in a shared ring is not held up:
+        a sample that is already older than the pause means no sleep.
+        """
+        last, self._last_timestamp = self._last_timestamp, timestamp
+        if not self.pace or last is None:
+            return 0.0
+        if timestamp > last:
+            self._intervals.update(timestamp - last)
+        interval = self._intervals.value
+        if not interval:
+            return 0.0
+        return self.pace * interval - (time.monotonic() - timestamp)
+
+    @property
+    def count(self):
+        """Total number of samples ever written."""
+        return self.history.count
+
+    def _append(self, value, timestamp):
+        filtered = self.chain.update(value)
+
+        with self._cond:
+            self.history.append(value, timestamp, filtered)
+            self._latest = (filtered, timestamp)
+            self._cond.notify_all()
+
+        for listener in self.listeners:
+            try:
+                listener(filtered, timestamp)
+            except Exception as e:
+                print(f"Error in sample listener: {e}")
+
+    def set_chain(self, chain):
+        """Swap in a new filter chain, primed with the buffered samples."""
+        for value, _ in self.recent(self.PRIME_SAMPLES):
+            chain.update(value)
+        self.chain = chain
+
+    def latest(self):
+        """Return (filtered raw value, timestamp) of the newest sample, or None."""
+        return self._latest
+
+    def recent(self, n):
+        """Return up to n of the newest raw samples as (value, timestamp), oldest first."""
+        return self.history.recent(n)
+
+    def since(self, index):
+        """Samples written since the total count was `index`, oldest first."""
+        return self.history.since(index)
+
+    def wait_for_count(self, count, timeout=None):
+        """Block until `count` samples have been written in total; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.count >= count, timeout)
+
+    def wait_for_samples(self, n, timeout=None, sleep=None):
+        """Block until n samples newer than the call have arrived and return them.
+
+        With `sleep` the count is polled with it instead of waiting on the
+        condition, for callers on a green thread that must not block the hub.
+        """
+        if sleep is not None:
+            target = self.count + n
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self.count < target:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"Timed out waiting for {n} scale samples")
+                sleep(self.POLL_INTERVAL)
+            return self.recent(n)
+        with self._cond:
+            target = self.count + n
+            if not self._cond.wait_for(lambda: self.count >= target, timeout):
+                raise TimeoutError(f"Timed out waiting for {n} scale samples")
+        return self.recent(n)
+
+    def wait_for_first(self, timeout=None):
+        with self._cond:
+            self._cond.wait_for(lambda: self._latest is not None, timeout)
+        return self._latest
@@ -1,28 +1,133 @@
-import RPi.GPIO as GPIO
 import time
 import statistics
 import json
 import os
+from collections import namedtuple
 from hx711 import HX711
+from gpio_backends import default_backend
+from sampler import Sampler
+from filters import build_chain, MAD_TO_SIGMA
+from calibration import CalibrationSession
+import metrics
+import realtime
+from shared_history import SCALE_SHM, SharedMemoryHX711
+from hx711_multi import HX711Multi
+
+# A weight estimate in grams, the number of samples behind it and its
+# standard error in grams (None when no fresh sample arrived in time).
+Measurement = namedtuple('Measurement', ['weight', 'samples', 'stderr'])
+
+def measure_sum(scales, resolution=None, deadline=None):
+    """Total weight on several load cells as one Measurement.
+
+    Every cell measures from the samples that arrived since the call, to
+    resolution / sqrt(n) each, so the sum meets `resolution`.
+    """
+    starts = [scale.sampler.count for scale in scales]
+    if resolution is None:
+        resolution = scales[0].RESOLUTION
+    resolution /= len(scales) ** 0.5
+    if deadline is None:
+        deadline = time.monotonic() + scales[0].MEASURE_TIMEOUT
+    parts = [scale.measure(resolution, deadline, since=start)
+             for scale, start in zip(scales, starts)]
+    stderrs = [part.stderr for part in parts]
+    stderr = None if None in stderrs else round(sum(e * e for e in stderrs) ** 0.5, 3)
+    return Measurement(round(sum(part.weight for part in parts), 1),
+                       min(part.samples for part in parts), stderr)
 
 class Scale:
     CALIBRATION_FILE = os.path.join(os.path.dirname(__file__), 'calibration.json')
     NUM_READINGS = 5  # Default number of readings
+    FIRST_SAMPLE_TIMEOUT = 2.0
+    SAMPLE_TIMEOUT = 5.0
+    # Adaptive get_weight(): sample until the standard error is below
+    # RESOLUTION grams or MEASURE_TIMEOUT passes.
+    RESOLUTION = 0.2
+    MEASURE_TIMEOUT = 1.0
+    MAX_SAMPLES = 64
+    NOISE_WINDOW = 32  # Recent samples used to estimate the sensor noise
+    STEP_SIGMAS = 4.0  # A sample this far from the estimate starts a new one
+    # Output rate selected by the board's RATE pin, 10 or 80 SPS.
+    RATE = int(os.environ.get('HX711_RATE', '10'))
+    # One HX711 per load cell, all on the same PD_SCK, e.g. "17,27,23,24"
+    # for a four-corner platform. See create_cells().
+    DOUT_PINS = [int(pin) for pin in os.environ.get('HX711_DOUT_PINS', '17').split(',')]
+    HISTORY_SECONDS = 600  # Samples kept for /samples, about 10 minutes
+    REALTIME = realtime.SAMPLER_REALTIME  # SCHED_FIFO sampler thread, see realtime.py
+    # How the driver waits for a conversion, see HX711.WAIT_MODES. None is
+    # edge where the GPIO backend supports it and poll otherwise;
+    # HX711_WAIT_MODE=spin busy-polls and costs a core.
+    WAIT_MODE = os.environ.get('HX711_WAIT_MODE') or None
+    # Filter chain applied to every sample, see filters.build_chain().
+    FILTERS = [
+        {'type': 'hampel', 'window': 5, 'min_deviation': 400},
+        {'type': 'median', 'window': NUM_READINGS},
+    ]
     DEFAULT_CALIBRATION = {
         'reference_unit': -399.3961653,
         'offset':  626476.6
     }
     
-    def __init__(self, dout_pin=17, pd_sck_pin=22):
+    def __init__(self, dout_pin=17, pd_sck_pin=22, gpio=None, rate=None, shm_name=SCALE_SHM,
+                 multi=None, cell=0, calibration_file=None):
         self.dout_pin = dout_pin
         self.pd_sck_pin = pd_sck_pin
+        self.rate = rate if rate is not None else self.RATE
+        # With multi, this Scale is load cell `cell` of an HX711Multi and
+        # keeps its own calibration file.
+        self.multi = multi
+        self.cell = cell
+        self.calibration_file = calibration_file or self.CALIBRATION_FILE
+        # With shm_name the samples come from scale_daemon.py, which owns the
+        # HX711, and this process never touches its pins.
+        self.shm_name = shm_name
+        if shm_name:
+            self.gpio = None
+        else:
+            self.gpio = gpio if gpio is not None else default_backend()
+        if self.REALTIME and not shm_name:
+            realtime.check_wait_mode(self.WAIT_MODE)
         self.calibration = self._load_calibration()
+        self.calibration_session = None
+        self.recorder = None
+        self.hx = None
+        self.sampler = Sampler(self._read_raw, size=int(self.HISTORY_SECONDS * self.rate),
+                               chain=build_chain(self.FILTERS),
+                               on_error=self._on_sample_error, timed=True,
+                               realtime=self.REALTIME)
+        # Counted per sample, not per request that happens to read it.
+        self.sampler.listeners.append(self._count_out_of_range)
         self.init_scale()
 
+    @classmethod
+    def create_cells(cls, dout_pins=None, pd_sck_pin=22, gpio=None, rate=None):
+        """One Scale per load cell in DOUT_PINS.
+
+        A single pin gives a plain Scale. Several pins share one HX711Multi
+        that reads all cells in one pass; cell i > 0 keeps its calibration in
+        calibration_<i>.json.
+        """
+        if dout_pins is None:
+            dout_pins = cls.DOUT_PINS
+        if len(dout_pins) == 1:
+            return [cls(dout_pins[0], pd_sck_pin, gpio=gpio, rate=rate)]
+        if SCALE_SHM:
+            # scale_daemon.py publishes a single load cell.
+            raise ValueError("SCALE_SHM reads one load cell, but HX711_DOUT_PINS lists %d"
+                             % len(dout_pins))
+        gpio = gpio if gpio is not None else default_backend()
+        multi = HX711Multi(dout_pins, pd_sck_pin, wait_mode=cls.WAIT_MODE, backend=gpio,
+                           rate=rate if rate is not None else cls.RATE)
+        base, ext = os.path.splitext(cls.CALIBRATION_FILE)
+        return [cls(pin, pd_sck_pin, gpio=gpio, rate=rate, multi=multi, cell=i,
+                    calibration_file=cls.CALIBRATION_FILE if i == 0 else '%s_%d%s' % (base, i, ext))
+                for i, pin in enumerate(dout_pins)]
+
     def _load_calibration(self):
         try:
-            if os.path.exists(self.CALIBRATION_FILE):
-                with open(self.CALIBRATION_FILE, 'r') as f:
+            if os.path.exists(self.calibration_file):
+                with open(self.calibration_file, 'r') as f:
                     data = json.load(f)
                     # Validate calibration data
                     if 'reference_unit' in data and 'offset' in data:
@@ -39,84 +144,323 @@ class Scale:
             if calibration_data is None:
                 calibration_data = {
                     'reference_unit': self.hx.get_reference_unit(),
-                    'offset': self.hx.get_offset()
+                    'offset': self.hx.get_offset(),
+                    'quadratic': self.calibration.get('quadratic', 0.0)
                 }
             
             # Ensure the directory exists
-            os.makedirs(os.path.dirname(self.CALIBRATION_FILE), exist_ok=True)
+            os.makedirs(os.path.dirname(self.calibration_file), exist_ok=True)
             
-            with open(self.CALIBRATION_FILE, 'w') as f:
+            with open(self.calibration_file, 'w') as f:
                 json.dump(calibration_data, f, indent=2)
         except Exception as e:
             print(f"Error saving calibration: {e}")
 
     def init_scale(self):
+        self.sampler.stop()
+        if self.hx is not None and metrics.ENABLED:
+            metrics.REINITS.inc('init_scale')
+        self._init_hx()
+        self.sampler.start()
+
+    def _init_hx(self):
         try:
-            self.hx = HX711(self.dout_pin, self.pd_sck_pin)
+            old = self.hx
+            if old is not None:
+                old.close()
+            if self.shm_name:
+                self.hx = SharedMemoryHX711(self.shm_name)
+            elif self.multi is not None:
+                self.hx = self.multi.channel(self.cell)
+            else:
+                self.hx = HX711(self.dout_pin, self.pd_sck_pin, wait_mode=self.WAIT_MODE,
+                                backend=self.gpio, rate=self.rate)
+            if old is not None:
+                # Keep the glitch counters monotonic across re-initialisations.
+                for name in ('conversions_read', 'timing_violations', 'spikes'):
+                    setattr(self.hx, name, getattr(old, name))
             self.hx.set_reference_unit(self.calibration['reference_unit'])
             self.hx.set_offset(self.calibration['offset'])
+            if self.recorder is not None:
+                self.hx.recorder = self.recorder
             self.hx.reset()
             time.sleep(0.1)
         except Exception as e:
             print(f"Error initializing scale: {e}")
             raise
 
-    def get_weight(self, num_readings=None):
+    def set_recorder(self, recorder):
+        """Record every raw sample from now on, see recording.py."""
+        self.recorder = recorder
+        recorder.meta({'calibration': self.calibration, 'rate': self.rate})
+        if self.hx is not None:
+            # The driver records the gain with its first sample.
+            self.hx.recorder = recorder
+
+    def _read_raw(self):
+        return self.hx.read_timed()
+
+    def glitch_stats(self):
+        """Conversions the driver discarded, see HX711.read_timed()."""
+        return self.hx.glitch_stats() if self.hx is not None else None
+
+    @property
+    def measured_sps(self):
+        """Conversion rate the HX711 actually runs at, None until measured."""
+        return self.hx.measured_sps if self.hx is not None else None
+
+    def _on_sample_error(self, error):
+        # Runs on the sampler thread, so only the driver is rebuilt here.
+        if metrics.ENABLED:
+            metrics.REINITS.inc('sample_error')
         try:
-            val = self.hx.get_weight(self.NUM_READINGS)
-            if val is not None and -10000 < val < 10000:  # Basic sanity check
-                return round(val, 1)
-            return 0
+            self._init_hx()
+        except Exception:
+            pass
+
+    def _to_grams(self, raw):
+        """Weight of a raw reading above the calibrated zero."""
+        x = (raw - self.calibration['offset']) / self.hx.get_reference_unit()
+        quadratic = self.calibration.get('quadratic')
+        if quadratic:
+            return x + quadratic * x * x
+        return x
+
+    def _to_weight(self, raw):
+        # Tare is a shift in grams, so the quadratic term stays anchored to
+        # the calibrated zero.
+        if not self.calibration.get('quadratic'):
+            return (raw - self.hx.get_offset()) / self.hx.get_reference_unit()
+        return self._to_grams(raw) - self._to_grams(self.hx.get_offset())
+
+    def _count_out_of_range(self, raw, timestamp):
+        if metrics.ENABLED and not -10000 < self._to_weight(raw) < 10000:  # As latest_weight()
+            metrics.OUT_OF_RANGE.inc()
+
+    def _fresh_raw_average(self, num_readings):
+        samples = self.sampler.wait_for_samples(num_readings, timeout=self.SAMPLE_TIMEOUT)
+        return statistics.median(value for value, _ in samples)
+
+    def add_weight_listener(self, listener):
+        """Call listener(weight, timestamp) for every filtered sample.
+
+        The weight is measured from the calibrated zero, so it does not jump
+        when tare() is called.
+        """
+        def on_sample(raw, timestamp):
+            listener(self._to_grams(raw), timestamp)
+        self.sampler.listeners.append(on_sample)
+
+    def configure_filters(self, spec):
+        """Replace the sample filter chain, e.g. [{'type': 'kalman'}]."""
+        self.sampler.set_chain(build_chain(spec))
+
+    def latest_weight(self):
+        """Newest filtered weight, or None before the first sample. Never blocks."""
+        latest = self.sampler.latest()
+        if latest is None:
+            return None
+        val = self._to_weight(latest[0])
+        if -10000 < val < 10000:  # Basic sanity check
+            return round(val, 1)
+        return 0
+
+    def _noise(self):
+        """Robust per-sample noise in counts, or None without enough history.
+
+        Taken from the differences of consecutive samples, so a load that
+        is slowly drifting or was just changed does not count as noise.
+        """
+        values = [value for value, _ in self.sampler.recent(self.NOISE_WINDOW)]
+        if len(values) < 4:
+            return None
+        diffs = [b - a for a, b in zip(values, values[1:])]
+        center = statistics.median(diffs)
+        mad = statistics.median(abs(d - center) for d in diffs)
+        # The difference of two samples has sqrt(2) times their noise.
+        return max(mad * MAD_TO_SIGMA / 2 ** 0.5, 1.0)
+
+    def measure(self, resolution=None, deadline=None, min_samples=1,
+                max_samples=MAX_SAMPLES, since=None):
+        """Sequentially estimate the weight from fresh samples.
+
+        Takes new samples until the standard error of their mean is below
+        `resolution` grams, `max_samples` were taken, or the monotonic
+        `deadline` passes, and returns a Measurement. A steady scale needs
+        one or two conversions; a sample that jumps away from the estimate
+        (the load changed) restarts it. `since` is the sampler count to take
+        samples after, by default the current one.
+        """
+        if resolution is None:
+            resolution = self.RESOLUTION
+        if deadline is None:
+            deadline = time.monotonic() + self.MEASURE_TIMEOUT
+        scale = abs(self.hx.get_reference_unit())
+        noise = self._noise()
+
+        values = []
+        total = 0.0
+        stderr = None
+        seen = self.sampler.count if since is None else since
+        while len(values) < max_samples:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.sampler.wait_for_count(seen + 1, remaining):
+                break
+            fresh = self.sampler.since(seen)
+            seen += len(fresh)
+            for value, _ in fresh:
+                if (noise is not None and values
+                        and abs(value - total / len(values)) > self.STEP_SIGMAS * noise):
+                    values, total = [], 0.0
+                values.append(value)
+                total += value
+            n = len(values)
+            if noise is not None:
+                sigma = noise
+            elif n > 1:
+                sigma = statistics.stdev(values)
+            else:
+                continue
+            stderr = sigma / scale / n ** 0.5
+            if n >= min_samples and stderr <= resolution:
+                break
+
+        if not values:
+            return Measurement(self.get_cached_weight(), 0, None)
+        weight = self._to_weight(total / len(values))
+        if not -10000 < weight < 10000:  # Basic sanity check
+            weight = 0
+        return Measurement(round(weight, 1), len(values),
+                           round(stderr, 3) if stderr is not None else None)
+
+    def get_cached_weight(self):
+        """Latest filtered weight, waiting for the first sample if needed."""
+        weight = self.latest_weight()
+        if weight is None:
+            self.sampler.wait_for_first(timeout=self.FIRST_SAMPLE_TIMEOUT)
+            weight = self.latest_weight()
+        return weight if weight is not None else 0
+
+    def get_weight(self, num_readings=None, resolution=None, deadline=None):
+        """Weight in grams from fresh samples.
+
+        With num_readings the mean of exactly that many samples, otherwise
+        as many as measure() needs for `resolution`.
+        """
+        try:
+            if num_readings:
+                if deadline is None:
+                    deadline = time.monotonic() + self.SAMPLE_TIMEOUT
+                return self.measure(0.0, deadline, num_readings, num_readings).weight
+            return self.measure(resolution, deadline).weight
         except Exception as e:
             print(f"Error reading weight: {e}")
-            self.init_scale()  # Try reinitializing on error
             return 0
 
     def tare(self):
         try:
-            self.hx.tare(times=10)
-            time.sleep(0.3)  # Small delay for stability
+            # Tare from fresh sampler output instead of clocking the HX711
+            # from this thread.
+            self.hx.set_offset(self._fresh_raw_average(10))
             #self._save_calibration()
         except Exception as e:
             print(f"Error during tare: {e}")
             self.init_scale()
             raise
 
-    def calibrate_with_known_weight(self, known_weight=100.0):
-        try:
-            # Take multiple readings of the known weight
-            val = self.hx.get_weight(self.NUM_READINGS)
-            
-            if val is None or abs(val) < 1 or abs(val) > 10000:
-                raise Exception("Invalid reading during calibration")
+    def calibrate_with_known_weight(self, known_weight=100.0, sleep=None):
+        """Two-point calibration between the current tare and a known weight.
 
-            # Calculate and set new reference unit
-            current_ref = self.hx.get_reference_unit()
-            new_ref = (current_ref * known_weight) / val
-            self.hx.set_reference_unit(new_ref)
-            
-            # Save calibration
-            self._save_calibration()
-            
+        Waits until the weight has been placed and settled, so it neither
+        depends on the previous reference unit nor on a fixed sample count.
+        It only waits for the sampler and does not touch the chip, so it can
+        run on the request thread; `sleep` is as for CalibrationSession.
+        Nothing is applied unless the fit succeeds.
+        """
+        try:
+            session = CalibrationSession(self.sampler, sleep=sleep)
+            session.add_point(0.0, self.hx.get_offset())
+            session.record_point(known_weight)
+            calibration, report = session.fit()
+            self.apply_calibration(calibration)
+            return report
         except Exception as e:
             print(f"Error during calibration: {e}")
-            self.init_scale()
             raise
 
+    def start_calibration(self, quadratic=False, sleep=None):
+        """Begin a multi-point calibration, see calibration.py."""
+        self.calibration_session = CalibrationSession(self.sampler, quadratic=quadratic,
+                                                      sleep=sleep)
+        return self.calibration_session.get_status()
+
+    def record_calibration_point(self, known_weight, timeout=CalibrationSession.POINT_TIMEOUT):
+        """Wait for known_weight to settle on the scale and record its plateau."""
+        if self.calibration_session is None:
+            raise RuntimeError("No calibration in progress")
+        return self.calibration_session.record_point(known_weight, timeout)
+
+    def finish_calibration(self, apply=True):
+        """Fit the recorded points; apply and save the result unless apply is False."""
+        if self.calibration_session is None:
+            raise RuntimeError("No calibration in progress")
+        calibration, report = self.calibration_session.fit()
+        if apply:
+            self.apply_calibration(calibration)
+            self.calibration_session = None
+        report['calibration'] = calibration
+        return report
+
+    def apply_calibration(self, calibration):
+        self.calibration = dict(calibration)
+        self.hx.set_reference_unit(calibration['reference_unit'])
+        self.hx.set_offset(calibration['offset'])
+        self._save_calibration(self.calibration)
+        if self.recorder is not None:
+            self.recorder.meta({'calibration': self.calibration})
+
     def reset_calibration(self):
         try:
             # Reset to default values
             self.hx.set_reference_unit(self.DEFAULT_CALIBRATION['reference_unit'])
             self.hx.set_offset(self.DEFAULT_CALIBRATION['offset'])
+            self.calibration = dict(self.DEFAULT_CALIBRATION)
             self._save_calibration(self.DEFAULT_CALIBRATION)
+            if self.recorder is not None:
+                self.recorder.meta({'calibration': self.calibration})
             self.init_scale()
             return True
         except Exception as e:
             print(f"Error resetting calibration: {e}")
             return False
 
+    def stop(self):
+        """Stop sampling; the pins stay claimed until cleanup()."""
+        self.sampler.stop()
+        if self.gpio is None:
+            self.hx.close()
+
     def cleanup(self):
+        self.stop()
+        if self.gpio is None:
+            return
         try:
-            GPIO.cleanup()
+            self.gpio.cleanup()
         except:
-            pass
\ No newline at end of file
+            pass
+
+    @staticmethod
+    def cleanup_cells(scales):
+        """cleanup() for the Scales of create_cells().
+
+        The cells share one GPIO backend, so every sampler is stopped before
+        the pins are released, once.
+        """
+        for cell in scales:
+            cell.stop()
+        backends = {id(cell.gpio): cell.gpio for cell in scales if cell.gpio is not None}
+        for gpio in backends.values():
+            try:
+                gpio.cleanup()
+            except:
+                pass
\ No newline at end of file
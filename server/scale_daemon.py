@@ -0,0 +1,107 @@
+"""Standalone sampler process that owns the HX711.
+
+Reads the HX711 on its own, without Flask's GIL contention, and publishes
+every sample to a shared-memory ring (see shared_history.py). The web
+server, the text game and analysis tools then read the ring instead of the
+GPIO pins:
+
+    python -m scale_daemon --name hx711
+    SCALE_SHM=hx711 python app.py
+
+The samples are raw counts run through the Scale's default filters. Set
+SAMPLER_REALTIME=1 to run the sampling thread with real-time priority, see
+realtime.py.
+"""
+import argparse
+import signal
+import threading
+
+import realtime
+from filters import build_chain
+from gpio_backends import default_backend
+from hx711 import HX711
+from sampler import Sampler
+from scale import Scale
+from shared_history import SCALE_SHM, SharedSampleHistory
+
+
+class ScaleDaemon:
+    STATS_INTERVAL = 10  # Samples between header updates
+
+    def __init__(self, name, dout_pin=17, pd_sck_pin=22, rate=Scale.RATE,
+                 seconds=Scale.HISTORY_SECONDS, gpio=None):
+        self.dout_pin = dout_pin
+        self.pd_sck_pin = pd_sck_pin
+        self.rate = rate
+        if realtime.SAMPLER_REALTIME:
+            realtime.check_wait_mode(Scale.WAIT_MODE)
+        self.gpio = gpio if gpio is not None else default_backend()
+        self.hx = None
+        self._init_hx()
+        self.ring = SharedSampleHistory.create(name, int(seconds * rate), rate)
+        self.ring.publish_stats(self.hx)
+        self.sampler = Sampler(self._read_raw, chain=build_chain(Scale.FILTERS),
+                               on_error=self._on_sample_error, timed=True,
+                               realtime=realtime.SAMPLER_REALTIME, history=self.ring)
+        self.sampler.listeners.append(self._on_sample)
+
+    def _init_hx(self):
+        old = self.hx
+        if old is not None:
+            old.close()
+        self.hx = HX711(self.dout_pin, self.pd_sck_pin, wait_mode=Scale.WAIT_MODE,
+                        backend=self.gpio, rate=self.rate)
+        if old is not None:
+            for name in ('conversions_read', 'timing_violations', 'spikes'):
+                setattr(self.hx, name, getattr(old, name))
+        self.hx.reset()
+
+    def _read_raw(self):
+        return self.hx.read_timed()
+
+    def _on_sample(self, filtered, timestamp):
+        if self.sampler.count % self.STATS_INTERVAL == 0:
+            self.ring.publish_stats(self.hx)
+
+    def _on_sample_error(self, error):
+        try:
+            self._init_hx()
+        except Exception:
+            pass
+
+    def run(self, stop_event):
+        self.sampler.start()
+        print(f"Publishing HX711 samples to shared memory {self.ring.shm.name}")
+        stop_event.wait()
+
+    def close(self):
+        self.sampler.stop()
+        self.hx.close()
+        self.ring.close()
+        self.gpio.cleanup([self.pd_sck_pin])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish HX711 samples to shared memory")
+    parser.add_argument('--name', default=SCALE_SHM or 'hx711',
+                        help="shared memory block, /dev/shm/<name>")
+    parser.add_argument('--dout', type=int, default=17)
+    parser.add_argument('--pd-sck', type=int, default=22)
+    parser.add_argument('--rate', type=int, default=Scale.RATE)
+    parser.add_argument('--seconds', type=float, default=Scale.HISTORY_SECONDS,
+                        help="history kept in the ring")
+    args = parser.parse_args()
+
+    stop_event = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop_event.set())
+
+    daemon = ScaleDaemon(args.name, args.dout, args.pd_sck, args.rate, args.seconds)
+    try:
+        daemon.run(stop_event)
+    finally:
+        daemon.close()
+
+
+if __name__ == '__main__':
+    main()
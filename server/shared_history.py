@@ -0,0 +1,207 @@
+"""Sample history in shared memory, written by scale_daemon.py.
+
+SharedSampleHistory is a SampleHistory whose counts, timestamps and
+filtered values live in a multiprocessing.shared_memory block, so one
+process can own the HX711 while any number of local processes read its
+samples without touching GPIO. The block is laid out as
+
+    0    header: magic, size, rate, gain, measured_sps, driver counters and
+         the monotonic time of the last update (HEADER)
+    64   seq, uint64
+    128  counts int32[size], times float64[size], filtered float64[size]
+
+There is one writer and no lock. The writer makes seq odd, writes the slot
+of sample seq // 2 and makes it even again, so count is seq // 2 and a
+reader can tell which slots were rewritten while it copied them (see
+SampleHistory.export). Timestamps are CLOCK_MONOTONIC, which all processes
+share. Readers copy with export() or read zero-copy through numpy_views();
+views alias the live ring, so check valid_from() after using them.
+
+SharedMemoryHX711 puts the HX711 driver interface on top of a reader, so the
+Scale and the text game can use the daemon in place of the GPIO pins.
+"""
+import os
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from history import SampleHistory
+from hx711 import HX711, SensorNotReadyError
+
+# Shared memory block the daemon publishes to and consumers read, e.g.
+# 'hx711' for /dev/shm/hx711. Unset means the Scale owns the GPIO pins.
+SCALE_SHM = os.environ.get('SCALE_SHM')
+
+MAGIC = b'HXM1'
+# magic, size, rate, gain, measured_sps, conversions, timing_violations,
+# spikes, updated
+HEADER = struct.Struct('<4sIIIdQQQd')
+SEQ_OFFSET = 64
+DATA_OFFSET = 128
+
+
+def _layout(size):
+    """Byte ranges of the counts, times and filtered arrays."""
+    counts = DATA_OFFSET
+    times = (counts + 4 * size + 7) & ~7
+    filtered = times + 8 * size
+    return (counts, times), (times, filtered), (filtered, filtered + 8 * size)
+
+
+def _attach(name):
+    try:
+        # Python 3.13+: do not let this process unlink the block at exit.
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedSampleHistory(SampleHistory):
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        buf = shm.buf
+        magic, self.size = HEADER.unpack_from(buf)[:2]
+        if magic != MAGIC:
+            raise ValueError("Shared memory %s is not a sample ring" % shm.name)
+        (c0, c1), (t0, t1), (f0, f1) = _layout(self.size)
+        self.counts = buf[c0:c1].cast('i')
+        self.times = buf[t0:t1].cast('d')
+        self.filtered = buf[f0:f1].cast('d')
+        self._seq = buf[SEQ_OFFSET:SEQ_OFFSET + 8].cast('Q')
+
+    @classmethod
+    def create(cls, name, size, rate=0):
+        """Create the block and become its only writer."""
+        if size <= 0:
+            raise ValueError("History size must be at least 1")
+        shm = shared_memory.SharedMemory(name=name, create=True, size=_layout(size)[2][1])
+        HEADER.pack_into(shm.buf, 0, MAGIC, size, rate, 0, 0.0, 0, 0, 0, time.monotonic())
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Read an existing block; FileNotFoundError if the daemon is not running."""
+        return cls(_attach(name), owner=False)
+
+    @property
+    def count(self):
+        return self._seq[0] // 2
+
+    def _written(self):
+        return (self._seq[0] + 1) // 2
+
+    def valid_from(self):
+        """Oldest total index whose slot has not been rewritten yet."""
+        return max(0, self._written() - self.size)
+
+    def append(self, value, timestamp, filtered):
+        seq = self._seq[0]
+        index = (seq // 2) % self.size
+        self._seq[0] = seq + 1
+        self.counts[index] = value
+        self.times[index] = timestamp
+        self.filtered[index] = filtered
+        self._seq[0] = seq + 2
+
+    def publish_stats(self, hx):
+        """Copy the driver's rate, gain and glitch counters into the header."""
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, self.size, hx.rate, hx.get_gain(),
+                         hx.measured_sps or 0.0, hx.conversions_read,
+                         hx.timing_violations, hx.spikes, time.monotonic())
+
+    def stats(self):
+        (_, _, rate, gain, measured_sps, conversions, timing_violations, spikes,
+         updated) = HEADER.unpack_from(self.shm.buf)
+        return {
+            'rate': rate,
+            'gain': gain,
+            'measured_sps': measured_sps or None,
+            'conversions': conversions,
+            'timing_violations': timing_violations,
+            'spikes': spikes,
+            'age': time.monotonic() - updated,
+        }
+
+    def close(self):
+        """Detach, and remove the block if we created it.
+
+        NumPy views from numpy_views() must be gone by now.
+        """
+        for view in (self.counts, self.times, self.filtered, self._seq):
+            view.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedMemoryHX711(HX711):
+    """HX711 stand-in that reads scale_daemon.py's samples instead of GPIO.
+
+    read_timed() returns the daemon's samples in order, skipping ahead if
+    this reader fell more than the ring size behind. Offset, reference
+    unit, tare and the averaging helpers work as on the driver and are
+    local to this reader. The gain is whatever the daemon uses.
+    """
+    POLL_INTERVAL = 0.002  # Seconds between checks for a new sample
+
+    def __init__(self, name=SCALE_SHM, ready_timeout=1.0):
+        self.ring = SharedSampleHistory.attach(name)
+        self.cursor = self.ring.count
+        self.ready_timeout = ready_timeout
+        self.readLock = threading.Lock()
+        self.check_timing = False
+        self.max_delta = None
+        self._init_state()
+        self._refresh_stats()
+
+    def _refresh_stats(self):
+        stats = self.ring.stats()
+        self.rate = stats['rate']
+        self._gain = stats['gain']
+        self._measured_sps = stats['measured_sps']
+        # Driver counters of the daemon, so glitch_stats() reports them.
+        self.conversions_read = stats['conversions']
+        self.timing_violations = stats['timing_violations']
+        self.spikes = stats['spikes']
+
+    def read_timed(self):
+        deadline = time.monotonic() + self.ready_timeout
+        while True:
+            with self.readLock:
+                start, counts, times, _ = self.ring.export(self.cursor, 1)
+                if len(counts):
+                    self.cursor = start + 1
+                    self.last_timestamp = times[0]
+                    self._refresh_stats()
+                    # The daemon's conversions are the rawest this reader sees.
+                    self._record(counts[0], times[0], self._gain)
+                    return self._accept(counts[0], times[0])
+            if time.monotonic() > deadline:
+                raise SensorNotReadyError(
+                    "No sample from the scale daemon within %.1fs" % self.ready_timeout)
+            time.sleep(self.POLL_INTERVAL)
+
+    @property
+    def measured_sps(self):
+        return self._measured_sps
+
+    def get_gain(self):
+        return self._gain
+
+    def set_gain(self, gain):
+        if gain != self._gain:
+            raise ValueError("The scale daemon reads at gain %d" % self._gain)
+
+    def power_down(self):
+        pass
+
+    def power_up(self):
+        pass
+
+    def close(self):
+        self.ring.close()
@@ -0,0 +1,440 @@
+"""Simulated hardware, so the server runs and benchmarks without a Pi.
+
+SimulatedHX711 models the HX711 serial protocol the way the datasheet
+describes it: DOUT goes low when a conversion is ready (10 or 80 SPS), each
+PD_SCK rising edge shifts out one bit of a 24-bit two's-complement word MSB
+first, the 25th-27th pulses select channel/gain for the next conversion, and
+holding PD_SCK high for more than 60us powers the chip down.
+
+The weight on the platform comes from a LoadProfile, which is deterministic
+for a given seed. SimulatedGPIOBackend plugs the chip into the drivers in
+place of RPi.GPIO, and its other pins can be scripted (joystick). FakeCW2015
+answers the battery fuel-gauge I2C transactions.
+
+Select it for the whole process with GPIO_BACKEND=sim. SIM_PROFILE picks the
+load profile: 'empty', 'static', 'drink' (default) or 'party'. SIM_PRESS_PINS
+(comma separated) and SIM_PRESS_INTERVAL script button presses on those pins
+in turn, e.g. to drive the joystick during benchmarks.
+"""
+import bisect
+import os
+import random
+import threading
+import time
+
+from gpio_backends import FALLING, BOTH
+
+# Counts that match Scale.DEFAULT_CALIBRATION, so simulated readings come out
+# in grams without calibrating first.
+DEFAULT_OFFSET = 626476.6
+DEFAULT_REFERENCE_UNIT = -399.3961653
+
+
+class LoadProfile:
+    """Grams on the platform as a function of time since the start.
+
+    Keyframes are (seconds, grams) pairs joined by straight lines; two
+    keyframes at the same time make a step. Noise, linear drift and random
+    spikes are layered on top.
+    """
+
+    def __init__(self, keyframes=None, noise=0.05, drift=0.0,
+                 spike_rate=0.0, spike_size=2000.0, seed=0):
+        self._times = []
+        self._grams = []
+        for t, grams in keyframes or [(0.0, 0.0)]:
+            self.add(t, grams)
+        self.noise = noise            # Standard deviation in grams
+        self.drift = drift            # Grams per second
+        self.spike_rate = spike_rate  # Probability per sample
+        self.spike_size = spike_size  # Grams
+        self._random = random.Random(seed)
+
+    def add(self, t, grams):
+        index = bisect.bisect_right(self._times, t)
+        self._times.insert(index, t)
+        self._grams.insert(index, grams)
+        return self
+
+    def step(self, t, grams):
+        self.add(t, self.base_at(t))
+        return self.add(t, grams)
+
+    def base_at(self, t):
+        """Noise-free load at time t."""
+        index = bisect.bisect_right(self._times, t)
+        if index == 0:
+            return self._grams[0]
+        if index == len(self._times):
+            return self._grams[-1]
+        t0, t1 = self._times[index - 1], self._times[index]
+        g0, g1 = self._grams[index - 1], self._grams[index]
+        return g0 + (g1 - g0) * (t - t0) / (t1 - t0)
+
+    def grams_at(self, t):
+        grams = self.base_at(t) + self.drift * t
+        if self.noise:
+            grams += self._random.gauss(0.0, self.noise)
+        if self.spike_rate and self._random.random() < self.spike_rate:
+            grams += self._random.choice((-1, 1)) * self.spike_size
+        return grams
+
+    @classmethod
+    def static(cls, grams, **kwargs):
+        return cls([(0.0, grams)], **kwargs)
+
+    @classmethod
+    def drink(cls, start=2.0, vessel=350.0, drunk=42.0, hold=4.0, lift=4.0,
+              settle=0.4, **kwargs):
+        """Glass placed, held still, lifted, drunk from and put back.
+
+        Placing and returning ramp over `settle` seconds with a small
+        overshoot, like a glass set down by hand.
+        """
+        profile = cls([(0.0, 0.0)], **kwargs)
+        placed = start + settle
+        profile.add(start, 0.0)
+        profile.add(start + settle * 0.5, vessel * 1.08)
+        profile.add(placed, vessel)
+        lifted = placed + hold
+        profile.add(lifted, vessel)
+        profile.add(lifted + 0.1, 0.0)
+        returned = lifted + lift
+        profile.add(returned, 0.0)
+        profile.add(returned + settle * 0.5, (vessel - drunk) * 1.08)
+        profile.add(returned + settle, vessel - drunk)
+        return profile
+
+    @classmethod
+    def party(cls, rounds=20, period=12.0, seed=0, **kwargs):
+        """Back-to-back drink rounds with varying glasses and sips."""
+        picker = random.Random(seed)
+        profile = cls([(0.0, 0.0)], seed=seed, **kwargs)
+        for i in range(rounds):
+            start = 1.0 + i * period
+            vessel = picker.uniform(250.0, 500.0)
+            drunk = picker.uniform(10.0, 80.0)
+            round_profile = cls.drink(start=start, vessel=vessel, drunk=drunk)
+            for t, grams in zip(round_profile._times[1:], round_profile._grams[1:]):
+                profile.add(t, grams)
+            profile.step(start + period - 1.0, 0.0)
+        return profile
+
+
+PROFILES = {
+    'empty': lambda: LoadProfile.static(0.0),
+    'static': lambda: LoadProfile.static(350.0),
+    'drink': lambda: LoadProfile.drink(),
+    'party': lambda: LoadProfile.party(),
+}
+
+
+class SimulatedHX711:
+    """Protocol-level model of one HX711 on a DOUT/PD_SCK pin pair."""
+    POWER_DOWN_TIME = 60e-6
+    SETTLING_CONVERSIONS = 4
+    # Total PD_SCK pulses per readout -> (channel, gain) of the next conversion.
+    PULSES = {25: ('A', 128), 26: ('B', 32), 27: ('A', 64)}
+
+    def __init__(self, profile=None, rate=10, profile_b=None,
+                 offset=DEFAULT_OFFSET, reference_unit=DEFAULT_REFERENCE_UNIT,
+                 offset_b=0.0, reference_unit_b=100.0,
+                 enforce_power_down=True, clock=time.perf_counter):
+        if rate not in (10, 80):
+            raise ValueError("HX711 rate must be 10 or 80 SPS, got %r" % rate)
+        self.profile = profile if profile is not None else LoadProfile.static(0.0)
+        self.profile_b = profile_b if profile_b is not None else LoadProfile.static(0.0)
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.offset = offset
+        self.reference_unit = reference_unit
+        self.offset_b = offset_b
+        self.reference_unit_b = reference_unit_b
+        self.enforce_power_down = enforce_power_down
+        self.clock = clock
+
+        self.start = clock()
+        self.channel, self.gain = 'A', 128
+        self.powered_down = False
+        self.power_downs = 0
+        self.conversions = 0
+
+        self._clock_high = False
+        self._high_since = 0.0
+        self._pulses = 0
+        self._bit = 1
+        self._data = 0
+        self._ready = False
+        self.next_conversion = self.start + self.period
+
+    def counts_at(self, t, channel, gain):
+        """Signed 24-bit output for a conversion finishing at time t."""
+        if channel == 'B':
+            counts = self.offset_b + self.reference_unit_b * self.profile_b.grams_at(t)
+        else:
+            counts = (self.offset + self.reference_unit * self.profile.grams_at(t)) * gain / 128
+        return max(-0x800000, min(0x7FFFFF, int(round(counts))))
+
+    def _update(self, now):
+        if (self.enforce_power_down and self._clock_high and not self.powered_down
+                and now - self._high_since > self.POWER_DOWN_TIME):
+            self.powered_down = True
+            self.power_downs += 1
+        if self.powered_down:
+            return
+
+        while now >= self.next_conversion:
+            if 0 < self._pulses < 25:
+                # Readout still in progress, the new result is lost.
+                self.next_conversion += self.period
+                continue
+            if self._pulses >= 25:
+                self.channel, self.gain = self.PULSES[min(self._pulses, 27)]
+                self._pulses = 0
+            t = self.next_conversion - self.start
+            self._data = self.counts_at(t, self.channel, self.gain) & 0xFFFFFF
+            self._ready = True
+            self.conversions += 1
+            self.next_conversion += self.period
+
+    def set_clock(self, level):
+        now = self.clock()
+        self._update(now)
+        if level and not self._clock_high:
+            self._clock_high = True
+            self._high_since = now
+            if self.powered_down:
+                return
+            if self._ready or self._pulses:
+                self._ready = False
+                self._pulses += 1
+                if self._pulses <= 24:
+                    self._bit = (self._data >> (24 - self._pulses)) & 1
+                else:
+                    self._bit = 1
+        elif not level and self._clock_high:
+            self._clock_high = False
+            if self.powered_down:
+                # Power up resets to channel A, gain 128 and waits for the
+                # output to settle.
+                self.powered_down = False
+                self.channel, self.gain = 'A', 128
+                self._pulses = 0
+                self._ready = False
+                self.next_conversion = now + self.period * self.SETTLING_CONVERSIONS
+
+    def dout(self):
+        self._update(self.clock())
+        if self.powered_down:
+            return 1
+        if self._pulses:
+            return self._bit
+        return 0 if self._ready else 1
+
+
+class SimulatedGPIOBackend:
+    """GPIO backend wired to simulated chips and scriptable input pins."""
+    name = 'sim'
+    supports_edge = True
+    WATCH_INTERVAL = 0.0005
+
+    def __init__(self):
+        self._levels = {}
+        self._clock_chips = {}
+        self._dout_chips = {}
+        self._callbacks = {}
+        self._last_edge = {}
+        self._watchers = {}
+
+        levels = self._levels
+        clock_chips = self._clock_chips
+        dout_chips = self._dout_chips
+
+        def output(pin, value):
+            # Several chips can share one PD_SCK, see hx711_multi.py.
+            for chip in clock_chips.get(pin, ()):
+                chip.set_clock(value)
+            levels[pin] = 1 if value else 0
+
+        def input(pin):
+            chip = dout_chips.get(pin)
+            if chip is not None:
+                return chip.dout()
+            return levels.get(pin, 0)
+
+        self.output = output
+        self.input = input
+
+    def attach_hx711(self, chip, dout, pd_sck):
+        self._dout_chips[dout] = chip
+        self._clock_chips.setdefault(pd_sck, []).append(chip)
+        return chip
+
+    def setup_output(self, pin):
+        self._levels.setdefault(pin, 0)
+
+    def setup_input(self, pin, pull_up=False):
+        if pin not in self._dout_chips:
+            self._levels[pin] = 1 if pull_up else 0
+
+    def read_levels(self, pins):
+        return [self.input(pin) for pin in pins]
+
+    def set_input(self, pin, level):
+        """Drive a scripted input pin and fire its edge callbacks."""
+        level = 1 if level else 0
+        previous = self._levels.get(pin, 0)
+        self._levels[pin] = level
+        if level == previous or pin not in self._callbacks:
+            return
+        callback, edge, bouncetime = self._callbacks[pin]
+        if edge == BOTH or (edge == FALLING) == (level == 0):
+            now = time.monotonic()
+            if bouncetime and now - self._last_edge.get(pin, -1e9) < bouncetime / 1000.0:
+                return
+            self._last_edge[pin] = now
+            callback(pin)
+
+    def press(self, pin, hold=0.05):
+        """Pull an active-low button pin down for `hold` seconds."""
+        self.set_input(pin, 0)
+        time.sleep(hold)
+        self.set_input(pin, 1)
+
+    def start_presses(self, pins, interval, hold=0.05):
+        """Press the given pins one after another every `interval` seconds."""
+        def run():
+            i = 0
+            while True:
+                time.sleep(max(0.0, interval - hold))
+                self.press(pins[i % len(pins)], hold)
+                i += 1
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def add_event_detect(self, pin, callback, edge=FALLING, bouncetime=None):
+        if pin in self._callbacks:
+            raise RuntimeError("Conflicting edge detection already enabled for GPIO %d" % pin)
+        self._callbacks[pin] = (callback, edge, bouncetime)
+        chip = self._dout_chips.get(pin)
+        if chip is not None and edge in (FALLING, BOTH):
+            stop = threading.Event()
+            thread = threading.Thread(target=self._watch_dout, args=(pin, chip, callback, stop),
+                                      daemon=True)
+            self._watchers[pin] = stop
+            thread.start()
+
+    def _watch_dout(self, pin, chip, callback, stop):
+        # DOUT is computed lazily by the chip model, so announce the falling
+        # edge when the next conversion is due instead of polling the pin.
+        while not stop.is_set():
+            delay = chip.next_conversion - chip.clock()
+            if delay > 0:
+                stop.wait(min(delay, 0.1))
+                continue
+            callback(pin)
+            stop.wait(max(self.WATCH_INTERVAL, chip.period / 2))
+
+    def remove_event_detect(self, pin):
+        self._callbacks.pop(pin, None)
+        stop = self._watchers.pop(pin, None)
+        if stop is not None:
+            stop.set()
+
+    def cleanup(self, pins=None):
+        for pin in list(self._callbacks if pins is None else pins):
+            self.remove_event_detect(pin)
+
+
+class FakeCW2015:
+    """SMBus stand-in answering as a CW2015 fuel gauge at 0x62.
+
+    `voltage` (V) and `capacity` (%) can be set directly; `discharge` is
+    percent per hour and is applied on every read.
+    """
+    ADDRESS = 0x62
+    REG_VCELL = 0x02
+    REG_SOC = 0x04
+    REG_MODE = 0x0A
+
+    def __init__(self, voltage=3.9, capacity=80.0, discharge=0.0, clock=time.monotonic):
+        self.voltage = voltage
+        self.capacity = capacity
+        self.discharge = discharge
+        self.clock = clock
+        self.mode = 0
+        self.transactions = 0
+        self._last = clock()
+
+    def _check(self, address):
+        if address != self.ADDRESS:
+            raise OSError(121, "Remote I/O error")
+        self.transactions += 1
+
+    def _registers(self):
+        now = self.clock()
+        if self.discharge:
+            self.capacity = max(0.0, self.capacity - self.discharge * (now - self._last) / 3600.0)
+        self._last = now
+        vcell = int(round(self.voltage * 1000 / 0.305)) & 0x3FFF
+        soc = int(round(self.capacity * 256))
+        return {
+            self.REG_VCELL: vcell >> 8,
+            self.REG_VCELL + 1: vcell & 0xFF,
+            self.REG_SOC: min(soc >> 8, 0xFF),
+            self.REG_SOC + 1: soc & 0xFF,
+            self.REG_MODE: self.mode,
+        }
+
+    def read_byte_data(self, address, register):
+        self._check(address)
+        return self._registers().get(register, 0)
+
+    def read_word_data(self, address, register):
+        # SMBus words are little endian: the addressed register is the low byte.
+        self._check(address)
+        registers = self._registers()
+        return registers.get(register, 0) | (registers.get(register + 1, 0) << 8)
+
+    def read_i2c_block_data(self, address, register, length):
+        self._check(address)
+        registers = self._registers()
+        return [registers.get(register + i, 0) for i in range(length)]
+
+    def write_byte_data(self, address, register, value):
+        self._check(address)
+        if register == self.REG_MODE:
+            self.mode = value & 0xFF
+
+    def write_word_data(self, address, register, value):
+        self.write_byte_data(address, register, value & 0xFF)
+
+    def close(self):
+        pass
+
+
+def create_sim_backend(dout=17, pd_sck=22, rate=None, profile=None, douts=None):
+    """Backend with one simulated HX711 on the Scale's default pins.
+
+    With HX711_DOUT_PINS listing several pins, one chip sits on each of them,
+    all clocked by the same PD_SCK. Only the first one gets `profile`, the
+    others carry a fresh instance of the SIM_PROFILE load.
+    """
+    if douts is None:
+        douts = [int(pin) for pin in os.environ.get('HX711_DOUT_PINS', str(dout)).split(',')]
+    if rate is None:
+        # SIM_RATE can differ from HX711_RATE to mimic a misconfigured board.
+        rate = int(os.environ.get('SIM_RATE', os.environ.get('HX711_RATE', '10')))
+    make_profile = PROFILES[os.environ.get('SIM_PROFILE', 'drink')]
+    if profile is None:
+        profile = make_profile()
+    backend = SimulatedGPIOBackend()
+    for i, pin in enumerate(douts):
+        backend.attach_hx711(SimulatedHX711(profile if i == 0 else make_profile(), rate=rate),
+                             pin, pd_sck)
+    press_pins = os.environ.get('SIM_PRESS_PINS')
+    if press_pins:
+        pins = [int(pin) for pin in press_pins.split(',')]
+        backend.start_presses(pins, float(os.environ.get('SIM_PRESS_INTERVAL', '0.5')))
+    return backend
@@ -0,0 +1,88 @@
+import os
+import random
+import sys
+import threading
+
+import pytest
+
+# The server modules import each other as top-level modules, as when
+# app.py is run from server/.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hx711 import HX711
+from sampler import Sampler
+from simulation import LoadProfile, SimulatedGPIOBackend, SimulatedHX711
+
+OFFSET = 626476.6
+REFERENCE_UNIT = -399.4
+
+
+def counts(grams):
+    """Raw counts of `grams` on the fake load cells."""
+    return OFFSET + REFERENCE_UNIT * grams
+
+
+class FakeLoad:
+    """Sampler read function: noisy raw counts of whatever `grams` is on it."""
+
+    def __init__(self, grams=0.0, noise=20.0, interval=0.001):
+        self.grams = grams
+        self.noise = noise
+        self.interval = interval
+        self._random = random.Random(1)
+        self._tick = threading.Event()
+
+    def read(self):
+        # About 1000 SPS by default, so a plateau takes a fraction of a second.
+        self._tick.wait(self.interval)
+        return int(round(counts(self.grams) + self._random.gauss(0.0, self.noise)))
+
+
+@pytest.fixture
+def load():
+    """A FakeLoad read back to back by a running Sampler, as (load, sampler)."""
+    load = FakeLoad()
+    sampler = Sampler(load.read, size=512, pace=0)
+    sampler.start()
+    yield load, sampler
+    sampler.stop()
+
+
+class ScriptedHX711(HX711):
+    """HX711 whose conversions come from a list instead of the pins."""
+
+    def __init__(self, values, gain=128):
+        self._values = iter(values)
+        self.GAIN = 1
+        self._violation = False
+        self.max_delta = self.MAX_DELTA
+        self._init_state()
+        self._pending_gain = gain
+
+    def _read_conversion(self, next_gain=None, at=None):
+        self.conversions_read += 1
+        gain, self._pending_gain = self._pending_gain, next_gain or self.get_gain()
+        return next(self._values), float(self.conversions_read), gain
+
+
+@pytest.fixture
+def scripted_hx711():
+    """Factory for an HX711 driver reading the given conversions in turn."""
+    return ScriptedHX711
+
+
+@pytest.fixture(scope='module')
+def sim_hx711():
+    """An HX711 driver on a simulated 80 SPS chip, as (chip, driver).
+
+    Channel A carries 100 g and channel B 50 g, without noise.
+    """
+    dout, pd_sck = 5, 6
+    backend = SimulatedGPIOBackend()
+    chip = SimulatedHX711(LoadProfile.static(100.0, noise=0.0), rate=80,
+                          profile_b=LoadProfile.static(50.0, noise=0.0))
+    backend.attach_hx711(chip, dout, pd_sck)
+    hx = HX711(dout, pd_sck, backend=backend, rate=80)
+    hx.reset()
+    yield chip, hx
+    hx.close()
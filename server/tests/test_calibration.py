@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from calibration import CalibrationError, CalibrationSession, fit_calibration
+from conftest import OFFSET, REFERENCE_UNIT, counts
+
+
+def test_linear_fit_recovers_offset_and_reference_unit():
+    points = [(w, counts(w)) for w in (0.0, 100.0, 500.0, 1000.0)]
+    calibration, report = fit_calibration(points)
+    assert calibration['offset'] == pytest.approx(OFFSET)
+    assert calibration['reference_unit'] == pytest.approx(REFERENCE_UNIT)
+    assert calibration['quadratic'] == 0.0
+    assert report['max_error'] < 1e-6
+
+
+def test_quadratic_fit_recovers_curvature():
+    quadratic = 2e-5
+    xs = [0.0, 200.0, 500.0, 1000.0]
+    points = [(x + quadratic * x * x, OFFSET + REFERENCE_UNIT * x) for x in xs]
+    calibration, report = fit_calibration(points, quadratic=True)
+    assert calibration['offset'] == pytest.approx(OFFSET)
+    assert calibration['reference_unit'] == pytest.approx(REFERENCE_UNIT)
+    assert calibration['quadratic'] == pytest.approx(quadratic)
+    assert report['rms'] < 1e-6
+
+
+def test_fit_needs_distinct_weights():
+    with pytest.raises(CalibrationError):
+        fit_calibration([(100.0, counts(100.0)), (100.0, counts(100.0) + 5)])
+    with pytest.raises(CalibrationError):
+        fit_calibration([(0.0, counts(0.0)), (100.0, counts(100.0))], quadratic=True)
+
+
+@pytest.mark.parametrize('sleep', [None, lambda seconds: threading.Event().wait(seconds)])
+def test_session_records_plateaus_and_fits(load, sleep):
+    load, sampler = load
+    session = CalibrationSession(sampler, sleep=sleep)
+    zero = session.record_point(0.0, timeout=10)
+    assert zero['counts'] == pytest.approx(counts(0.0), abs=20)
+    load.grams = 500.0
+    session.record_point(500.0, timeout=10)
+    calibration, report = session.fit()
+    assert calibration['reference_unit'] == pytest.approx(REFERENCE_UNIT, rel=1e-3)
+    assert calibration['offset'] == pytest.approx(OFFSET, abs=20)
+
+
+def test_session_times_out_without_a_new_weight(load):
+    _, sampler = load
+    session = CalibrationSession(sampler)
+    session.record_point(0.0, timeout=10)
+    with pytest.raises(TimeoutError):
+        session.record_point(200.0, timeout=0.5)
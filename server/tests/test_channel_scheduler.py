@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from channel_scheduler import ChannelScheduler
+
+
+def expected(sim, channel):
+    return sim.counts_at(0.0, channel, 128 if channel == 'A' else 32)
+
+
+def test_interleaved_reads_return_their_channel(sim_hx711):
+    sim, hx = sim_hx711
+    scheduler = ChannelScheduler(hx)
+    values = {'A': [], 'B': []}
+
+    def reader(channel):
+        for _ in range(8):
+            values[channel].append(scheduler.read(channel)[0])
+
+    threads = [threading.Thread(target=reader, args=(c,)) for c in ChannelScheduler.CHANNELS]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for channel in ChannelScheduler.CHANNELS:
+        assert values[channel] == [expected(sim, channel)] * 8
+    assert scheduler.stats()['delivered'] == {'A': 8, 'B': 8}
+
+
+def test_read_at_switches_back_without_a_throwaway(sim_hx711):
+    sim, hx = sim_hx711
+    hx.read_timed()
+    discarded = hx.discarded
+    assert hx.read_at(32, next_gain=128)[0] == expected(sim, 'B')
+    # Switching to B costs one conversion, coming back to A none.
+    assert hx.discarded == discarded + 1
+    assert hx.read_timed()[0] == expected(sim, 'A')
+    assert hx.discarded == discarded + 1
+
+
+def test_unknown_channel_is_rejected(sim_hx711):
+    _, hx = sim_hx711
+    with pytest.raises(ValueError):
+        ChannelScheduler(hx).read('C')
@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+from coalesce import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return 42
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', work)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while flight.executed + flight.coalesced < 5:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [42] * 5
+    assert len(calls) == 1
+    assert (flight.executed, flight.coalesced) == (1, 4)
+
+
+def test_fresh_result_is_reused():
+    flight = SingleFlight(freshness=60.0)
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 1
+    assert flight.do('other', lambda: 3) == 3
+    assert flight.do('key', lambda: 4, freshness=0.0) == 4
+    assert flight.stats()['cached'] == 1
+
+
+def test_errors_are_not_cached():
+    flight = SingleFlight(freshness=60.0)
+
+    def fail():
+        raise RuntimeError('no scale')
+
+    with pytest.raises(RuntimeError):
+        flight.do('key', fail)
+    assert flight.do('key', lambda: 5) == 5
+
+
+def test_stored_results_are_bounded():
+    flight = SingleFlight(freshness=60.0)
+    for i in range(SingleFlight.MAX_RESULTS + 50):
+        flight.do(('cell', i), lambda: i)
+    assert len(flight._results) == SingleFlight.MAX_RESULTS
+    # The newest ones are kept.
+    assert flight.do(('cell', SingleFlight.MAX_RESULTS + 49), lambda: None) is not None
+
+
+def test_expired_results_are_dropped():
+    flight = SingleFlight(freshness=0.01)
+    for i in range(10):
+        flight.do(i, lambda: i)
+    time.sleep(0.02)
+    flight.do('last', lambda: 0)
+    assert list(flight._results) == ['last']
@@ -0,0 +1,89 @@
+from drink_detector import DrinkDetector
+
+RATE = 10  # Samples per second
+
+
+class Stream:
+    def __init__(self, detector):
+        self.detector = detector
+        self.t = 0.0
+
+    def hold(self, grams, seconds):
+        for _ in range(int(seconds * RATE)):
+            self.detector.update(grams, self.t)
+            self.t += 1.0 / RATE
+
+
+def detector_with_events(**kwargs):
+    events = []
+    return DrinkDetector(on_event=events.append, **kwargs), events
+
+
+def states(events):
+    return [event['state'] for event in events]
+
+
+def test_sip_is_detected_with_amount():
+    detector, events = detector_with_events()
+    stream = Stream(detector)
+    stream.hold(2.0, 1.0)      # Empty platform, slightly off zero
+    stream.hold(302.0, 1.0)    # Glass placed
+    stream.hold(2.0, 0.5)      # Lifted
+    stream.hold(252.0, 1.0)    # Back, 50 g lighter
+
+    assert states(events) == ['placed', 'tared', 'lifted', 'returned']
+    assert events[0]['weight'] == 300.0
+    assert events[-1]['drunk'] == 50.0
+    assert detector.get_status() == {'state': 'returned', 'baseline': 250.0, 'result': 50.0}
+
+
+def test_refill_counts_as_a_new_vessel():
+    detector, events = detector_with_events()
+    stream = Stream(detector)
+    stream.hold(0.0, 1.0)
+    stream.hold(300.0, 1.0)
+    stream.hold(0.0, 0.5)
+    stream.hold(400.0, 1.0)
+
+    assert states(events) == ['placed', 'tared', 'lifted', 'placed', 'tared']
+    assert detector.baseline == 400.0
+
+
+def test_vessel_gone_too_long_ends_the_round():
+    detector, events = detector_with_events(max_lift_time=2.0)
+    stream = Stream(detector)
+    stream.hold(0.0, 1.0)
+    stream.hold(300.0, 1.0)
+    stream.hold(0.0, 3.0)
+
+    assert states(events)[-1] == 'idle'
+    assert events[-1]['reason'] == 'timeout'
+    assert detector.get_status()['baseline'] is None
+
+
+def test_unsteady_load_is_not_placed():
+    detector, events = detector_with_events()
+    stream = Stream(detector)
+    stream.hold(0.0, 1.0)
+    for i in range(20):
+        stream.hold(300.0 + (i % 2) * 10, 0.1)
+    assert events == []
+
+
+def test_reset_waits_for_a_vessel_again():
+    detector, _ = detector_with_events()
+    stream = Stream(detector)
+    stream.hold(0.0, 1.0)
+    stream.hold(300.0, 1.0)
+    detector.reset()
+    assert detector.get_status()['state'] == 'idle'
+
+
+def test_on_event_can_read_the_detector():
+    # on_event runs after the lock is released, so it may call back in.
+    seen = []
+    detector = DrinkDetector(on_event=lambda event: seen.append(detector.get_status()['state']))
+    stream = Stream(detector)
+    stream.hold(0.0, 1.0)
+    stream.hold(300.0, 1.0)
+    assert seen == ['tared', 'tared']
@@ -0,0 +1,78 @@
+import pytest
+
+from filters import EMA, FilterChain, Hampel, Kalman1D, RunningMedian, TrimmedMean, build_chain
+
+
+def feed(f, values):
+    return [f.update(v) for v in values]
+
+
+def test_running_median_window():
+    f = RunningMedian(3)
+    assert feed(f, [5, 1, 3, 100, 2]) == [5, 3, 3, 3, 3]
+    assert f.value == 3
+
+
+def test_running_median_even_window_averages_middle():
+    f = RunningMedian(4)
+    assert feed(f, [1, 2, 3, 10])[-1] == 2.5
+
+
+def test_running_median_reset():
+    f = RunningMedian(3)
+    feed(f, [1, 2, 3])
+    f.reset()
+    assert f.value is None
+    assert f.update(7) == 7
+
+
+def test_trimmed_mean_drops_outliers():
+    f = TrimmedMean(window=5, trim=0.2)
+    assert feed(f, [10, 10, 10, 10, 1000])[-1] == 10
+
+
+def test_trimmed_mean_slides():
+    f = TrimmedMean(window=3, trim=0.0)
+    assert feed(f, [3, 6, 9, 12]) == [3, 4.5, 6, 9]
+
+
+def test_trimmed_mean_rejects_bad_trim():
+    with pytest.raises(ValueError):
+        TrimmedMean(trim=0.5)
+
+
+def test_ema_span():
+    f = EMA(span=3)
+    assert feed(f, [0, 10]) == [0, 5]
+
+
+def test_hampel_replaces_spike_but_accepts_step():
+    f = Hampel(window=5, n_sigmas=3.0, min_deviation=1.0)
+    out = feed(f, [100, 101, 100, 99, 100, 5000])
+    assert out[-1] == 100
+    assert f.rejected == 1
+    # A lasting step takes over once it fills half the window.
+    out = feed(f, [200, 200, 200])
+    assert out[-1] == 200
+
+
+def test_kalman_converges():
+    f = Kalman1D(process_variance=0.01, measurement_variance=1.0)
+    for _ in range(200):
+        f.update(50.0)
+    assert f.value == pytest.approx(50.0)
+    assert f.standard_error < 1.0
+
+
+def test_chain_feeds_each_filter_the_previous_output():
+    chain = FilterChain(RunningMedian(3), EMA(alpha=1.0))
+    assert feed(chain, [1, 100, 2]) == [1, 50.5, 2]
+    chain.reset()
+    assert chain.value is None
+
+
+def test_build_chain():
+    chain = build_chain([{'type': 'hampel', 'window': 5}, {'type': 'median', 'window': 3}])
+    assert [type(f) for f in chain.filters] == [Hampel, RunningMedian]
+    with pytest.raises(ValueError):
+        build_chain([{'type': 'nope'}])
@@ -0,0 +1,30 @@
+def read_all(hx, n):
+    return [hx.read_timed()[0] for _ in range(n)]
+
+
+def test_load_ramp_is_kept(scripted_hx711):
+    # A glass set down: 0 to about 378 g over a few conversions.
+    ramp = [0, 0, 0, 40000, 110000, 151000, 151200, 151200]
+    hx = scripted_hx711(ramp)
+    assert read_all(hx, len(ramp)) == ramp
+    assert hx.spikes == 0
+    assert hx.glitch_rate == 0.0
+
+
+def test_single_spike_is_dropped_and_counted(scripted_hx711):
+    hx = scripted_hx711([0, 0, 0, 300000, 0, 0, 0])
+    assert read_all(hx, 6) == [0] * 6
+    assert hx.spikes == 1
+
+
+def test_step_is_confirmed_by_the_next_conversion(scripted_hx711):
+    hx = scripted_hx711([0, 0, 0, 200000, 200010, 200020])
+    assert read_all(hx, 6) == [0, 0, 0, 200000, 200010, 200020]
+    assert hx.spikes == 0
+
+
+
+def test_conversion_at_another_gain_is_discarded(scripted_hx711):
+    hx = scripted_hx711([999, 5, 6], gain=32)
+    assert read_all(hx, 2) == [5, 6]
+    assert hx.discarded == 1
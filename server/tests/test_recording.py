@@ -0,0 +1,69 @@
+import pytest
+
+import recording
+from recording import Recorder, load
+
+
+@pytest.mark.parametrize('n', [0, 1, 63, 64, 127, 128, 2 ** 23, 2 ** 40])
+def test_varint_round_trip(n):
+    out = bytearray()
+    recording._put_varint(out, n)
+    assert recording._get_varint(out, 0) == (n, len(out))
+
+
+@pytest.mark.parametrize('n', [0, 1, -1, 2 ** 23 - 1, -2 ** 23, 2 ** 40, -2 ** 40])
+def test_zigzag_round_trip(n):
+    assert n == recording._unzigzag(recording._zigzag(n))
+    assert recording._zigzag(n) >= 0
+
+
+def write_session(path):
+    recorder = Recorder(str(path))
+    t = recorder.start
+    samples = [(626476, t + 0.1), (626480, t + 0.2), (-8388608, t + 0.3),
+               (8388607, t + 0.4), (0, t + 0.5)]
+    recorder.meta({'calibration': {'offset': 1.5, 'reference_unit': -400.0}}, t)
+    recorder.gain(128, t + 0.05)
+    for value, timestamp in samples[:3]:
+        recorder.sample(value, timestamp)
+    recorder.gain(32, t + 0.35)
+    for value, timestamp in samples[3:]:
+        recorder.sample(value, timestamp)
+    recorder.joystick('up', t + 0.6)
+    recorder.api({'method': 'POST', 'path': '/tare'}, t + 0.7)
+    recorder.close()
+    return recorder, samples
+
+
+def test_record_and_load_round_trip(tmp_path):
+    path = tmp_path / 'session.hxr'
+    recorder, samples = write_session(path)
+    loaded = load(str(path))
+
+    assert list(loaded.counts) == [value for value, _ in samples]
+    assert list(loaded.times) == pytest.approx([t - recorder.start for _, t in samples], abs=1e-6)
+    assert loaded.channels == ['A', 'A', 'A', 'B', 'B']
+    assert loaded.calibration() == {'offset': 1.5, 'reference_unit': -400.0}
+    kinds = [kind for _, kind, _ in loaded.events]
+    assert kinds == [recording.META, recording.GAIN, recording.GAIN,
+                     recording.JOYSTICK, recording.API]
+    assert loaded.events[3][2] == 'up'
+    assert loaded.events[4][2] == {'method': 'POST', 'path': '/tare'}
+    assert loaded.duration == pytest.approx(0.7, abs=1e-6)
+
+
+def test_truncated_last_record_is_ignored(tmp_path):
+    path = tmp_path / 'session.hxr'
+    write_session(path)
+    data = path.read_bytes()
+    path.write_bytes(data[:-3])
+    loaded = load(str(path))
+    assert len(loaded.counts) == 5
+    assert [kind for _, kind, _ in loaded.events][-1] == recording.JOYSTICK
+
+
+def test_recorder_never_overwrites(tmp_path):
+    path = tmp_path / 'session.hxr'
+    write_session(path)
+    with pytest.raises(FileExistsError):
+        Recorder(str(path))
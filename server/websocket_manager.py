@@ -1,21 +1,123 @@
-from flask_socketio import SocketIO
+import time
+from collections import deque
+from flask import request
+from flask_socketio import SocketIO, join_room, leave_room
 from threading import Lock
+from hardware_executor import ASYNC_MODE, GreenNotifier, is_green
+import metrics
 
 class WebSocketManager:
-    def __init__(self):
-        self.socketio = SocketIO()
+    WEIGHT_ROOM = 'weight'
+    DRINK_ROOM = 'drink'
+    BATTERY_ROOM = 'battery'
+    JOYSTICK_ROOM = 'joystick'
+
+    def __init__(self, async_mode=ASYNC_MODE):
+        self.socketio = SocketIO(async_mode=async_mode)
         self._lock = Lock()
-        
+        # room name -> set of subscribed session ids
+        self._rooms = {}
+        # Rooms clients may join; per-cell weight rooms are added with
+        # allow_room().
+        self.rooms = {self.WEIGHT_ROOM, self.DRINK_ROOM, self.BATTERY_ROOM, self.JOYSTICK_ROOM}
+        # In eventlet/gevent modes the hardware threads are real OS threads
+        # that must not touch the hub, so their emits are queued here and
+        # sent by a green task that every enqueue wakes.
+        self.green = is_green(async_mode)
+        self._outbox = deque()
+        self._wake = GreenNotifier(async_mode) if self.green else None
+
     def init_app(self, app):
         self.socketio.init_app(app, cors_allowed_origins="*")
-        
-    def emit_joystick(self, direction):
+        self.socketio.on_event('subscribe', self._subscribe)
+        self.socketio.on_event('unsubscribe', self._unsubscribe)
+        self.socketio.on_event('disconnect', self._disconnect)
+
+    def allow_room(self, room):
+        self.rooms.add(room)
+
+    @classmethod
+    def cell_room(cls, cell):
+        """Room with the weight updates of one load cell."""
+        return '%s:%d' % (cls.WEIGHT_ROOM, cell)
+
+    def _subscribe(self, data):
+        room = (data or {}).get('room')
+        if room not in self.rooms:
+            return
+        join_room(room)
         with self._lock:
-            self.socketio.emit('joystick_event', {'direction': direction})
-            
-    def emit_weight(self, weight):
+            self._rooms.setdefault(room, set()).add(request.sid)
+
+    def _unsubscribe(self, data):
+        room = (data or {}).get('room')
+        if room not in self.rooms:
+            return
+        leave_room(room)
+        with self._lock:
+            self._discard(room, request.sid)
+
+    def _disconnect(self, *args):
         with self._lock:
-            self.socketio.emit('weight_update', {'weight': weight})
-            
+            for room in list(self._rooms):
+                self._discard(room, request.sid)
+
+    def _discard(self, room, sid):
+        # Called with _lock held; empty rooms are dropped.
+        sids = self._rooms.get(room)
+        if sids is None:
+            return
+        sids.discard(sid)
+        if not sids:
+            del self._rooms[room]
+
+    def subscriber_count(self, room):
+        return len(self._rooms.get(room, ()))
+
+    def _emit(self, event, data, to=None):
+        # With /metrics scraped, emits count and time from this call until
+        # Socket.IO has the event, outbox queueing included.
+        start = time.perf_counter() if metrics.ENABLED else None
+        if self.green:
+            self._outbox.append((event, data, to, start))
+            self._wake.notify()
+            return
+        with self._lock:
+            self.socketio.emit(event, data, to=to)
+        if start is not None:
+            self._observe_emit(event, start)
+
+    def _observe_emit(self, event, start):
+        metrics.EMITS.inc(event)
+        metrics.EMIT_LATENCY.observe(time.perf_counter() - start, event)
+
+    def _drain_outbox(self):
+        outbox = self._outbox
+        while True:
+            while outbox:
+                event, data, to, start = outbox.popleft()
+                self.socketio.emit(event, data, to=to)
+                if start is not None:
+                    self._observe_emit(event, start)
+            self._wake.wait()
+
+    def emit_joystick(self, direction):
+        self._emit('joystick_event', {'direction': direction, 'timestamp': time.time()})
+
+    def emit_weight(self, weight, room=WEIGHT_ROOM):
+        self._emit('weight_update', {'weight': weight}, to=room)
+
+    def emit_drink_event(self, event):
+        self._emit('drink_event', event, to=self.DRINK_ROOM)
+
+    def emit_battery(self, status):
+        self._emit('battery_update', status, to=self.BATTERY_ROOM)
+
     def run(self, app, host='0.0.0.0', port=5000):
-        self.socketio.run(app, host=host, port=port)
\ No newline at end of file
+        if self.green:
+            self.socketio.start_background_task(self._drain_outbox)
+            self.socketio.run(app, host=host, port=port)
+        else:
+            # Werkzeug refuses to start without a TTY (e.g. under systemd)
+            # unless told to.
+            self.socketio.run(app, host=host, port=port, allow_unsafe_werkzeug=True)
@@ -0,0 +1,60 @@
+import time
+
+
+class WeightBroadcaster:
+    """Pushes `weight_update` events to clients subscribed to the weight room.
+
+    One producer reads the scale's cached value at EMIT_RATE and only emits
+    when the weight moved by more than HYSTERESIS grams or HEARTBEAT seconds
+    passed since the last emit. Nothing is read or sent while the room is
+    empty.
+    """
+    EMIT_RATE = 10.0  # Checks per second
+    HYSTERESIS = 0.5  # Grams
+    HEARTBEAT = 5.0   # Seconds
+
+    def __init__(self, scale, websocket, emit_rate=EMIT_RATE,
+                 hysteresis=HYSTERESIS, heartbeat=HEARTBEAT, room=None):
+        self.scale = scale
+        self.websocket = websocket
+        self.room = room if room is not None else websocket.WEIGHT_ROOM
+        self.emit_rate = emit_rate
+        self.hysteresis = hysteresis
+        self.heartbeat = heartbeat
+        self._running = False
+        self._last_weight = None
+        self._last_emit = 0.0
+        self._last_subscribers = 0
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.websocket.socketio.start_background_task(self._run)
+
+    def stop(self):
+        self._running = False
+
+    def _run(self):
+        interval = 1.0 / self.emit_rate
+        while self._running:
+            self._tick()
+            self.websocket.socketio.sleep(interval)
+
+    def _tick(self):
+        subscribers = self.websocket.subscriber_count(self.room)
+        joined = subscribers > self._last_subscribers
+        self._last_subscribers = subscribers
+        if not subscribers:
+            return
+
+        weight = self.scale.latest_weight()
+        if weight is None:
+            return
+        now = time.monotonic()
+        # A newly joined client gets the current value right away.
+        if (joined or self._last_weight is None
+                or abs(weight - self._last_weight) >= self.hysteresis
+                or now - self._last_emit >= self.heartbeat):
+            self.websocket.emit_weight(weight, self.room)
+            self._last_weight = weight
+            self._last_emit = now
@@ -1,37 +1,9 @@
-import React, { useState, useEffect } from 'react';
+import React from 'react';
 import { Battery, Plug } from 'lucide-react';
-import { API_BASE_URL } from '../config';
-
-interface BatteryStatus {
-  voltage: number;
-  capacity: number;
-  is_plugged: boolean;
-  is_low: boolean;
-  is_full: boolean;
-}
+import { useBatteryStatus } from '../hooks/useBatteryStatus';
 
 function BatteryStatus() {
-  const [status, setStatus] = useState<BatteryStatus | null>(null);
-  const [error, setError] = useState<string | null>(null);
-
-  useEffect(() => {
-    const fetchBatteryStatus = async () => {
-      try {
-        const response = await fetch(`${API_BASE_URL}/battery`);
-        const data = await response.json();
-        if (data.error) throw new Error(data.error);
-        setStatus(data);
-        setError(null);
-      } catch (err) {
-        setError('Failed to read battery status');
-        console.error('Battery status error:', err);
-      }
-    };
-
-    fetchBatteryStatus();
-    const interval = setInterval(fetchBatteryStatus, 10000);
-    return () => clearInterval(interval);
-  }, []);
+  const { status } = useBatteryStatus();
 
   if (!status) return null;
 
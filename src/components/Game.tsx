@@ -3,6 +3,7 @@ import { useNavigate } from 'react-router-dom';
 import { ArrowLeft, Dice1, Scale, CheckCircle2, AlertTriangle } from 'lucide-react';
 import { useGameState } from '../hooks/useGameState';
 import { useScale } from '../hooks/useScale';
+import { useDrinkEvents } from '../hooks/useDrinkEvents';
 import { loadSettings, updatePlayerStats } from '../utils/storage';
 import { isValidWeight, calculateScore } from '../utils/gameLogic';
 import { NavigationItem } from './NavigationItem';
@@ -25,6 +26,7 @@ function Game() {
   const [roundScore, setRoundScore] = useState({ score: 0, isPerfect: false, deviation: 0 });
   const [isTared, setIsTared] = useState(false);
   const [isRolling, setIsRolling] = useState(false);
+  const [isDrinkArmed, setIsDrinkArmed] = useState(false);
   const totalItems = state.phase === 'rolling' ? 2 : 3; // Back + Roll/Tare + Measure
   useNavigationSetup(totalItems);
 
@@ -39,8 +41,20 @@ function Game() {
 
   useEffect(() => {
     setIsTared(false);
+    setIsDrinkArmed(false);
   }, [state.phase, state.currentPlayerIndex, state.attempts]);
 
+  // The server detects the glass being placed, lifted and put back, so the
+  // round finishes on its own as soon as the glass settles.
+  useDrinkEvents((event) => {
+    if (state.phase !== 'drinking' || showResult) return;
+    if (event.state === 'tared' || event.state === 'lifted') {
+      setIsDrinkArmed(true);
+    } else if (event.state === 'returned' && isDrinkArmed && event.drunk !== undefined) {
+      finishRound(Math.abs(event.drunk));
+    }
+  });
+
   const handleRollClick = () => {
     setIsRolling(true);
     rollDice();
@@ -61,53 +75,57 @@ function Game() {
 
     try {
       const measured = await getWeight(true);
-      const measuredWeight = Math.abs(measured);
-      setWeight(measuredWeight);
-      
-      const settings = loadSettings();
-      const score = calculateScore(measuredWeight, state.targetWeight, settings);
-      setRoundScore(score);
-      
-      const currentPlayer = state.players[state.currentPlayerIndex];
-      const isWin = isValidWeight(measuredWeight, state.targetWeight, state.margin);
-      
-      updatePlayerStats(currentPlayer.name, {
-        score: score.score,
-        deviation: score.deviation,
-        targetWeight: state.targetWeight,
-        actualWeight: measuredWeight,
-        timestamp: Date.now(),
-        isPerfect: score.isPerfect
-      });
-      
-      setShowResult(true);
-      
-      if (isWin) {
-        setTimeout(() => {
-          setShowResult(false);
-          moveToNextPlayer();
-          setWeight(0);
-          setIsTared(false);
-        }, 2000);
-      } else {
-        incrementAttempts();
-        const isLastAttempt = state.attempts + 1 >= state.maxAttempts;
-        
-        setTimeout(() => {
-          setShowResult(false);
-          if (isLastAttempt) {
-            moveToNextPlayer();
-            setWeight(0);
-          }
-          setIsTared(false);
-        }, 2000);
-      }
+      finishRound(Math.abs(measured));
     } catch (error) {
       console.error('Measurement error:', error);
       setIsTared(false);
     }
   };
 
+  const finishRound = (measuredWeight: number) => {
+    setIsDrinkArmed(false);
+    setWeight(measuredWeight);
+
+    const settings = loadSettings();
+    const score = calculateScore(measuredWeight, state.targetWeight, settings);
+    setRoundScore(score);
+    
+    const currentPlayer = state.players[state.currentPlayerIndex];
+    const isWin = isValidWeight(measuredWeight, state.targetWeight, state.margin);
+    
+    updatePlayerStats(currentPlayer.name, {
+      score: score.score,
+      deviation: score.deviation,
+      targetWeight: state.targetWeight,
+      actualWeight: measuredWeight,
+      timestamp: Date.now(),
+      isPerfect: score.isPerfect
+    });
+    
+    setShowResult(true);
+    
+    if (isWin) {
+      setTimeout(() => {
+        setShowResult(false);
+        moveToNextPlayer();
+        setWeight(0);
+        setIsTared(false);
+      }, 2000);
+    } else {
+      incrementAttempts();
+      const isLastAttempt = state.attempts + 1 >= state.maxAttempts;
+      
+      setTimeout(() => {
+        setShowResult(false);
+        if (isLastAttempt) {
+          moveToNextPlayer();
+          setWeight(0);
+        }
+        setIsTared(false);
+      }, 2000);
+    }
+  };
+
   if (state.players.length === 0) {
     return (
       <div className="text-center p-8">
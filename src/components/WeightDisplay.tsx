@@ -1,35 +1,10 @@
-import React, { useState, useEffect } from 'react';
+import React from 'react';
 import { Scale } from 'lucide-react';
-import { useScale } from '../hooks/useScale';
+import { useWeightStream } from '../hooks/useWeightStream';
 
 function WeightDisplay() {
-  const [weight, setWeight] = useState<number | null>(null);
-  const { getWeight } = useScale();
-
-  useEffect(() => {
-    let intervalId: NodeJS.Timeout;
-    let isMounted = true;
-    
-    const updateWeight = async () => {
-      try {
-        const measured = await getWeight(false); // Set priority to false for background updates
-        if (isMounted && measured !== 0) { // Only update if we got a real measurement
-          setWeight(measured);
-        }
-      } catch (error) {
-        console.error('Error reading weight:', error);
-      }
-    };
-
-    // Update weight every 2 seconds
-    updateWeight();
-    intervalId = setInterval(updateWeight, 1000);
-
-    return () => {
-      isMounted = false;
-      clearInterval(intervalId);
-    };
-  }, [getWeight]);
+  // Pushed by the server whenever the weight changes, no polling needed.
+  const weight = useWeightStream();
 
   return (
     <div className="fixed bottom-4 right-4 bg-black/50 backdrop-blur-sm rounded-lg p-3 flex items-center gap-2 text-white/90 shadow-lg">
@@ -41,4 +16,4 @@ function WeightDisplay() {
   );
 }
 
-export default WeightDisplay;
\ No newline at end of file
+export default WeightDisplay;
@@ -0,0 +1,54 @@
+import { useState, useEffect } from 'react';
+import { io } from 'socket.io-client';
+import { API_BASE_URL } from '../config';
+
+const BATTERY_ROOM = 'battery';
+
+export interface BatteryStatus {
+  voltage: number;
+  capacity: number;
+  is_plugged: boolean;
+  is_low: boolean;
+  is_full: boolean;
+}
+
+export function useBatteryStatus() {
+  const [status, setStatus] = useState<BatteryStatus | null>(null);
+  const [error, setError] = useState<string | null>(null);
+
+  useEffect(() => {
+    const socket = io(API_BASE_URL);
+
+    // The server only pushes changes, so fetch the cached status once per
+    // (re)connect and then follow the battery room.
+    const fetchBatteryStatus = async () => {
+      try {
+        const response = await fetch(`${API_BASE_URL}/battery`);
+        const data = await response.json();
+        if (data.error) throw new Error(data.error);
+        setStatus(data);
+        setError(null);
+      } catch (err) {
+        setError('Failed to read battery status');
+        console.error('Battery status error:', err);
+      }
+    };
+
+    socket.on('connect', () => {
+      socket.emit('subscribe', { room: BATTERY_ROOM });
+      fetchBatteryStatus();
+    });
+
+    socket.on('battery_update', (data: BatteryStatus) => {
+      setStatus(data);
+      setError(null);
+    });
+
+    return () => {
+      socket.emit('unsubscribe', { room: BATTERY_ROOM });
+      socket.close();
+    };
+  }, []);
+
+  return { status, error };
+}
@@ -0,0 +1,41 @@
+import { useEffect, useRef } from 'react';
+import { io } from 'socket.io-client';
+import { API_BASE_URL } from '../config';
+
+const DRINK_ROOM = 'drink';
+
+export type DrinkState = 'idle' | 'placed' | 'tared' | 'lifted' | 'returned';
+
+export interface DrinkEvent {
+  state: DrinkState;
+  timestamp: number;
+  time: number;
+  weight?: number;
+  baseline?: number;
+  drunk?: number;
+  duration?: number;
+  reason?: string;
+}
+
+export function useDrinkEvents(onEvent: (event: DrinkEvent) => void) {
+  // Keep the latest callback without reconnecting on every render.
+  const callbackRef = useRef(onEvent);
+  callbackRef.current = onEvent;
+
+  useEffect(() => {
+    const socket = io(API_BASE_URL);
+
+    socket.on('connect', () => {
+      socket.emit('subscribe', { room: DRINK_ROOM });
+    });
+
+    socket.on('drink_event', (event: DrinkEvent) => {
+      callbackRef.current(event);
+    });
+
+    return () => {
+      socket.emit('unsubscribe', { room: DRINK_ROOM });
+      socket.close();
+    };
+  }, []);
+}
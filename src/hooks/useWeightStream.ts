@@ -0,0 +1,29 @@
+import { useState, useEffect } from 'react';
+import { io } from 'socket.io-client';
+import { API_BASE_URL } from '../config';
+
+const WEIGHT_ROOM = 'weight';
+
+export function useWeightStream() {
+  const [weight, setWeight] = useState<number | null>(null);
+
+  useEffect(() => {
+    const socket = io(API_BASE_URL);
+
+    // Re-subscribe on every (re)connect, the server forgets rooms on disconnect.
+    socket.on('connect', () => {
+      socket.emit('subscribe', { room: WEIGHT_ROOM });
+    });
+
+    socket.on('weight_update', (data: { weight: number }) => {
+      setWeight(data.weight);
+    });
+
+    return () => {
+      socket.emit('unsubscribe', { room: WEIGHT_ROOM });
+      socket.close();
+    };
+  }, []);
+
+  return weight;
+}
@@ -8,7 +8,9 @@ class GameConf:
 
         self.settings = {"delta_max":2,
                          "retry_max":3,
-                         "rounds_max":10
+                         "rounds_max":10,
+                         "weight_window":16,  # Recent samples kept per round
+                         "tare_samples":5     # Recent samples averaged for tare
                          }
 
         self.players = ["Lennart", "Lars", "Martin"]
\ No newline at end of file
@@ -364,7 +364,7 @@ class HX711:
 
 
     def get_reference_unit(self):
-        return get_reference_unit_A()
+        return self.get_reference_unit_A()
 
         
     def get_reference_unit_A(self):
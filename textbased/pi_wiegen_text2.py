@@ -1,21 +1,41 @@
 from config import GameConf as game_conf
 from subfunctions import Game as game
+from subfunctions import KeyboardReader, weight_stream
 import json
-import time
+import os
 import sys
-import RPi.GPIO as GPIO
-from hx711 import HX711
-import numpy as np
 
 
 game_conf = game_conf()
 game = game()
 
+# Read the samples of server/scale_daemon.py from this shared memory block
+# instead of clocking the HX711 ourselves, e.g. SCALE_SHM=hx711.
+SCALE_SHM = os.environ.get('SCALE_SHM')
 
 
-def main():
+def open_scale():
+    if SCALE_SHM:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+        from shared_history import SharedMemoryHX711
+        return SharedMemoryHX711(SCALE_SHM)
+    from hx711 import HX711
     hx = HX711(17, 22)
     hx.set_reading_format("MSB", "MSB")
+    return hx
+
+
+def close_scale(hx):
+    # Only the direct-hardware mode owns the pins; the daemon keeps its own.
+    if SCALE_SHM:
+        hx.close()
+        return
+    import RPi.GPIO as GPIO
+    GPIO.cleanup()
+
+
+def main():
+    hx = open_scale()
     referenceUnit = -320795.0 / 803.2
     hx.set_reference_unit(referenceUnit)
     hx.reset()
@@ -30,6 +50,11 @@ def main():
         player = input(f'Player {len(players) + 1}: ').strip()
         if player != '': players.append(player)
         else: break
+
+    # From here on stdin is read on a background thread and the scale is
+    # sampled continuously.
+    keyboard = KeyboardReader()
+    samples = weight_stream(hx)
     for player in players:
         if player not in player_data:
             print(f'Added {player} to database')
@@ -42,37 +67,25 @@ def main():
             won = False
             for retry in range(game_conf.settings["retry_max"]):
                 weight_result = None
-                weights = []
-                tare = False
-                drink = False
-                start_time = time.time()
+                round_state = game.new_round()
                 print(player)
                 round_score = {}
                 dice_result = game.get_dice_result()
                 print(f'Dice: {dice_result}')
                 print('Place drink to tare')
+                keyboard.clear()
                 while weight_result is None:
                     try:
-                        weight = hx.get_weight(1)
-                        weights.append(weight)
+                        weight = next(samples)
                         sys.stdout.write(f"\r{weight:6.1f}g")
                         sys.stdout.flush()
 
-                        if len(weights) > 3 and not tare and weight > 100 and round(weights[-1]) == round(weights[-2]):
-                            input()
-                            hx.tare()
-                            print('\nTare finished. Drink now!')
-                            tare = True
-                        if tare and not drink and weights[-1] < -10 and round(weights[-1]) == round(weights[-2]):
-                            drink = True
-                            weight_bottle = weight
-                            print('\ndrinking...')
-                        if drink and tare and weights[-1] > weight_bottle + 5 and round(weights[-1], 1) == round(
-                                weights[-2], 1):
-                            weight_result = abs(weight)
-                            # print(f'You drank {round(weight_result,1)}g')
+                        # Enter is read on its own thread, the sample stream
+                        # keeps running while we wait for it.
+                        confirmed = keyboard.poll() is not None
+                        weight_result = game.round_update(round_state, weight, hx, confirmed)
                     except (KeyboardInterrupt, SystemExit):
-                        GPIO.cleanup()
+                        close_scale(hx)
                         print("[INFO] 'KeyboardInterrupt Exception' detected. Cleaning and exiting...")
                         sys.exit()
 
@@ -1,11 +1,44 @@
 import random
+import queue
+import sys
+import threading
+from collections import deque
 from config import GameConf as game_conf
-import time
 
 game_conf = game_conf()
 
 
 
+def weight_stream(hx):
+    """Endless stream of single-conversion weights, one per HX711 sample."""
+    while True:
+        yield hx.get_weight(1)
+
+
+class KeyboardReader:
+    """Reads stdin lines on a background thread, so sampling never waits on input()."""
+
+    def __init__(self):
+        self.lines = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        for line in sys.stdin:
+            self.lines.put(line.strip())
+
+    def poll(self):
+        """Return the next entered line, or None if nothing was entered."""
+        try:
+            return self.lines.get_nowait()
+        except queue.Empty:
+            return None
+
+    def clear(self):
+        while self.poll() is not None:
+            pass
+
+
 class Game:
     def roll_dice(self):
         return random.randint(1,6)
@@ -23,23 +56,64 @@ class Game:
             score = round(10+0.1*dice_res*abs(1/(max((weight_res-dice_res),0.1))),0)
         return score
 
-    def round_tare(self, weights, tare, hx, input_required=True):
-        if len(weights) > 3 and not tare and weights[-1] > 100 and round(weights[-1]) == round(weights[-2]):
-            hx.tare()
-            time.sleep(0.2)
-            print('\nTare finished. Drink now!')
-            tare = True
-        return tare
-    
+    def new_round(self):
+        """State of one drinking attempt, updated sample by sample by round_update()."""
+        return {"weights": deque(maxlen=game_conf.settings["weight_window"]),
+                "tare": False,
+                "tare_prompted": False,
+                # Enter pressed and not used for a tare yet.
+                "confirmed": False,
+                "drink": False,
+                "weight_bottle": None,
+                "weight_result": None}
+
+    def round_update(self, state, weight, hx, confirmed=False):
+        """Feed one sample into the round; returns the drunk weight once it is known."""
+        weights = state["weights"]
+        weights.append(weight)
+        if confirmed:
+            # Kept until a stable sample can use it, like a blocking input().
+            state["confirmed"] = True
+        if len(weights) < 2:
+            return None
+        state["tare"] = self.round_tare(state, hx)
+        if len(weights) < 2:
+            # Just tared, the buffered samples were taken before the tare.
+            return None
+        state["drink"], state["weight_bottle"] = self.round_drink(
+            weights, state["drink"], state["tare"], state["weight_bottle"])
+        state["weight_result"] = self.round_weight_result(
+            weights, state["weight_result"], state["drink"], state["tare"], state["weight_bottle"])
+        return state["weight_result"]
+
+    def round_tare(self, state, hx):
+        weights = state["weights"]
+        if state["tare"]:
+            return True
+        if len(weights) > 3 and weights[-1] > 100 and round(weights[-1]) == round(weights[-2]):
+            if not state["tare_prompted"]:
+                print('\nPress Enter to tare')
+                state["tare_prompted"] = True
+            if state["confirmed"]:
+                state["confirmed"] = False
+                # Tare from samples already taken instead of stopping the
+                # stream for hx.tare().
+                recent = list(weights)[-game_conf.settings["tare_samples"]:]
+                mean = sum(recent) / len(recent)
+                hx.set_offset(hx.get_offset() + mean * hx.get_reference_unit())
+                weights.clear()
+                print('\nTare finished. Drink now!')
+                return True
+        return False
+
     def round_drink(self, weights, drink, tare, weight_bottle):
         if tare and not drink and weights[-1] < -10 and round(weights[-1]) == round(weights[-2]):
             drink = True
-            #weight_bottle = weights[-1]
             print('\ndrinking...')
             weight_bottle = weights[-1]
         return drink, weight_bottle
     
-    def round_weight_result(self, weights, weight_result, drink, tare,weight_bottle,input_required=True):
+    def round_weight_result(self, weights, weight_result, drink, tare,weight_bottle):
         if weight_bottle is not None:
             if drink and tare and weights[-1] > weight_bottle + 5 and round(weights[-1], 1) == round(
                     weights[-2], 1):